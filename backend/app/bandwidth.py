@@ -0,0 +1,134 @@
+"""
+Fair-share bandwidth broker for download tasks. Each running download registers in Redis with its user's
+weight and its recent demand; every task derives its own share of BANDWIDTH_GLOBAL_CAP from the live
+registrations, so no coordinator process is needed. A user's weight is split across that user's tasks,
+and bandwidth a task is not using is handed to the others (max-min fairness).
+"""
+from typing import Dict, Optional
+import asyncio
+import json
+import time
+from app.config import settings
+from app.redis_client import get_redis
+
+TASKS_KEY = "superapp:bandwidth:tasks"
+WEIGHTS_KEY = "superapp:bandwidth:weights"
+HEADROOM = 2.0  # a task may grow to twice its measured rate per refresh
+
+async def get_user_weight(user_id: Optional[int]) -> float:
+    if user_id is None: return 1.0
+    value = await get_redis().hget(WEIGHTS_KEY, str(user_id))
+    return float(value) if value else 1.0
+
+async def set_user_weight(user_id: int, weight: float):
+    await get_redis().hset(WEIGHTS_KEY, str(user_id), weight)
+
+async def read_user_weights() -> Dict[str, float]:
+    return {k: float(v) for k, v in (await get_redis().hgetall(WEIGHTS_KEY)).items()}
+
+def compute_shares(entries: Dict[str, dict], cap: int) -> Dict[str, int]:
+    """
+    Water-filling: split `cap` by weight, cap tasks that use less than their split at HEADROOM x their
+    demand (never below BANDWIDTH_MIN_SHARE), and share what they leave among the rest.
+    """
+    per_user: Dict[str, int] = {}
+    for entry in entries.values(): per_user[entry['user_id']] = per_user.get(entry['user_id'], 0) + 1
+    active = {tid: entry['weight'] / per_user[entry['user_id']] for tid, entry in entries.items()}
+    shares: Dict[str, float] = {}
+    remaining = float(cap)
+    while active:
+        total = sum(active.values()) or 1.0
+        fair = {tid: remaining * w / total for tid, w in active.items()}
+        limited = {}
+        for tid in active:
+            demand = entries[tid].get('demand')
+            if demand is None: continue  # no measurement yet: assume it can use a full share
+            want = max(demand * HEADROOM, settings.BANDWIDTH_MIN_SHARE)
+            if want < fair[tid]: limited[tid] = want
+        if not limited:
+            shares.update(fair); break
+        for tid, want in limited.items():
+            shares[tid] = want; remaining -= want; del active[tid]
+    return {tid: int(share) for tid, share in shares.items()}
+
+async def read_registrations(max_age: float = None) -> Dict[str, dict]:
+    """Live registrations; entries whose heartbeat is older than max_age are removed."""
+    max_age = max_age or settings.BANDWIDTH_REFRESH_SECONDS * 3
+    r = get_redis()
+    now = time.time(); entries = {}; stale = []
+    for tid, payload in (await r.hgetall(TASKS_KEY)).items():
+        entry = json.loads(payload)
+        if now - entry['heartbeat'] > max_age: stale.append(tid)
+        else: entries[tid] = entry
+    if stale: await r.hdel(TASKS_KEY, *stale)
+    return entries
+
+async def read_allocations() -> dict:
+    entries = await read_registrations()
+    shares = compute_shares(entries, settings.BANDWIDTH_GLOBAL_CAP) if settings.BANDWIDTH_GLOBAL_CAP > 0 else {}
+    return {
+        'cap_bytes_per_sec': settings.BANDWIDTH_GLOBAL_CAP,
+        'tasks': [{'task_id': tid, 'user_id': e['user_id'], 'weight': e['weight'], 'demand_bytes_per_sec': e.get('demand'),
+                   'share_bytes_per_sec': shares.get(tid)} for tid, e in entries.items()],
+    }
+
+class BandwidthLease:
+    """A download task's registration with the broker plus a local token bucket paced at its current share."""
+    def __init__(self, task_id: str, user_id: Optional[int]):
+        self.task_id = task_id
+        self.user_id = str(user_id) if user_id is not None else 'anonymous'
+        self.enabled = settings.BANDWIDTH_GLOBAL_CAP > 0
+        self.weight = 1.0
+        self.rate = settings.BANDWIDTH_GLOBAL_CAP
+        self.active_tasks = 1
+        self._tokens = 0.0
+        self._last = time.monotonic()
+        self._consumed = 0
+        self._demand: Optional[int] = None
+        self._refresher: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if not self.enabled: return
+        try:
+            self.weight = await get_user_weight(int(self.user_id) if self.user_id.isdigit() else None)
+            await self._refresh()
+        except Exception as e: print(f"[BANDWIDTH] Registration failed for {self.task_id}: {e}")
+        self._refresher = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._refresher: self._refresher.cancel()
+        if not self.enabled: return
+        try: await get_redis().hdel(TASKS_KEY, self.task_id)
+        except Exception as e: print(f"[BANDWIDTH] Could not unregister {self.task_id}: {e}")
+
+    async def _refresh(self):
+        entry = {'user_id': self.user_id, 'weight': self.weight, 'demand': self._demand, 'heartbeat': time.time()}
+        await get_redis().hset(TASKS_KEY, self.task_id, json.dumps(entry))
+        entries = await read_registrations()
+        entries[self.task_id] = entry
+        self.rate = max(compute_shares(entries, settings.BANDWIDTH_GLOBAL_CAP).get(self.task_id, 0), settings.BANDWIDTH_MIN_SHARE)
+        self.active_tasks = len(entries)
+
+    async def _refresh_loop(self):
+        interval = settings.BANDWIDTH_REFRESH_SECONDS
+        while True:
+            await asyncio.sleep(interval)
+            self._demand = int(self._consumed / interval); self._consumed = 0
+            try:
+                self.weight = await get_user_weight(int(self.user_id) if self.user_id.isdigit() else None)
+                await self._refresh()
+            except Exception as e: print(f"[BANDWIDTH] Refresh failed for {self.task_id}: {e}")
+
+    async def consume(self, nbytes: int):
+        """Waits until `nbytes` fit the task's share; at most one second of share accumulates while idle."""
+        if not self.enabled: return
+        self._consumed += nbytes
+        now = time.monotonic()
+        self._tokens = min(self.rate, self._tokens + (now - self._last) * self.rate) - nbytes
+        self._last = now
+        if self._tokens < 0: await asyncio.sleep(-self._tokens / self.rate)
+
+    def snapshot(self) -> dict:
+        if not self.enabled: return {'enabled': False}
+        return {'enabled': True, 'share_bytes_per_sec': self.rate, 'weight': self.weight, 'active_tasks': self.active_tasks,
+                'cap_bytes_per_sec': settings.BANDWIDTH_GLOBAL_CAP}
@@ -1,103 +1,378 @@
 from celery import Celery
+from celery.signals import worker_process_init, worker_process_shutdown
 from app.config import settings
 from app.storage_service import StorageManager
 from app.auth import decrypt_session_string
-from pyrogram import Client
+from app.client_pool import TelegramClientPool
+from app.worker_db import worker_db, DumpedMessageWriter
+from app.telegram_history import iter_history_window, iter_media_search
+from app.rate_limiter import rate_limiter
+from app.media_stream import CHUNK_SIZE, is_archive, iter_media_chunks, iter_media_segments, stream_to_storage, describe_media
+from app.progress import ProgressReporter
+from app.redis_client import get_redis
+from app.bandwidth import BandwidthLease
+from pyrogram.errors import FloodWait, RPCError
 from datetime import datetime, timezone
+from collections import deque
 import asyncio
 import os
 import random
 import mimetypes
-import asyncpg
-import shutil
+import hashlib
 import json
 import re
+import signal
+import threading
+import time
 
 celery_app = Celery("superapp", broker=settings.REDIS_URL, backend=settings.REDIS_URL)
-celery_app.conf.update(task_serializer="json", accept_content=["json"], result_serializer="json", timezone="UTC", enable_utc=True)
+celery_app.conf.update(task_serializer="json", accept_content=["json"], result_serializer="json", timezone="UTC", enable_utc=True,
+                       # one reserved task per process, so the fair dispatcher (app/dispatcher.py) decides what runs next
+                       worker_prefetch_multiplier=1)
+
+_worker_loop = None
+
+def get_worker_loop():
+    """One event loop per worker process, kept running in a background thread so pooled clients stay warm between tasks."""
+    global _worker_loop
+    if _worker_loop is None or _worker_loop.is_closed():
+        _worker_loop = asyncio.new_event_loop()
+        threading.Thread(target=_worker_loop.run_forever, name="worker-event-loop", daemon=True).start()
+    return _worker_loop
+
+_running_task = None
+
+async def _track_running(coro):
+    global _running_task
+    _running_task = asyncio.current_task()
+    try: return await coro
+    finally: _running_task = None
+
+def run_async(coro):
+    return asyncio.run_coroutine_threadsafe(_track_running(coro), get_worker_loop()).result()
+
+@worker_process_init.connect
+def install_revoke_handler(**kwargs):
+    """
+    revoke(terminate=True) SIGTERMs the pool process. Cancel the running coroutine first and
+    give its cleanup (buffered DB writes, task status) a grace period before exiting.
+    """
+    def on_sigterm(signum, frame):
+        task, loop = _running_task, _worker_loop
+        if task is not None and loop is not None and loop.is_running():
+            finished = threading.Event()
+            def cancel():
+                if task.done(): finished.set(); return
+                task.add_done_callback(lambda _: finished.set())
+                task.cancel()
+            loop.call_soon_threadsafe(cancel)
+            finished.wait(timeout=settings.WORKER_SHUTDOWN_GRACE)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        os.kill(os.getpid(), signal.SIGTERM)
+    signal.signal(signal.SIGTERM, on_sigterm)
+
+class BoundTask:
+    """
+    Carries the Celery request id into the worker loop thread, where task.request is not populated.
+    Progress goes to Redis pub/sub, coalesced; the result backend only sees the final state.
+    """
+    def __init__(self, task):
+        self.task = task
+        self.request_id = task.request.id
+        self.progress = None
+
+    def update_state(self, state=None, meta=None):
+        self.progress.update(state, meta)
+
+    async def run(self, process, *args):
+        self.progress = ProgressReporter(self.request_id)
+        try: result = await process(self, *args)
+        except asyncio.CancelledError:
+            await self.progress.finish('REVOKED', {'status': 'cancelled'})
+            raise
+        except Exception as e:
+            await self.progress.finish('FAILURE', {'error': str(e)})
+            raise
+        await self.progress.finish('SUCCESS', result)
+        return result
+
+def run_task(task, process, *args):
+    return run_async(BoundTask(task).run(process, *args))
 
 async def run_in_thread(func, *args, **kwargs):
     loop = asyncio.get_running_loop()
     return await loop.run_in_executor(None, lambda: func(*args, **kwargs))
 
-async def get_db_connection():
-    dsn = settings.DATABASE_URL.replace("postgresql+asyncpg://", "postgresql://")
-    return await asyncpg.connect(dsn)
-
 async def get_session_string_safe(session_id: int):
-    conn = None
     try:
-        conn = await get_db_connection()
-        row = await conn.fetchrow('SELECT session_string, api_id, api_hash FROM telegram_sessions WHERE id = $1', session_id)
+        async with worker_db.acquire() as conn:
+            row = await worker_db.fetchrow(conn, 'session_credentials', session_id)
         if row: return decrypt_session_string(row['session_string']), row['api_id'], row['api_hash']
         return None, None, None
     except Exception as e:
         print(f"DB Error in Worker: {e}")
         return None, None, None
-    finally:
-        if conn:
-            await conn.close()
 
-async def save_file_metadata(session_id, chat_id, chat_name, message_id, file_name, file_path, file_type, file_size):
-    conn = None
+async def save_file_metadata(session_id, chat_id, chat_name, message_id, file_name, file_path, file_type, file_size, file_unique_id=None):
+    await save_file_metadata_batch([(session_id, chat_id, chat_name, message_id, file_name, file_path, file_type, file_size, file_unique_id)])
+
+async def save_file_metadata_batch(rows):
+    """
+    Writes downloaded_files rows and returns the ones that were written. executemany is all-or-nothing,
+    so a failed batch is retried row by row and only the rows that fail on their own are left out.
+    """
+    if not rows: return []
+    now = datetime.utcnow()
+    records = [(sid, str(cid), cname, mid, fname, fpath, ftype, fsize, fuid, now) for sid, cid, cname, mid, fname, fpath, ftype, fsize, fuid in rows]
     try:
-        conn = await get_db_connection()
-        await conn.execute('''
-            INSERT INTO downloaded_files (session_id, chat_id, chat_name, message_id, file_name, file_path, file_type, file_size, created_at)
-            VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
-            ON CONFLICT (file_path) DO NOTHING
-        ''', session_id, str(chat_id), chat_name, message_id, file_name, file_path, file_type, file_size, datetime.utcnow())
-    except Exception as e: print(f"Error saving metadata: {e}")
-    finally: 
-        if conn: await conn.close()
-
-async def save_dumped_message(session_id, chat_id, chat_name, msg):
-    conn = None
+        async with worker_db.acquire() as conn:
+            await worker_db.run_many(conn, 'insert_file', records)
+        return list(rows)
+    except Exception as e: print(f"Error saving metadata batch of {len(rows)}, retrying row by row: {e}")
+    written = []
+    for row, record in zip(rows, records):
+        try:
+            async with worker_db.acquire() as conn:
+                await worker_db.run(conn, 'insert_file', *record)
+            written.append(row)
+        except Exception as e: print(f"Error saving metadata for {row[5]}: {e}")
+    return written
+
+async def find_media_object(file_unique_id):
+    """Returns (object_name, file_size) of an already stored copy of this Telegram file, if any."""
+    if not file_unique_id: return None
     try:
-        conn = await get_db_connection()
-        media_type = None
-        if msg.photo: media_type = 'photo'
-        elif msg.video: media_type = 'video'
-        elif msg.document: media_type = 'document'
-        
-        content = msg.text or msg.caption or ""
-        sender_id = str(msg.from_user.id) if msg.from_user else str(msg.sender_chat.id) if msg.sender_chat else None
-        sender_name = f"{msg.from_user.first_name} {msg.from_user.last_name or ''}" if msg.from_user else msg.sender_chat.title if msg.sender_chat else "Unknown"
-        sender_username = msg.from_user.username if msg.from_user else msg.sender_chat.username if msg.sender_chat else None
-        
-        await conn.execute('''
-            INSERT INTO dumped_messages (session_id, chat_id, chat_name, telegram_message_id, sender_id, sender_name, sender_username, content, media_type, message_date, created_at)
-            VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11)
-            ON CONFLICT (session_id, chat_id, telegram_message_id) DO NOTHING
-        ''', session_id, str(chat_id), chat_name, msg.id, sender_id, sender_name.strip(), sender_username, content, media_type, msg.date, datetime.utcnow())
+        async with worker_db.acquire() as conn:
+            row = await worker_db.fetchrow(conn, 'find_media_object', file_unique_id)
+        return (row['object_name'], row['file_size']) if row else None
     except Exception as e:
-        print(f"Error saving dump msg: {e}")
-    finally:
-        if conn:
-            await conn.close()
+        print(f"Error looking up media object: {e}")
+        return None
+
+async def register_media_object(file_unique_id, object_name, size, sha256, mime):
+    """Records a freshly uploaded object. Returns the canonical object name, which differs if another worker won the race."""
+    if not file_unique_id: return object_name
+    async with worker_db.acquire() as conn:
+        stored = await worker_db.run(conn, 'insert_media_object', file_unique_id, object_name, size, sha256, mime, datetime.utcnow())
+    if stored: return stored
+    existing = await find_media_object(file_unique_id)
+    return existing[0] if existing else object_name
+
+def dumped_message_row(session_id, chat_id, chat_name, msg):
+    """Builds a dumped_messages row in DUMPED_MESSAGE_COLUMNS order."""
+    media_type = None
+    if msg.photo: media_type = 'photo'
+    elif msg.video: media_type = 'video'
+    elif msg.document: media_type = 'document'
+    
+    content = msg.text or msg.caption or ""
+    sender_id = str(msg.from_user.id) if msg.from_user else str(msg.sender_chat.id) if msg.sender_chat else None
+    sender_name = f"{msg.from_user.first_name} {msg.from_user.last_name or ''}" if msg.from_user else msg.sender_chat.title if msg.sender_chat else "Unknown"
+    sender_username = msg.from_user.username if msg.from_user else msg.sender_chat.username if msg.sender_chat else None
+    return (session_id, str(chat_id), chat_name, msg.id, sender_id, (sender_name or "").strip(), sender_username, content, media_type, msg.date, datetime.utcnow())
 
 async def update_dump_task_status(task_db_id, status, progress=0, error=None, total=0):
     if not task_db_id: return
-    conn = None
     try:
-        conn = await get_db_connection()
-        await conn.execute('''
-            UPDATE dump_tasks 
-            SET status=$1, progress=$2, error_message=$3, total_messages=$4
-            WHERE id=$5
-        ''', status, progress, error, total, task_db_id)
+        async with worker_db.acquire() as conn:
+            await worker_db.run(conn, 'update_dump_task', status, progress, error, total, task_db_id)
     except Exception as e: print(f"Error updating task status: {e}")
-    finally: 
-        if conn: await conn.close()
 
-def is_archive(filename: str) -> bool:
-    if not filename: return False
-    ext = filename.split('.')[-1].lower() if '.' in filename else ''
-    return ext in ['zip', 'rar', '7z', 'tar', 'gz', 'iso', 'dmg']
+async def load_dump_checkpoint(session_id, chat_id):
+    """Returns (last_message_id, pending_top_id, resume_offset_id, covered_from) for a chat, or None if it has none."""
+    try:
+        async with worker_db.acquire() as conn:
+            row = await worker_db.fetchrow(conn, 'load_checkpoint', session_id, str(chat_id))
+        if row: return row['last_message_id'] or 0, row['pending_top_id'], row['resume_offset_id'], row['covered_from']
+    except Exception as e: print(f"Error loading dump checkpoint: {e}")
+    return None
+
+async def save_dump_checkpoint(session_id, chat_id, last_message_id, covered_from, pending_top_id=None, resume_offset_id=None):
+    try:
+        async with worker_db.acquire() as conn:
+            await worker_db.run(conn, 'save_checkpoint', session_id, str(chat_id), last_message_id, pending_top_id, resume_offset_id, covered_from, datetime.utcnow())
+    except Exception as e: print(f"Error saving dump checkpoint: {e}")
+
+client_pool = TelegramClientPool(get_session_string_safe, idle_timeout=settings.WORKER_CLIENT_IDLE_SECONDS,
+                                 # every transfer worker plus the extra range streams of one large file
+                                 max_concurrent_transmissions=settings.DOWNLOAD_CONCURRENCY + settings.PARALLEL_DOWNLOAD_STREAMS - 1,
+                                 chats_per_session=settings.SESSION_CHAT_CONCURRENCY)
+
+@worker_process_shutdown.connect
+def close_worker_clients(**kwargs):
+    if _worker_loop is not None and _worker_loop.is_running():
+        try: asyncio.run_coroutine_threadsafe(client_pool.close_all(), _worker_loop).result(timeout=30)
+        except Exception as e: print(f"Error closing pooled clients: {e}")
+        try: asyncio.run_coroutine_threadsafe(worker_db.close(), _worker_loop).result(timeout=10)
+        except Exception as e: print(f"Error closing DB pool: {e}")
 
 def sanitize_filename(name):
     return re.sub(r'[<>:"/\\|?*]', '_', name).strip()
 
+class PipelineStats:
+    """Per-stage counters for the download pipeline, reported in task progress meta."""
+    def __init__(self, *stages):
+        self.started = time.monotonic()
+        self.stages = {name: {'done': 0, 'failed': 0, 'bytes': 0} for name in stages}
+        self.bytes_received = 0
+        self.first_byte = None
+        self._samples = deque([(self.started, 0)], maxlen=64)
+
+    def add_bytes(self, n):
+        self.bytes_received += n
+        now = time.monotonic()
+        if self.first_byte is None: self.first_byte = now
+        if now - self._samples[-1][0] >= 0.5: self._samples.append((now, self.bytes_received))
+
+    def throughput(self, window=10.0):
+        """Bytes received from Telegram so far and the rate over roughly the last `window` seconds."""
+        now = time.monotonic()
+        since, base = next(((t, b) for t, b in self._samples if now - t <= window), self._samples[-1])
+        elapsed = max(now - since, 1e-6)
+        return {'bytes': self.bytes_received, 'bytes_per_sec': int((self.bytes_received - base) / elapsed)}
+
+    def average_rate(self):
+        """Bytes/sec since the first byte arrived, so scan time does not dilute it; None before any transfer."""
+        if self.first_byte is None: return None
+        elapsed = time.monotonic() - self.first_byte
+        return int(self.bytes_received / elapsed) if elapsed >= 1 else None
+
+    def record(self, stage, size=0, ok=True):
+        entry = self.stages[stage]
+        if ok: entry['done'] += 1; entry['bytes'] += size or 0
+        else: entry['failed'] += 1
+
+    def snapshot(self):
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        return {name: {**v, 'files_per_sec': round(v['done'] / elapsed, 2), 'mb_per_sec': round(v['bytes'] / elapsed / 1048576, 2)} for name, v in self.stages.items()}
+
+class ChatProgress:
+    """Per-chat counters and timings for tasks that process several chats at once."""
+    def __init__(self): self.chats = {}
+
+    def start(self, chat_id, title):
+        self.chats[str(chat_id)] = {'title': title, 'status': 'running', 'started': time.monotonic(), 'seconds': 0.0}
+
+    def add(self, chat_id, key, n=1):
+        entry = self.chats.get(str(chat_id))
+        if not entry: return
+        entry[key] = entry.get(key, 0) + n
+        entry['seconds'] = round(time.monotonic() - entry['started'], 1)
+
+    def finish(self, chat_id, status='done', error=None):
+        entry = self.chats.get(str(chat_id))
+        if not entry: return
+        entry['status'] = status
+        entry['seconds'] = round(time.monotonic() - entry['started'], 1)
+        if error: entry['error'] = error
+
+    def _public(self, entry): return {k: v for k, v in entry.items() if k != 'started'}
+
+    def active(self): return {cid: self._public(e) for cid, e in self.chats.items() if e['status'] == 'running'}
+
+    def summary(self): return [{'chat_id': cid, **self._public(e)} for cid, e in self.chats.items()]
+
+async def list_dialog_targets(client, session_id, order='largest_first'):
+    """
+    All dialogs as chat objects. The top message id stands in for chat size, so large chats can
+    start first (they bound total runtime) or last (small chats finish quickly).
+    """
+    dialogs = [d async for d in rate_limiter.iterate(session_id, 'history', client.get_dialogs())]
+    size = lambda d: d.top_message.id if d.top_message else 0
+    if order == 'largest_first': dialogs.sort(key=size, reverse=True)
+    elif order == 'smallest_first': dialogs.sort(key=size)
+    return [d.chat for d in dialogs]
+
+def matches_media_types(message, media_types):
+    if 'photo' in media_types and message.photo: return True
+    if 'video' in media_types and (message.video or message.video_note): return True
+    if 'audio' in media_types and (message.audio or message.voice): return True
+    if message.document:
+        is_arc = is_archive(message.document.file_name or "")
+        if 'archive' in media_types and is_arc: return True
+        if 'document' in media_types and not is_arc: return True
+    return False
+
+def media_identity(message):
+    """Returns (file_unique_id, file_size) of the message's media."""
+    media = message.photo or message.video or message.video_note or message.audio or message.voice or message.document
+    if not media: return None, 0
+    return getattr(media, 'file_unique_id', None), getattr(media, 'file_size', 0) or 0
+
+class MediaRecord:
+    """What a transfer needs from a scanned media message, so the Message object can be dropped at scan time."""
+    __slots__ = ('message_id', 'date', 'file_id', 'file_unique_id', 'file_name', 'mime_type', 'file_size', 'file_type', 'ctx')
+
+    def __init__(self, message, ctx):
+        media = message.photo or message.video or message.video_note or message.audio or message.voice or message.document
+        fname, mime, ftype = describe_media(message)
+        self.message_id = message.id
+        self.date = message.date.timestamp() if message.date else 0
+        self.file_id = media.file_id
+        self.file_unique_id, self.file_size = media_identity(message)
+        self.file_name = sanitize_filename(fname)
+        self.mime_type = mime
+        self.file_type = ftype
+        self.ctx = ctx  # per-chat dict shared by all records of that chat
+
+class DownloadPlan:
+    """
+    Applies the per-file size cap and total byte budget to scanned records. With the 'history' priority
+    records stream to transfers as they are found; other priorities hold the (slim) records until every
+    scan is done, then release them ordered, so the budget goes to the files the policy prefers.
+    """
+    ORDER = {'smallest_first': lambda r: r.file_size, 'newest_first': lambda r: -r.date}
+
+    def __init__(self, priority='history', max_total_bytes=None, max_file_size=None):
+        self.priority = priority if priority in self.ORDER else 'history'
+        self.max_total_bytes = max_total_bytes
+        self.max_file_size = max_file_size
+        self.files = 0
+        self.bytes = 0
+        self.skipped = {'too_large': 0, 'over_budget': 0}
+        self.held = []
+        self.held_bytes = 0
+
+    @property
+    def streaming(self): return self.priority == 'history'
+
+    def fits(self, record):
+        if self.max_file_size and record.file_size > self.max_file_size:
+            self.skipped['too_large'] += 1; return False
+        return True
+
+    def admit(self, record):
+        if self.max_total_bytes and self.bytes + record.file_size > self.max_total_bytes:
+            self.skipped['over_budget'] += 1; return False
+        self.files += 1; self.bytes += record.file_size
+        return True
+
+    def hold(self, record):
+        self.held.append(record); self.held_bytes += record.file_size
+
+    def release(self):
+        key = self.ORDER.get(self.priority, lambda r: -r.date)
+        records = sorted(self.held, key=key); self.held = []; self.held_bytes = 0
+        return [r for r in records if self.admit(r)]
+
+    def estimate(self, bytes_per_sec):
+        """While records are held (before the budget is applied) this counts everything found so far."""
+        files, size = self.files + len(self.held), self.bytes + self.held_bytes
+        return {'files': files, 'bytes': size, 'bytes_per_sec': bytes_per_sec,
+                'seconds': int(size / bytes_per_sec) if bytes_per_sec else None, 'skipped': self.skipped, 'priority': self.priority}
+
+def throughput_key(session_id): return f"superapp:throughput:{session_id}"
+
+async def load_session_throughput(session_id):
+    """Last measured download rate of the session, falling back to DOWNLOAD_ESTIMATE_BPS."""
+    try: value = await get_redis().get(throughput_key(session_id))
+    except Exception as e: print(f"Could not read throughput for session {session_id}: {e}"); value = None
+    return int(value) if value else settings.DOWNLOAD_ESTIMATE_BPS
+
+async def save_session_throughput(session_id, bytes_per_sec):
+    try: await get_redis().set(throughput_key(session_id), int(bytes_per_sec), ex=7 * 86400)
+    except Exception as e: print(f"Could not save throughput for session {session_id}: {e}")
+
 def parse_ts(ts):
     if not ts: return None
     if isinstance(ts, datetime):
@@ -108,155 +383,270 @@ def parse_ts(ts):
         return dt.replace(tzinfo=None)
     except: return None
 
-async def process_download(self, session_id: int, chat_ids: list, media_types: list, start_time=None, end_time=None, limit=None, save_locally=False):
-    session_string, api_id, api_hash = await get_session_string_safe(session_id)
-    if not session_string: return {'status': 'failed', 'error': 'Session not found'}
-    
+async def process_download(self, session_id: int, chat_ids: list, media_types: list, start_time=None, end_time=None, limit=None, save_locally=False, chat_order='largest_first',
+                           priority='history', max_total_bytes=None, max_file_size=None, estimate_only=False, user_id=None):
     start_dt = parse_ts(start_time)
     end_dt = parse_ts(end_time)
     if limit:
         try: limit = int(limit)
         except: limit = None
 
-    workdir = f"./sessions/worker_{session_id}"
-    os.makedirs(workdir, exist_ok=True)
-    client = Client(name=f"worker_downloader_{session_id}", api_id=int(api_id), api_hash=api_hash, session_string=session_string, workdir=workdir, no_updates=True, ipv6=False)
-    
-    total_downloaded = 0
-    
+    try: client = await client_pool.acquire(session_id)
+    except Exception as e: return {'status': 'failed', 'error': str(e)}
+    if not client: return {'status': 'failed', 'error': 'Session not found'}
+
+    export_dir = "/app/exports"
+    download_q = asyncio.Queue(maxsize=settings.PIPELINE_QUEUE_SIZE)
+    meta_q = asyncio.Queue(maxsize=settings.PIPELINE_QUEUE_SIZE * settings.METADATA_BATCH_SIZE)
+    history = rate_limiter.bind(session_id, 'history')
+    downloads = rate_limiter.bind(session_id, 'download')
+    stats = PipelineStats('transfer', 'dedup', 'metadata')
+    state = {'found': 0, 'finished': 0, 'status': 'Starting...'}
+    scan_stats = {'strategies': {}, 'scanned': 0, 'matched': 0}
+    chat_progress = ChatProgress()
+    plan = DownloadPlan(priority, max_total_bytes, max_file_size)
+    lease = BandwidthLease(self.request_id, user_id)
+    estimated_rate = await load_session_throughput(session_id)
+
+    def report(status=None):
+        if status: state['status'] = status
+        total = state['found']
+        self.update_state(state='PROGRESS', meta={
+            'current': state['finished'], 'total': total, 'status': state['status'],
+            'progress': int(state['finished'] / total * 100) if total else 0, 'stages': stats.snapshot(), 'scan': scan_stats,
+            'throughput': stats.throughput(), 'estimate': plan.estimate(stats.average_rate() or estimated_rate), 'bandwidth': lease.snapshot(),
+            'chats': chat_progress.active()
+        })
+
+    def on_chunk(n):
+        # Coalesced by the progress reporter, so long transfers keep the bytes/sec figure live
+        stats.add_bytes(n); report()
+
+    # file_unique_id -> future resolving to the stored object name, so concurrent copies of one file download once
+    inflight = {}
+
+    async def store_media(record):
+        """Returns (object_name, size, deduplicated)."""
+        ctx, fname, mime = record.ctx, record.file_name, record.mime_type
+        file_unique_id, expected_size = record.file_unique_id, record.file_size
+        existing = await find_media_object(file_unique_id)
+        known = (existing[0], existing[1] or expected_size) if existing else None
+        if not known and file_unique_id in inflight:
+            object_name = await inflight[file_unique_id]
+            if object_name: known = (object_name, expected_size)
+        if known:
+            if save_locally:
+                chat_export_dir = os.path.join(export_dir, ctx['folder_name'])
+                os.makedirs(chat_export_dir, exist_ok=True)
+                await run_in_thread(StorageManager.download_file, known[0], os.path.join(chat_export_dir, fname))
+            return known[0], known[1], True
+        waiter = asyncio.get_running_loop().create_future()
+        if file_unique_id: inflight[file_unique_id] = waiter
+        try:
+            # The message id keeps same-named files apart, so an upload that loses the register race only deletes its own object
+            obj_name = f"{session_id}/{ctx['folder_name']}/{record.message_id}_{fname}"
+            tee_path = None
+            if save_locally:
+                chat_export_dir = os.path.join(export_dir, ctx['folder_name'])
+                os.makedirs(chat_export_dir, exist_ok=True)
+                tee_path = os.path.join(chat_export_dir, fname)
+            hasher = hashlib.sha256()
+            if settings.PARALLEL_DOWNLOAD_STREAMS > 1 and expected_size >= settings.PARALLEL_DOWNLOAD_THRESHOLD:
+                chunks = iter_media_segments(client, record.file_id, expected_size, downloads, settings.PARALLEL_DOWNLOAD_STREAMS,
+                                             max(settings.MINIO_PART_SIZE // CHUNK_SIZE, 1), settings.PARALLEL_DOWNLOAD_BUFFER // CHUNK_SIZE)
+            else: chunks = iter_media_chunks(client, record.file_id, downloads, file_size=expected_size)
+            size = await stream_to_storage(chunks, obj_name, mime, tee_path, on_chunk=on_chunk, hasher=hasher, pace=lease.consume,
+                                           expected_size=expected_size)
+            canonical = await register_media_object(file_unique_id, obj_name, size, hasher.hexdigest(), mime)
+            if canonical != obj_name: await run_in_thread(StorageManager.delete_file, obj_name)
+            waiter.set_result(canonical)
+            return canonical, size, False
+        except BaseException:
+            waiter.set_result(None)
+            raise
+        finally:
+            inflight.pop(file_unique_id, None)
+
+    async def transfer_worker():
+        while True:
+            job = await download_q.get()
+            if job is None: return
+            record = job
+            fname = record.file_name
+            try:
+                obj_name, size, deduplicated = await store_media(record)
+                if deduplicated: stats.record('dedup', size)
+                else: stats.record('transfer', size)
+                await meta_q.put((session_id, record.ctx['chat_id'], record.ctx['chat_title'], record.message_id, fname, obj_name, record.file_type, size, record.file_unique_id))
+                report(f'{"Already stored" if deduplicated else "Finished"}: {fname}')
+            except Exception as e:
+                stats.record('transfer', ok=False); state['finished'] += 1
+                report(f'Error processing {fname}: {str(e)}')
+
+    async def metadata_writer():
+        batch = []; done = False; deadline = None
+        while not done:
+            timeout = max(deadline - time.monotonic(), 0) if deadline else None
+            try:
+                row = await asyncio.wait_for(meta_q.get(), timeout=timeout)
+                if row is None: done = True
+                else:
+                    batch.append(row)
+                    if deadline is None: deadline = time.monotonic() + settings.METADATA_FLUSH_SECONDS
+            except asyncio.TimeoutError: pass
+            if batch and (done or len(batch) >= settings.METADATA_BATCH_SIZE or time.monotonic() >= deadline):
+                written = await save_file_metadata_batch(batch)
+                for row in written: stats.record('metadata', row[7]); chat_progress.add(row[1], 'downloaded')
+                for _ in range(len(batch) - len(written)): stats.record('metadata', ok=False)
+                state['finished'] += len(batch)
+                if len(written) < len(batch): report(f'Could not record {len(batch) - len(written)} downloaded files')
+                batch = []; deadline = None
+                report()
+
     try:
-        await client.start()
-        
         target_chats = []
         if not chat_ids or not chat_ids[0]:
-             self.update_state(state='PROGRESS', meta={'status': 'Fetching all dialogs...', 'progress': 0})
-             async for d in client.get_dialogs(): target_chats.append(d.chat.id)
+             report('Fetching all dialogs...')
+             target_chats = [chat.id for chat in await list_dialog_targets(client, session_id, chat_order)]
         else:
              for cid in chat_ids:
                 try:
                     target_chats.append(int(cid) if str(cid).lstrip('-').isdigit() else cid)
                 except: target_chats.append(cid)
 
-        temp_dir = "/app/media/temp_downloads"
-        os.makedirs(temp_dir, exist_ok=True)
-        export_dir = "/app/exports"
         if save_locally: os.makedirs(export_dir, exist_ok=True)
-        
-        for idx, target_chat in enumerate(target_chats):
-            try:
-                self.update_state(state='PROGRESS', meta={'status': f'Resolving chat {target_chat}...', 'progress': 0})
-                chat_info = await client.get_chat(target_chat)
-                chat_title = chat_info.title or f"{chat_info.first_name} {chat_info.last_name or ''}".strip()
-                chat_username = chat_info.username
-                self.update_state(state='PROGRESS', meta={'status': f'Scanning {chat_title} ({idx+1}/{len(target_chats)})...', 'progress': 0})
-
-                target_messages = []
-                scanned_count = 0
-                async for message in client.get_chat_history(target_chat):
-                    scanned_count += 1
-                    # Throttle scanning slightly
-                    if scanned_count % 200 == 0: await asyncio.sleep(0.5)
-                    
-                    if scanned_count % 50 == 0: self.update_state(state='PROGRESS', meta={'status': f'Scanned {scanned_count} msgs in {chat_title}. Found {len(target_messages)} files.', 'progress': 0})
-                    
-                    if end_dt and message.date > end_dt: continue
-                    if start_dt and message.date < start_dt: break 
-                    
-                    is_match = False
-                    if 'photo' in media_types and message.photo: is_match = True
-                    elif 'video' in media_types and (message.video or message.video_note): is_match = True
-                    elif 'audio' in media_types and (message.audio or message.voice): is_match = True
-                    elif message.document:
-                        fname = message.document.file_name or ""
-                        is_arc = is_archive(fname)
-                        if 'archive' in media_types and is_arc: is_match = True
-                        elif 'document' in media_types and not is_arc: is_match = True
-                    if is_match:
-                        target_messages.append(message)
-                        if limit and len(target_messages) >= limit: break
-                
-                self.update_state(state='PROGRESS', meta={'status': f'Found {len(target_messages)} files in {chat_title}. Starting download...', 'progress': 0})
-                
-                folder_name = chat_username if chat_username else sanitize_filename(chat_title)
-                folder_name = f"{session_id}_{folder_name}"
-
-                for i, message in enumerate(target_messages):
-                    try:
-                        fname = "unknown"; ftype="other"; mime="application/octet-stream"
-                        if message.photo: fname=f"photo_{message.id}.jpg"; mime="image/jpeg"; ftype="image"
-                        elif message.video: fname=message.video.file_name or f"video_{message.id}.mp4"; mime=message.video.mime_type or "video/mp4"; ftype="video"
-                        elif message.video_note: fname=f"videonote_{message.id}.mp4"; mime="video/mp4"; ftype="video"
-                        elif message.audio: fname=message.audio.file_name or f"audio_{message.id}.mp3"; mime=message.audio.mime_type or "audio/mpeg"; ftype="audio"
-                        elif message.voice: fname=f"voice_{message.id}.ogg"; mime=message.voice.mime_type or "audio/ogg"; ftype="audio"
-                        elif message.document:
-                            fname=message.document.file_name or f"doc_{message.id}"; mime=message.document.mime_type or "application/octet-stream"
-                            if is_archive(fname): ftype="archive"
-                            else: ftype="document"
-                        
-                        self.update_state(state='PROGRESS', meta={'current': i+1, 'total': len(target_messages), 'progress': int(i/len(target_messages)*100), 'status': f'Downloading: {fname} ({i+1}/{len(target_messages)})'})
-                        
-                        local_path = await client.download_media(message, file_name=os.path.join(temp_dir, fname))
-                        if local_path:
-                            size = os.path.getsize(local_path)
-                            obj_name = f"{session_id}/{folder_name}/{os.path.basename(local_path)}"
-                            await run_in_thread(StorageManager.upload_file, local_path, obj_name, mime)
-                            await save_file_metadata(session_id, str(target_chat), chat_title, message.id, os.path.basename(local_path), obj_name, ftype, size)
-                            total_downloaded += 1
-                            if save_locally:
-                                try:
-                                    chat_export_dir = os.path.join(export_dir, folder_name)
-                                    os.makedirs(chat_export_dir, exist_ok=True)
-                                    shutil.copy2(local_path, os.path.join(chat_export_dir, os.path.basename(local_path)))
-                                    self.update_state(state='PROGRESS', meta={'status': f'Saved locally: {fname}', 'progress': int((i+1)/len(target_messages)*100)})
-                                except: pass
-                            os.remove(local_path)
-                            self.update_state(state='PROGRESS', meta={'status': f'Finished: {fname}', 'progress': int((i+1)/len(target_messages)*100)})
-                            
-                            # Anti-flood delay between downloads
-                            await asyncio.sleep(0.5)
-                    except Exception as e:
-                        self.update_state(state='PROGRESS', meta={'status': f'Error processing {fname}: {str(e)}', 'progress': int((i+1)/len(target_messages)*100)})
-                        continue
-            except Exception as e: 
-                print(f"Error processing chat {target_chat}: {e}")
-                self.update_state(state='PROGRESS', meta={'status': f'Skipping chat {target_chat} due to error: {str(e)}', 'progress': 0})
-                continue
+
+        if not estimate_only: await lease.start()
+        transfers = [asyncio.create_task(transfer_worker()) for _ in range(settings.DOWNLOAD_CONCURRENCY)]
+        writer = asyncio.create_task(metadata_writer())
+
+        async def scan_chat(idx, target_chat):
+            async with client_pool.chat_budget(session_id):
+                try:
+                    chat_info = await history(client.get_chat, target_chat)
+                    chat_title = chat_info.title or f"{chat_info.first_name} {chat_info.last_name or ''}".strip()
+                    chat_username = chat_info.username
+                    chat_progress.start(target_chat, chat_title)
+                    report(f'Scanning {chat_title} ({idx+1}/{len(target_chats)})...')
+
+                    folder_name = chat_username if chat_username else sanitize_filename(chat_title)
+                    ctx = {'chat_id': str(target_chat), 'chat_title': chat_title, 'folder_name': f"{session_id}_{folder_name}"}
+                    # In history order matches go straight onto the bounded transfer queue, so downloads start during the scan
+                    counts = {'scanned': 0, 'matched': 0}; last_seen = 0
+
+                    async def enqueue(message):
+                        record = MediaRecord(message, ctx)
+                        if not plan.fits(record): return
+                        counts['matched'] += 1
+                        chat_progress.add(target_chat, 'found')
+                        if not plan.streaming or estimate_only:
+                            plan.hold(record); return
+                        if not plan.admit(record): return
+                        state['found'] += 1
+                        await download_q.put(record)
+
+                    strategy = 'search'
+                    # Let Telegram filter by media type and date window; only matches come back
+                    search = iter_media_search(client, target_chat, media_types, min_date=start_dt, max_date=end_dt, throttle=history).__aiter__()
+                    while True:
+                        # Only Telegram refusing the search switches to the history scan; a FloodWait the throttle gave up
+                        # on, or an error while queueing a match, fails the chat like any other error
+                        try: message = await search.__anext__()
+                        except StopAsyncIteration: break
+                        except FloodWait: raise
+                        except RPCError as e:
+                            print(f"Media search failed for {target_chat}, falling back to history scan: {e}")
+                            strategy = 'history'; break
+                        counts['scanned'] += 1; last_seen = message.id
+                        if counts['scanned'] % 50 == 0: report(f'Searched {counts["scanned"]} media msgs in {chat_title}. Queued {counts["matched"]} files.')
+                        if end_dt and message.date > end_dt: continue
+                        if start_dt and message.date < start_dt: break
+                        if matches_media_types(message, media_types):
+                            await enqueue(message)
+                            if limit and counts['matched'] >= limit: break
+                    await search.aclose()
+                    if strategy == 'history':
+                        # Results arrive newest-first, so the history scan picks up below the last message already seen
+                        async for message in iter_history_window(client, target_chat, start_dt, end_dt, offset_id=last_seen, throttle=history):
+                            counts['scanned'] += 1
+                            if counts['scanned'] % 50 == 0: report(f'Scanned {counts["scanned"]} msgs in {chat_title}. Queued {counts["matched"]} files.')
+                            if matches_media_types(message, media_types):
+                                await enqueue(message)
+                                if limit and counts['matched'] >= limit: break
+                    scan_stats['strategies'][strategy] = scan_stats['strategies'].get(strategy, 0) + 1
+                    scan_stats['scanned'] += counts['scanned']
+                    scan_stats['matched'] += counts['matched']
+                    report(f'Finished scanning {chat_title}: {counts["matched"]} files {"queued" if plan.streaming else "found"}.')
+                    chat_progress.finish(target_chat, 'queued')
+                except Exception as e: 
+                    print(f"Error processing chat {target_chat}: {e}")
+                    chat_progress.finish(target_chat, 'failed', str(e))
+                    report(f'Skipping chat {target_chat} due to error: {str(e)}')
+
+        try:
+            # Chats are scanned concurrently up to the session's budget; transfers are shared by all of them
+            await asyncio.gather(*[scan_chat(idx, chat) for idx, chat in enumerate(target_chats)])
+            if estimate_only or not plan.streaming:
+                # Held records are released in priority order once every scan is done
+                records = plan.release()
+                if estimate_only:
+                    estimate = plan.estimate(estimated_rate)
+                    return {'status': 'completed', 'estimate_only': True, 'estimate': estimate, 'scanned': scan_stats['scanned'], 'matched': scan_stats['matched'],
+                            'message': f'Estimate: {estimate["files"]} files, {round(estimate["bytes"] / 1048576, 1)} MB, about {estimate["seconds"]}s'}
+                state['found'] = len(records)
+                report(f'Downloading {len(records)} files ({round(plan.bytes / 1048576, 1)} MB), {plan.priority.replace("_", " ")}...')
+                for record in records: await download_q.put(record)
+        finally:
+            for _ in transfers: await download_q.put(None)
+            await asyncio.gather(*transfers, return_exceptions=True)
+            await meta_q.put(None)
+            await asyncio.gather(writer, return_exceptions=True)
             
-        return {'status': 'completed', 'total_files': total_downloaded, 'message': f'Downloaded {total_downloaded} files from {len(target_chats)} chats'}
+        total_downloaded = stats.stages['metadata']['done']
+        if stats.average_rate() and stats.bytes_received >= CHUNK_SIZE * 16: await save_session_throughput(session_id, stats.average_rate())
+        strategy = '+'.join(sorted(scan_stats['strategies'])) or 'search'
+        for entry in chat_progress.chats.values():
+            if entry['status'] == 'queued': entry['status'] = 'done'
+        return {'status': 'completed', 'total_files': total_downloaded, 'stages': stats.snapshot(), 'strategy': strategy, 'scanned': scan_stats['scanned'], 'matched': scan_stats['matched'], 'chats': chat_progress.summary(), 'estimate': plan.estimate(stats.average_rate() or estimated_rate), 'message': f'Downloaded {total_downloaded} files from {len(target_chats)} chats'}
     except Exception as e: return {'status': 'failed', 'error': str(e)}
     finally:
-        if client.is_connected: await client.stop()
+        await lease.stop()
+        client_pool.release(session_id)
 
-async def process_dump(self, session_id: int, chat_ids: list, start_time=None, end_time=None, task_db_id=None):
-    session_string, api_id, api_hash = await get_session_string_safe(session_id)
-    if not session_string:
+async def close_dump_writer(writer: DumpedMessageWriter):
+    try: await writer.close()
+    except Exception as e: print(f"Error flushing buffered dump rows: {e}")
+
+async def process_dump(self, session_id: int, chat_ids: list, start_time=None, end_time=None, task_db_id=None, incremental=True, chat_order='largest_first'):
+    try: client = await client_pool.acquire(session_id)
+    except Exception as e:
+        if task_db_id: await update_dump_task_status(task_db_id, 'failed', error=str(e))
+        return {'status': 'failed', 'error': str(e)}
+    if not client:
         if task_db_id: await update_dump_task_status(task_db_id, 'failed', error='Session not found')
         return {'status': 'failed', 'error': 'Session not found'}
     
     start_dt = parse_ts(start_time)
     end_dt = parse_ts(end_time)
 
-    workdir = f"./sessions/worker_dump_{session_id}"
-    os.makedirs(workdir, exist_ok=True)
-    client = Client(name=f"worker_dumper_{session_id}", api_id=int(api_id), api_hash=api_hash, session_string=session_string, workdir=workdir, no_updates=True, ipv6=False)
-    
-    count = 0
-    total_messages_count = 0
+    counters = {'total': 0, 'chats_done': 0}
+    chat_progress = ChatProgress()
+    history = rate_limiter.bind(session_id, 'history')
+    writer = DumpedMessageWriter(worker_db, settings.DUMP_BATCH_SIZE, settings.DUMP_FLUSH_SECONDS)
     if task_db_id: await update_dump_task_status(task_db_id, 'running')
     
     try:
-        await client.start()
         self.update_state(state='PROGRESS', meta={'status': 'Connected. Resolving targets...', 'progress': 0})
         
         target_chats = []
         if not chat_ids or not chat_ids[0]:
              self.update_state(state='PROGRESS', meta={'status': 'Fetching ALL chats...', 'progress': 5})
-             async for d in client.get_dialogs(): target_chats.append(d.chat)
+             target_chats = await list_dialog_targets(client, session_id, chat_order)
         else:
              for cid in chat_ids:
                  try: 
                      val = int(cid) if str(cid).lstrip('-').isdigit() else cid
-                     chat = await client.get_chat(val)
+                     chat = await history(client.get_chat, val)
                      target_chats.append(chat)
                  except Exception as e: 
                      print(f"Resolve fail {cid}: {e}")
@@ -269,64 +659,93 @@ async def process_dump(self, session_id: int, chat_ids: list, start_time=None, e
         export_dir = "/app/exports/dumps"
         os.makedirs(export_dir, exist_ok=True)
 
-        for idx, chat in enumerate(target_chats):
+
+        def report(status):
+            progress = int(counters['chats_done'] / total_chats * 100)
+            self.update_state(state='PROGRESS', meta={'status': status, 'progress': progress, 'total': counters['total'], 'chats': chat_progress.active()})
+
+        async def dump_chat(idx, chat):
             chat_title = chat.title or f"{chat.first_name or ''} {chat.last_name or ''}".strip()
             safe_title = sanitize_filename(chat_title)
             chat_username = chat.username
             folder_name = chat_username if chat_username else safe_title
             json_file_path = os.path.join(export_dir, f"{session_id}_{folder_name}_dump.jsonl")
             
-            self.update_state(state='PROGRESS', meta={'status': f'Dumping {chat_title} ({idx+1}/{total_chats})...', 'progress': int(idx/total_chats*100)})
+            chat_progress.start(chat.id, chat_title)
+            report(f'Dumping {chat_title} ({idx+1}/{total_chats})...')
             
             chat_msg_count = 0
+            # A checkpoint means "every message dated covered_from or later, up to last_message_id, is dumped". Only a
+            # window that reaches the present advances it. It may stand in for this window's older part when it starts
+            # no later than start_time; the run then covers start_time..newest, which is what gets saved.
+            use_checkpoint = incremental and (not end_dt or end_dt >= datetime.utcnow())
+            checkpoint = await load_dump_checkpoint(session_id, chat.id) if use_checkpoint else None
+            if checkpoint and (checkpoint[3] is None or (start_dt and checkpoint[3] <= start_dt)): last_id, pending_top, resume_offset, _ = checkpoint
+            else: last_id, pending_top, resume_offset = 0, None, None
+            # An interrupted run leaves (last_id, resume_offset) undumped: close that gap first, then fetch what is new
+            segments = [(resume_offset, pending_top)] if pending_top and resume_offset else []
+            segments.append((0, None))
             try:
                 with open(json_file_path, 'a', encoding='utf-8') as f:
-                    async for msg in client.get_chat_history(chat.id):
-                        # Throttle to avoid FloodWait: Sleep 1s every 100 msgs
-                        if chat_msg_count > 0 and chat_msg_count % 100 == 0:
-                             await asyncio.sleep(1)
-                        
-                        if end_dt and msg.date > end_dt: continue
-                        if start_dt and msg.date < start_dt: break
-                        
-                        # Skip empty content for dumps
-                        content = msg.text or msg.caption or ""
-                        if not content.strip() and not msg.media: 
-                            continue
-
-                        await save_dumped_message(session_id, str(chat.id), chat_title, msg)
-                        
-                        dump_obj = {"id": msg.id, "date": msg.date.isoformat(), "sender": msg.from_user.id if msg.from_user else None, "content": content}
-                        f.write(json.dumps(dump_obj) + "\n")
-                        
-                        count += 1
-                        total_messages_count += 1
-                        chat_msg_count += 1
-                        
-                        if total_messages_count % 50 == 0:
-                            if task_db_id: await update_dump_task_status(task_db_id, 'running', progress=int(idx/total_chats*100), total=total_messages_count)
-                            self.update_state(state='PROGRESS', meta={'status': f'Dumped {total_messages_count} total msgs ({chat_msg_count} in {chat_title}).', 'progress': int(idx/total_chats*100)})
+                    for offset_id, run_top in segments:
+                        async for msg in iter_history_window(client, chat.id, start_dt, end_dt, offset_id=offset_id, min_id=last_id, throttle=history):
+                            if run_top is None: run_top = msg.id
+                            # Skip empty content for dumps
+                            content = msg.text or msg.caption or ""
+                            if not content.strip() and not msg.media: 
+                                continue
+
+                            await writer.add(dumped_message_row(session_id, chat.id, chat_title, msg))
+                            
+                            dump_obj = {"id": msg.id, "date": msg.date.isoformat(), "sender": msg.from_user.id if msg.from_user else None, "content": content}
+                            f.write(json.dumps(dump_obj) + "\n")
+                            
+                            counters['total'] += 1
+                            chat_msg_count += 1
+                            chat_progress.add(chat.id, 'messages')
+                            
+                            if use_checkpoint and chat_msg_count % settings.DUMP_BATCH_SIZE == 0:
+                                await writer.flush()
+                                await save_dump_checkpoint(session_id, chat.id, last_id, start_dt, run_top, msg.id)
+                            if counters['total'] % 50 == 0:
+                                if task_db_id: await update_dump_task_status(task_db_id, 'running', progress=int(counters['chats_done']/total_chats*100), total=counters['total'])
+                                report(f'Dumped {counters["total"]} total msgs ({chat_msg_count} in {chat_title}).')
+                        if use_checkpoint and run_top:
+                            await writer.flush()
+                            last_id = max(last_id, run_top)
+                            await save_dump_checkpoint(session_id, chat.id, last_id, start_dt)
+                chat_progress.finish(chat.id)
             except Exception as e:
                 print(f"Error dumping chat {chat_title}: {e}")
-                continue
+                chat_progress.finish(chat.id, 'failed', str(e))
+            finally:
+                counters['chats_done'] += 1
+
+        async def dump_chat_within_budget(idx, chat):
+            async with client_pool.chat_budget(session_id): await dump_chat(idx, chat)
+
+        await asyncio.gather(*[dump_chat_within_budget(idx, chat) for idx, chat in enumerate(target_chats)])
+        total_messages_count = counters['total']
         
+        await writer.close()
         if task_db_id: await update_dump_task_status(task_db_id, 'completed', progress=100, total=total_messages_count)
-        return {'status': 'completed', 'total_messages': total_messages_count, 'message': f'Dumped {total_messages_count} messages from {total_chats} chats.'}
+        return {'status': 'completed', 'total_messages': total_messages_count, 'new_messages': writer.inserted_total, 'chats': chat_progress.summary(), 'message': f'Dumped {total_messages_count} messages from {total_chats} chats.'}
+    except asyncio.CancelledError:
+        await close_dump_writer(writer)
+        if task_db_id: await update_dump_task_status(task_db_id, 'cancelled', total=counters['total'])
+        raise
     except Exception as e:
-        if task_db_id: await update_dump_task_status(task_db_id, 'failed', error=str(e))
+        await close_dump_writer(writer)
+        if task_db_id: await update_dump_task_status(task_db_id, 'failed', error=str(e), total=counters['total'])
         return {'status': 'failed', 'error': str(e)}
     finally:
-        if client.is_connected:
-            await client.stop()
+        client_pool.release(session_id)
 
 async def process_broadcast(self, session_id: int, message: str, target_chat_ids: list, delay_min: int, delay_max: int):
-    session_string, api_id, api_hash = await get_session_string_safe(session_id)
-    if not session_string: return {'status': 'failed', 'error': 'Session not found'}
-    workdir = f"./sessions/worker_broadcast_{session_id}"
-    os.makedirs(workdir, exist_ok=True)
-    client = Client(name=f"worker_broadcaster_{session_id}", api_id=int(api_id), api_hash=api_hash, session_string=session_string, workdir=workdir, no_updates=True, ipv6=False)
+    try: client = await client_pool.acquire(session_id)
+    except Exception as e: return {'status': 'failed', 'error': str(e)}
+    if not client: return {'status': 'failed', 'error': 'Session not found'}
     try:
-        await client.start()
         total = len(target_chat_ids); sent = 0; failed = 0
         for idx, chat_id in enumerate(target_chat_ids):
             try:
@@ -334,26 +753,28 @@ async def process_broadcast(self, session_id: int, message: str, target_chat_ids
                 if isinstance(chat_id, str) and (chat_id.startswith('-') or chat_id.isdigit()):
                     try: target = int(chat_id)
                     except: pass
-                await client.send_message(target, message)
+                await rate_limiter.call(session_id, 'send', client.send_message, target, message)
                 sent += 1
             except Exception as e: 
                 print(f"Broadcast fail: {e}"); failed += 1
             self.update_state(state='PROGRESS', meta={'current': idx+1, 'total': total, 'sent': sent, 'failed': failed, 'progress': int((idx+1)/total*100), 'status': f'Sending to {chat_id}...'})
+            # The user's delay spaces this broadcast out; the send bucket keeps all tasks on the session under the limit
             if idx < total - 1: await asyncio.sleep(random.uniform(delay_min, delay_max))
         return {'status': 'completed', 'sent': sent, 'failed': failed, 'message': f'Broadcast Finished. Sent: {sent}, Failed: {failed}'}
     except Exception as e: return {'status': 'failed', 'error': str(e)}
     finally:
-        if client.is_connected:
-            await client.stop()
+        client_pool.release(session_id)
 
 @celery_app.task(bind=True)
-def download_media_task(self, session_id: int, chat_ids: list, media_types: list, start_time=None, end_time=None, limit=None, save_locally=False):
-    return asyncio.run(process_download(self, session_id, chat_ids, media_types, start_time, end_time, limit, save_locally))
+def download_media_task(self, session_id: int, chat_ids: list, media_types: list, start_time=None, end_time=None, limit=None, save_locally=False, chat_order='largest_first',
+                        priority='history', max_total_bytes=None, max_file_size=None, estimate_only=False, user_id=None):
+    return run_task(self, process_download, session_id, chat_ids, media_types, start_time, end_time, limit, save_locally, chat_order,
+                    priority, max_total_bytes, max_file_size, estimate_only, user_id)
 
 @celery_app.task(bind=True)
 def broadcast_message_task(self, session_id: int, message: str, target_chat_ids: list, delay_min: int = 2, delay_max: int = 5):
-    return asyncio.run(process_broadcast(self, session_id, message, target_chat_ids, delay_min, delay_max))
+    return run_task(self, process_broadcast, session_id, message, target_chat_ids, delay_min, delay_max)
 
 @celery_app.task(bind=True)
-def dump_messages_task(self, session_id: int, chat_ids: list, start_time=None, end_time=None, task_db_id=None, is_auto=False):
-    return asyncio.run(process_dump(self, session_id, chat_ids, start_time, end_time, task_db_id))
\ No newline at end of file
+def dump_messages_task(self, session_id: int, chat_ids: list, start_time=None, end_time=None, task_db_id=None, is_auto=False, incremental=True, chat_order='largest_first'):
+    return run_task(self, process_dump, session_id, chat_ids, start_time, end_time, task_db_id, incremental, chat_order)
\ No newline at end of file
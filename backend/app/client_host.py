@@ -0,0 +1,182 @@
+"""
+Client host: the processes that own the live Telegram clients. `python -m app.client_host` starts
+CLIENT_HOST_PROCESSES shard processes and restarts any that die. Sessions are placed on shards with a
+consistent-hash ring, so changing the process count moves only the sessions whose owner changed; each
+shard's session supervisor brings up the active sessions it owns and drops the ones it no longer owns.
+
+With CLIENT_HOST_MODE=remote the API keeps no clients at all: it sends commands to the owning shard's
+Redis list and reads the reply from a per-request key. In embedded mode (single API worker) the same
+commands run in-process.
+"""
+from typing import Any, Dict, List, Optional
+import asyncio
+import bisect
+import hashlib
+import json
+import multiprocessing
+import signal
+import sys
+import time
+import uuid
+from app.config import settings
+from app.redis_client import get_redis
+from app.ingest import message_ingest
+from app.telegram_service import TelegramManager, active_clients
+from app.session_supervisor import session_supervisor
+from app.media_capture import media_capture
+
+RPC_PREFIX = "superapp:clients:rpc:"
+REPLY_PREFIX = "superapp:clients:reply:"
+HEARTBEAT_PREFIX = "superapp:clients:shard:"
+HEARTBEAT_SECONDS = 5
+
+def is_remote() -> bool: return settings.CLIENT_HOST_MODE == "remote"
+
+def _hash(key: str) -> int: return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+class HashRing:
+    def __init__(self, shards: int, replicas: int = 64):
+        self.shards = max(shards, 1)
+        self._ring = sorted((_hash(f"shard-{shard}#{replica}"), shard) for shard in range(self.shards) for replica in range(replicas))
+        self._points = [point for point, _ in self._ring]
+
+    def owner(self, session_id: int) -> int:
+        return self._ring[bisect.bisect(self._points, _hash(str(session_id))) % len(self._ring)][1]
+
+ring = HashRing(settings.CLIENT_HOST_PROCESSES)
+current_shard: Optional[int] = None  # set in shard processes; None means this process owns every session
+
+def owns(session_id: int) -> bool: return current_shard is None or ring.owner(session_id) == current_shard
+
+session_supervisor.owns = owns
+
+async def _ensure(session_id: int) -> dict:
+    if not owns(session_id): return {"active": False, "error": f"Session {session_id} belongs to shard {ring.owner(session_id)}"}
+    return {"active": await session_supervisor.ensure(session_id)}
+
+async def _stop(session_id: int) -> dict:
+    await session_supervisor.stop(session_id)
+    return {"stopped": True}
+
+OPS = {
+    "ensure": _ensure,
+    "stop": _stop,
+    "get_dialogs": TelegramManager.get_dialogs,
+    "get_profile_info": TelegramManager.get_profile_info,
+    "get_group_info": TelegramManager.get_group_info,
+    "send_message": TelegramManager.send_message,
+}
+
+async def _request(shard: int, op: str, kwargs: dict) -> Dict[str, Any]:
+    request_id = str(uuid.uuid4())
+    r = get_redis()
+    await r.rpush(f"{RPC_PREFIX}{shard}", json.dumps({"id": request_id, "op": op, "kwargs": kwargs, "sent": time.time()}))
+    reply = await r.blpop(f"{REPLY_PREFIX}{request_id}", timeout=settings.CLIENT_RPC_TIMEOUT)
+    if not reply: return {"error": f"Client host shard {shard} did not answer"}
+    return json.loads(reply[1])
+
+async def call(op: str, **kwargs) -> Dict[str, Any]:
+    """Runs a client command here in embedded mode, otherwise on the shard that owns the session."""
+    if not is_remote(): return await OPS[op](**kwargs)
+    return await _request(ring.owner(kwargs["session_id"]), op, kwargs)
+
+async def read_shards() -> List[dict]:
+    """Latest heartbeat of every shard: the sessions it runs, their health and its ingest counters."""
+    r = get_redis()
+    shards = []
+    for shard in range(ring.shards):
+        payload = await r.get(f"{HEARTBEAT_PREFIX}{shard}")
+        shards.append({"shard": shard, "alive": payload is not None, **(json.loads(payload) if payload else {})})
+    return shards
+
+async def _handle(request: dict):
+    try: result = await OPS[request["op"]](**request["kwargs"])
+    except Exception as e: result = {"error": str(e)}
+    reply_key = f"{REPLY_PREFIX}{request['id']}"
+    async with get_redis().pipeline(transaction=True) as pipe:
+        pipe.rpush(reply_key, json.dumps(result, default=str))
+        pipe.expire(reply_key, settings.CLIENT_RPC_TIMEOUT * 2)
+        await pipe.execute()
+
+async def serve(shard: int):
+    """Takes commands off the shard's queue; each runs as its own task so a slow lookup does not hold the rest."""
+    r = get_redis()
+    while True:
+        try: item = await r.blpop(f"{RPC_PREFIX}{shard}", timeout=5)
+        except asyncio.CancelledError: raise
+        except Exception as e:
+            print(f"[CLIENT HOST {shard}] RPC queue unavailable: {e}")
+            await asyncio.sleep(1); continue
+        if not item: continue
+        request = json.loads(item[1])
+        # The caller has given up on requests older than its timeout; do not send messages it no longer expects
+        if time.time() - request.get("sent", time.time()) > settings.CLIENT_RPC_TIMEOUT: continue
+        asyncio.create_task(_handle(request))
+
+async def readiness() -> dict:
+    """Session health of this process, or of every shard in remote mode (ready once all shards are)."""
+    if not is_remote(): return session_supervisor.readiness()
+    shards = await read_shards()
+    return {"ready": all(shard.get("readiness", {}).get("ready") for shard in shards),
+            "shards": {str(shard["shard"]): shard.get("readiness") for shard in shards}}
+
+async def _heartbeat(shard: int):
+    while True:
+        try:
+            heartbeat = {"sessions": sorted(active_clients), "readiness": session_supervisor.readiness(),
+                         "ingest": message_ingest.stats(), "media_capture": media_capture.stats(), "updated": time.time()}
+            await get_redis().set(f"{HEARTBEAT_PREFIX}{shard}", json.dumps(heartbeat), ex=HEARTBEAT_SECONDS * 3)
+        except asyncio.CancelledError: raise
+        except Exception as e: print(f"[CLIENT HOST {shard}] Heartbeat failed: {e}")
+        await asyncio.sleep(HEARTBEAT_SECONDS)
+
+async def main(shard: int):
+    global current_shard
+    current_shard = shard
+    print(f"🚀 Starting Telegram client host shard {shard}/{ring.shards}...")
+    message_ingest.start()
+    media_capture.start()
+    session_supervisor.start()
+    heartbeat = asyncio.create_task(_heartbeat(shard))
+    server = asyncio.create_task(serve(shard))
+    # SIGTERM (docker stop, supervisor) and SIGINT stop taking commands; the cleanup below then runs in full
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT): loop.add_signal_handler(sig, server.cancel)
+    try: await server
+    except asyncio.CancelledError: print(f"[CLIENT HOST {shard}] Stopping: closing clients and flushing buffered messages")
+    finally:
+        heartbeat.cancel()
+        await session_supervisor.close()
+        await media_capture.close()
+        await message_ingest.close()
+
+def run_shard(shard: int): asyncio.run(main(shard))
+
+def supervise():
+    """Keeps one process per shard running."""
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))  # run the finally below on docker stop
+    ctx = multiprocessing.get_context("spawn")
+    processes: Dict[int, multiprocessing.Process] = {}
+    try:
+        while True:
+            for shard in range(ring.shards):
+                process = processes.get(shard)
+                if process is None or not process.is_alive():
+                    if process is not None: print(f"[CLIENT HOST] Shard {shard} exited ({process.exitcode}), restarting")
+                    processes[shard] = ctx.Process(target=run_shard, args=(shard,), name=f"client-host-{shard}", daemon=True)
+                    processes[shard].start()
+            time.sleep(2)
+    finally:
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        for process in processes.values(): process.terminate()
+        # Each shard flushes its ingest buffer on SIGTERM; only one that overruns the grace period is killed
+        deadline = time.monotonic() + settings.CLIENT_HOST_SHUTDOWN_GRACE
+        for shard, process in processes.items():
+            process.join(max(deadline - time.monotonic(), 0))
+            if process.is_alive():
+                print(f"[CLIENT HOST] Shard {shard} did not stop in time, killing it")
+                process.kill(); process.join()
+
+if __name__ == "__main__":
+    if ring.shards == 1: run_shard(0)
+    else: supervise()
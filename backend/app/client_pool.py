@@ -0,0 +1,129 @@
+"""
+Per-process pool of warm Pyrogram clients for Celery workers.
+Keeps one connection per Telegram session alive between tasks and stops it once idle.
+The per-session chat budget is shared by every worker process through Redis.
+"""
+from pyrogram import Client
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+import asyncio
+import os
+import time
+import uuid
+from app.redis_client import get_redis
+
+SLOTS_PREFIX = "superapp:chat_slots:"
+SLOT_TTL = 60  # a slot whose holder stopped renewing it (crashed process) is free again after this long
+SLOT_POLL_SECONDS = 0.5
+
+# Drops expired holders, then takes a slot if one is free. KEYS[1] = slot set; ARGV = token, limit, now, ttl
+ACQUIRE_SLOT_LUA = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[3])
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[2]) then return 0 end
+redis.call('ZADD', KEYS[1], tonumber(ARGV[3]) + tonumber(ARGV[4]), ARGV[1])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return 1
+"""
+
+class ChatSlot:
+    """One of a session's `limit` concurrent chat slots across all processes; use as `async with`."""
+    def __init__(self, session_id: int, limit: int):
+        self._key = f"{SLOTS_PREFIX}{session_id}"
+        self._limit = limit
+        self._token = str(uuid.uuid4())
+        self._renewer: Optional[asyncio.Task] = None
+
+    async def __aenter__(self):
+        r = get_redis()
+        while not await r.eval(ACQUIRE_SLOT_LUA, 1, self._key, self._token, self._limit, time.time(), SLOT_TTL):
+            await asyncio.sleep(SLOT_POLL_SECONDS)
+        self._renewer = asyncio.create_task(self._renew())
+        return self
+
+    async def _renew(self):
+        while True:
+            await asyncio.sleep(SLOT_TTL / 3)
+            try:
+                # The set's own TTL must move with the holders, or it expires under a long chat and frees every slot
+                async with get_redis().pipeline(transaction=True) as pipe:
+                    pipe.zadd(self._key, {self._token: time.time() + SLOT_TTL}, xx=True)
+                    pipe.expire(self._key, SLOT_TTL)
+                    await pipe.execute()
+            except Exception as e: print(f"[POOL] Could not renew chat slot {self._key}: {e}")
+
+    async def __aexit__(self, *exc):
+        self._renewer.cancel()
+        try: await get_redis().zrem(self._key, self._token)
+        except Exception as e: print(f"[POOL] Could not release chat slot {self._key}: {e}")
+
+CredentialLoader = Callable[[int], Awaitable[Tuple[Optional[str], Optional[str], Optional[str]]]]
+
+class TelegramClientPool:
+    def __init__(self, loader: CredentialLoader, idle_timeout: float = 600, max_concurrent_transmissions: int = 1, chats_per_session: int = 3):
+        self._loader = loader
+        self._idle_timeout = idle_timeout
+        self._max_transmissions = max_concurrent_transmissions
+        self._clients: Dict[int, Client] = {}
+        self._session_strings: Dict[int, str] = {}
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._users: Dict[int, int] = {}
+        self._last_used: Dict[int, float] = {}
+        self._reaper: Optional[asyncio.Task] = None
+        self._chats_per_session = chats_per_session
+
+    async def acquire(self, session_id: int) -> Optional[Client]:
+        """Returns a started client for the session, or None if the session does not exist."""
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.create_task(self._reap_idle())
+        # One lock per session guarantees a single connection even when tasks race
+        async with self._locks.setdefault(session_id, asyncio.Lock()):
+            session_string, api_id, api_hash = await self._loader(session_id)
+            if not session_string: return None
+            client = self._clients.get(session_id)
+            if client and (not client.is_connected or self._session_strings.get(session_id) != session_string):
+                await self._stop(session_id)
+                client = None
+            if client is None:
+                workdir = f"./sessions/worker_{session_id}"
+                os.makedirs(workdir, exist_ok=True)
+                client = Client(name=f"worker_{session_id}", api_id=int(api_id), api_hash=api_hash, session_string=session_string, workdir=workdir,
+                                no_updates=True, ipv6=False, max_concurrent_transmissions=self._max_transmissions)
+                await client.start()
+                self._clients[session_id] = client
+                self._session_strings[session_id] = session_string
+                print(f"[POOL] Client {session_id} connected")
+            self._users[session_id] = self._users.get(session_id, 0) + 1
+            return client
+
+    def chat_budget(self, session_id: int) -> ChatSlot:
+        """One chat's slot: caps how many chats all tasks, in every worker process, work on concurrently through one session."""
+        return ChatSlot(session_id, self._chats_per_session)
+
+    def release(self, session_id: int):
+        self._users[session_id] = max(self._users.get(session_id, 1) - 1, 0)
+        self._last_used[session_id] = time.monotonic()
+
+    async def _stop(self, session_id: int):
+        client = self._clients.pop(session_id, None)
+        self._session_strings.pop(session_id, None)
+        self._last_used.pop(session_id, None)
+        if client and client.is_connected:
+            try: await client.stop()
+            except Exception as e: print(f"[POOL] Error stopping client {session_id}: {e}")
+
+    async def evict_idle(self):
+        now = time.monotonic()
+        for session_id in list(self._clients):
+            if self._users.get(session_id, 0) == 0 and now - self._last_used.get(session_id, now) >= self._idle_timeout:
+                async with self._locks[session_id]:
+                    if self._users.get(session_id, 0) == 0:
+                        await self._stop(session_id)
+                        print(f"[POOL] Client {session_id} evicted after idling")
+
+    async def _reap_idle(self):
+        while True:
+            await asyncio.sleep(max(self._idle_timeout / 4, 5))
+            await self.evict_idle()
+
+    async def close_all(self):
+        if self._reaper: self._reaper.cancel()
+        for session_id in list(self._clients): await self._stop(session_id)
@@ -20,6 +20,83 @@ class Settings(BaseSettings):
 
     # MinIO External (Browser Access)
     MINIO_PUBLIC_ENDPOINT: str = "localhost:9000"
+
+    # Download pipeline (Celery worker)
+    DOWNLOAD_CONCURRENCY: int = 3
+    UPLOAD_CONCURRENCY: int = 2  # parallel multipart part uploads per streamed object
+    UPLOAD_THREADS: int = 8  # streamed objects uploading at once per process; later streams wait for a slot
+    MINIO_PART_SIZE: int = 8 * 1024 * 1024
+    SESSION_CHAT_CONCURRENCY: int = 3  # chats processed at once per Telegram session
+    WORKER_CLIENT_IDLE_SECONDS: int = 600  # pooled worker clients are stopped after this much idle time
+    WORKER_DB_POOL_MIN: int = 1
+    WORKER_DB_POOL_MAX: int = 5
+    WORKER_METRICS_INTERVAL: int = 15
+    WORKER_SHUTDOWN_GRACE: int = 20  # seconds a revoked task gets to flush buffered writes
+    DUMP_BATCH_SIZE: int = 500
+    DUMP_FLUSH_SECONDS: float = 2.0
+    STREAM_BUFFER_CHUNKS: int = 4  # 1 MiB Telegram chunks held between download and upload
+    PARALLEL_DOWNLOAD_THRESHOLD: int = 256 * 1024 * 1024  # files at least this large are fetched as parallel byte ranges
+    PARALLEL_DOWNLOAD_STREAMS: int = 4  # concurrent ranges (each its own media session) per large file
+    PARALLEL_DOWNLOAD_BUFFER: int = 128 * 1024 * 1024  # bytes of a large file held between its range streams and the upload
+    DOWNLOAD_ESTIMATE_BPS: int = 5 * 1024 * 1024  # assumed rate for time estimates until a session has a measured one
+    BANDWIDTH_GLOBAL_CAP: int = 100 * 1024 * 1024  # bytes/sec shared by all download tasks; 0 disables the broker
+    BANDWIDTH_MIN_SHARE: int = 1024 * 1024  # floor for any single task's share
+    BANDWIDTH_REFRESH_SECONDS: float = 2.0
+    PIPELINE_QUEUE_SIZE: int = 10
+    METADATA_BATCH_SIZE: int = 25
+    METADATA_FLUSH_SECONDS: float = 2.0
+
+    # Telegram rate limits per session, shared by every worker through Redis (requests/second, burst)
+    RATE_LIMIT_HISTORY_RATE: float = 3.0
+    RATE_LIMIT_HISTORY_BURST: int = 5
+    RATE_LIMIT_DOWNLOAD_RATE: float = 20.0  # 1 MiB chunk requests
+    RATE_LIMIT_DOWNLOAD_BURST: int = 40
+    RATE_LIMIT_SEND_RATE: float = 0.5
+    RATE_LIMIT_SEND_BURST: int = 3
+    RATE_LIMIT_MIN_FRACTION: float = 0.1  # FloodWait halving never drops below this share of the configured rate
+    RATE_LIMIT_RECOVERY_SECONDS: float = 300  # time to climb from zero back to the configured rate
+
+    # Task dispatch: per-user fair queuing in front of per-lane Celery queues
+    DISPATCH_QUEUE_DEPTH: int = 2  # jobs allowed to sit in each Celery queue; the rest wait in the fair queue
+    DISPATCH_INTERVAL: float = 1.0
+    INTERACTIVE_MAX_CHATS: int = 3  # larger downloads/dumps (or "all chats") go to the bulk lane
+
+    # Live message ingestion (write-behind into message_logs)
+    INGEST_BATCH_SIZE: int = 200
+    INGEST_FLUSH_MS: int = 250
+    INGEST_MAX_PENDING: int = 10000  # rows held in memory; beyond this they spill to disk
+    INGEST_SPILL_DIR: str = "./sessions/spill"  # append-only segment files, replayed once the queue drains
+    INGEST_SEGMENT_BYTES: int = 16 * 1024 * 1024
+    INGEST_SPILL_STALE_SECONDS: int = 300  # open/replaying segments untouched this long belong to a dead process
+
+    # Telegram client hosting
+    CLIENT_HOST_MODE: str = "embedded"  # embedded: the API owns the clients (one worker only) | remote: python -m app.client_host
+    CLIENT_HOST_PROCESSES: int = 2  # shard processes; the API must use the same value to route commands
+    CLIENT_HOST_REBALANCE_SECONDS: int = 30  # how often running clients are reconciled with the active sessions
+    CLIENT_HOST_SHUTDOWN_GRACE: int = 25  # seconds a stopping shard gets to stop its clients and flush ingest before it is killed
+    SESSION_WARMUP_CONCURRENCY: int = 5  # session handshakes at once per process
+    SESSION_START_TIMEOUT: int = 60  # seconds one start attempt may take
+    SESSION_RETRY_BASE: float = 2.0  # first retry delay; doubles per failed attempt
+    SESSION_RETRY_MAX: float = 300.0
+    SESSION_ENSURE_WAIT: float = 15.0  # how long a request waits for a session that is not up yet
+    CLIENT_RPC_TIMEOUT: int = 30  # seconds the API waits for the client host to answer
+    LOGIN_STATE_TTL: int = 600  # seconds a half-finished Telegram login stays resumable
+
+    # Live media capture (per-session MediaCaptureRule rows opt sessions in)
+    MEDIA_CAPTURE_ENABLED: bool = True  # master switch
+    MEDIA_CAPTURE_WORKERS: int = 2  # concurrent uploads per client-host process
+    MEDIA_CAPTURE_QUEUE_SIZE: int = 200  # captures beyond this are dropped, the message itself is still logged
+    MEDIA_CAPTURE_MAX_FILE_SIZE: int = 50 * 1024 * 1024  # default cap for rules without their own
+    MEDIA_CAPTURE_RULES_REFRESH: int = 30  # seconds between rule reloads
+
+    # Live feed WebSocket fan-out
+    WS_SEND_QUEUE_SIZE: int = 256  # messages queued per subscriber
+    WS_SLOW_CONSUMER_POLICY: str = "drop_oldest"  # drop_oldest | drop_newest | sample | disconnect
+    WS_SAMPLE_EVERY: int = 5
+
+    # Task progress events (Redis pub/sub, fanned out over WebSocket)
+    PROGRESS_MIN_INTERVAL: float = 0.25  # per task; updates in between are coalesced
+    PROGRESS_SNAPSHOT_TTL: int = 86400
     
     class Config:
         env_file = ".env"
@@ -1,9 +1,11 @@
 """
 Database configuration and session management
 """
+from sqlalchemy import text
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import declarative_base
 from app.config import settings
+from app.search import FTS_TABLES
 
 # Create async engine
 engine = create_async_engine(
@@ -34,10 +36,64 @@ async def get_db() -> AsyncSession:
             await session.close()
 
 
+# downloaded_files rows became references to shared media objects: file_path is no longer unique on its own
+DOWNLOADED_FILES_DDL = [
+    "ALTER TABLE downloaded_files ADD COLUMN IF NOT EXISTS file_unique_id VARCHAR(100)",
+    "CREATE INDEX IF NOT EXISTS ix_downloaded_files_file_unique_id ON downloaded_files (file_unique_id)",
+    "ALTER TABLE downloaded_files DROP CONSTRAINT IF EXISTS downloaded_files_file_path_key",
+    "CREATE INDEX IF NOT EXISTS ix_downloaded_files_file_path ON downloaded_files (file_path)",
+    # Multi-GB files overflow INTEGER; checked first so later starts do not take the table lock again
+    """DO $$ BEGIN
+        IF EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name = 'downloaded_files' AND column_name = 'file_size' AND data_type = 'integer') THEN
+            ALTER TABLE downloaded_files ALTER COLUMN file_size TYPE BIGINT;
+        END IF;
+    END $$""",
+    """DO $$ BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = '_downloaded_file_ref_uc') THEN
+            ALTER TABLE downloaded_files ADD CONSTRAINT _downloaded_file_ref_uc UNIQUE (file_path, chat_id, message_id);
+        END IF;
+    END $$""",
+]
+
+# dump_checkpoints gained the date its coverage starts from
+DUMP_CHECKPOINTS_DDL = ["ALTER TABLE dump_checkpoints ADD COLUMN IF NOT EXISTS covered_from TIMESTAMP"]
+
+SEARCH_TABLES = ("message_logs", "dumped_messages")
+
+
+async def migrate_search():
+    """
+    One-off step for databases created before full-text search (python -m app.migrate_search).
+    ADD COLUMN ... STORED rewrites the table under an exclusive lock, so run it in a quiet window;
+    the GIN indexes are then built CONCURRENTLY, outside a transaction, and do not block writes.
+    """
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        await conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        for table in SEARCH_TABLES:
+            print(f"[DB] Adding {table}.search_vector...")
+            await conn.execute(text(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS search_vector tsvector "
+                                    "GENERATED ALWAYS AS (to_tsvector('simple'::regconfig, coalesce(content, ''))) STORED"))
+            for index, definition in ((f"ix_{table}_search_vector", "gin (search_vector)"), (f"ix_{table}_content_trgm", "gin (content gin_trgm_ops)")):
+                # An interrupted concurrent build leaves an invalid index behind that IF NOT EXISTS would keep
+                invalid = (await conn.execute(text("SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+                                                   "WHERE c.relname = :name AND NOT i.indisvalid"), {"name": index})).scalar()
+                if invalid: await conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {index}"))
+                print(f"[DB] Building {index}...")
+                await conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index} ON {table} USING {definition}"))
+
+
 async def init_db():
     """
     Initialize database tables
     """
     async with engine.begin() as conn:
+        await conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
         await conn.run_sync(Base.metadata.create_all)
-
+        for statement in DOWNLOADED_FILES_DDL + DUMP_CHECKPOINTS_DDL: await conn.execute(text(statement))
+        # New tables get search_vector from the models; older ones need the one-off migration, never run at startup
+        found = set((await conn.execute(text("SELECT table_name FROM information_schema.columns WHERE column_name = 'search_vector' "
+                                             "AND table_name IN ('message_logs', 'dumped_messages')"))).scalars().all())
+    FTS_TABLES.update(found)
+    for table in SEARCH_TABLES:
+        if table not in found: print(f"⚠️ {table} has no search_vector column: search falls back to substring matching until `python -m app.migrate_search` is run and the API restarted")
@@ -51,6 +51,21 @@ async def get_current_user(
     return user
 
 
+async def get_websocket_user(token: Optional[str], db: AsyncSession) -> Optional[User]:
+    """
+    Resolves the ?token= query parameter of a WebSocket, which cannot send an Authorization header.
+    Returns None instead of raising, so the caller can refuse the handshake.
+    """
+    if not token: return None
+    try: payload = decode_access_token(token)
+    except HTTPException: return None
+    user_id = payload.get("sub")
+    if user_id is None: return None
+    user = (await db.execute(select(User).where(User.id == int(user_id)))).scalar_one_or_none()
+    if user is None or user.status == UserStatus.BANNED: return None
+    return user
+
+
 async def get_admin_user(
     current_user: User = Depends(get_current_user)
 ) -> User:
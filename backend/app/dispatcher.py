@@ -0,0 +1,228 @@
+"""
+Fair dispatcher in front of Celery. Jobs wait in Redis per lane and per user; the dispatcher releases
+them round-robin across users into one Celery queue per task type and lane, keeping each queue only
+DISPATCH_QUEUE_DEPTH deep so ordering is decided here rather than by the broker's FIFO. Interactive
+lanes are always served before bulk ones. Workers consume lanes separately (see docker-compose).
+"""
+from typing import Optional
+from kombu.utils.json import dumps, loads
+import asyncio
+import time
+import uuid
+from app.config import settings
+from app.redis_client import get_redis
+from app.progress import snapshot_key
+from app.celery_worker import celery_app
+
+INTERACTIVE, BULK = "interactive", "bulk"
+LANES = {
+    # Celery queue: lane
+    "broadcasts.interactive": INTERACTIVE,
+    "downloads.interactive": INTERACTIVE,
+    "dumps.interactive": INTERACTIVE,
+    "downloads.bulk": BULK,
+    "dumps.bulk": BULK,
+}
+PREFIX = "superapp:dispatch"
+OWNER_PREFIX = "superapp:tasks:owner:"
+OWNER_TTL = 7 * 86400  # long enough to outlive any task; read by the progress WebSocket
+
+# Pops the next job of the user at the head of the rotation, moving that user to the back if more remain.
+# The broker depth check happens in the same script, and the job moves to the in-flight hash until it is
+# acknowledged after send_task, so dispatchers in several processes never overfill a queue or lose a job.
+POP_LUA = """
+local rotation, members, jobs, broker, inflight, inflight_at = KEYS[1], KEYS[2], KEYS[3], KEYS[4], KEYS[5], KEYS[6]
+if redis.call('LLEN', broker) + redis.call('HLEN', inflight) >= tonumber(ARGV[2]) then return false end
+local uid = redis.call('LPOP', rotation)
+while uid do
+  local pending = ARGV[1] .. ':user:' .. uid
+  local task_id = redis.call('LPOP', pending)
+  while task_id do
+    local job = redis.call('HGET', jobs, task_id)
+    if job then
+      redis.call('HDEL', jobs, task_id)
+      redis.call('HSET', inflight, task_id, job)
+      redis.call('ZADD', inflight_at, ARGV[3], task_id)
+      if redis.call('LLEN', pending) > 0 then redis.call('RPUSH', rotation, uid) else redis.call('SREM', members, uid) end
+      return job
+    end
+    task_id = redis.call('LPOP', pending)  -- cancelled while waiting
+  end
+  redis.call('SREM', members, uid)
+  uid = redis.call('LPOP', rotation)
+end
+return false
+"""
+
+# Puts in-flight jobs (ARGV[2..]) back at the front of their users' lines; ids already acknowledged are skipped
+RESTORE_LUA = """
+local rotation, members, jobs, inflight, inflight_at = KEYS[1], KEYS[2], KEYS[3], KEYS[4], KEYS[5]
+local restored = 0
+for i = 2, #ARGV do
+  local task_id = ARGV[i]
+  local job = redis.call('HGET', inflight, task_id)
+  redis.call('HDEL', inflight, task_id)
+  redis.call('ZREM', inflight_at, task_id)
+  if job then
+    local uid = cjson.decode(job)['user_id']
+    redis.call('HSET', jobs, task_id, job)
+    redis.call('LPUSH', ARGV[1] .. ':user:' .. uid, task_id)
+    if redis.call('SADD', members, uid) == 1 then redis.call('LPUSH', rotation, uid) end
+    restored = restored + 1
+  end
+end
+return restored
+"""
+INFLIGHT_STALE_SECONDS = 60  # a job popped this long ago and never acknowledged belonged to a dispatcher that died
+
+def queue_for(task_type: str, bulk: bool) -> str:
+    queue = f"{task_type}.{BULK if bulk else INTERACTIVE}"
+    return queue if queue in LANES else f"{task_type}.{INTERACTIVE}"
+
+def _keys(queue: str):
+    base = f"{PREFIX}:{queue}"
+    return base, f"{base}:rotation", f"{base}:members", f"{base}:jobs", f"{base}:stats"
+
+def _inflight_keys(queue: str):
+    base = f"{PREFIX}:{queue}"
+    return f"{base}:inflight", f"{base}:inflight_at"
+
+class FairDispatcher:
+    def __init__(self, celery_app):
+        self.celery_app = celery_app
+        self._pop = None
+        self._restore = None
+        self._loop_task: Optional[asyncio.Task] = None
+        self._wake = asyncio.Event()
+
+    def _pop_script(self):
+        if self._pop is None: self._pop = get_redis().register_script(POP_LUA)
+        return self._pop
+
+    def _restore_script(self):
+        if self._restore is None: self._restore = get_redis().register_script(RESTORE_LUA)
+        return self._restore
+
+    async def submit(self, task, args: list, kwargs: dict = None, user_id: Optional[int] = None, queue: str = "downloads.interactive") -> str:
+        """Queues a job for `task` and returns the Celery task id it will run under."""
+        task_id = str(uuid.uuid4())
+        uid = str(user_id) if user_id is not None else "system"
+        base, rotation, members, jobs, _ = _keys(queue)
+        job = dumps({"task": task.name, "args": args, "kwargs": kwargs or {}, "task_id": task_id, "user_id": uid, "queue": queue, "submitted": time.time()})
+        r = get_redis()
+        async with r.pipeline(transaction=True) as pipe:
+            pipe.hset(jobs, task_id, job)
+            pipe.rpush(f"{base}:user:{uid}", task_id)
+            pipe.sadd(members, uid)
+            pipe.set(f"{OWNER_PREFIX}{task_id}", uid, ex=OWNER_TTL)
+            added = (await pipe.execute())[2]
+        if added: await r.rpush(rotation, uid)
+        await r.set(snapshot_key(task_id), dumps({"task_id": task_id, "status": "PENDING", "info": {"status": f"Waiting in {LANES[queue]} lane..."}}),
+                    ex=settings.PROGRESS_SNAPSHOT_TTL)
+        self._wake.set()
+        return task_id
+
+    async def owner(self, task_id: str) -> Optional[str]:
+        """The submitting user's id as a string ("system" for jobs without one), or None if unknown."""
+        return await get_redis().get(f"{OWNER_PREFIX}{task_id}")
+
+    async def cancel(self, task_id: str) -> bool:
+        """Drops a job that has not been dispatched yet; returns False if it already reached Celery."""
+        r = get_redis()
+        for queue in LANES:
+            if await r.hdel(_keys(queue)[3], task_id):
+                # The task never reaches Celery, so the snapshot is its only record of the final state
+                await r.set(snapshot_key(task_id), dumps({"task_id": task_id, "status": "REVOKED", "info": {"status": "cancelled"}}),
+                            ex=settings.PROGRESS_SNAPSHOT_TTL)
+                return True
+        return False
+
+    async def _requeue(self, queue: str, task_ids: list) -> int:
+        """Puts in-flight jobs (publish failed, or their dispatcher died) back at the front of their users' lines."""
+        base, rotation, members, jobs, _ = _keys(queue)
+        return await self._restore_script()(keys=[rotation, members, jobs, *_inflight_keys(queue)], args=[base, *task_ids])
+
+    async def recover_stale(self) -> int:
+        """
+        Requeues jobs popped by a dispatcher that never acknowledged them. Delivery is at-least-once:
+        a dispatcher that died between send_task and the acknowledgement has its job sent twice.
+        """
+        r = get_redis()
+        recovered = 0
+        for queue in LANES:
+            stale = await r.zrangebyscore(_inflight_keys(queue)[1], "-inf", time.time() - INFLIGHT_STALE_SECONDS)
+            if stale: recovered += await self._requeue(queue, stale)
+        if recovered: print(f"[DISPATCH] Requeued {recovered} unacknowledged jobs")
+        return recovered
+
+    async def dispatch_once(self) -> int:
+        r = get_redis()
+        await self.recover_stale()
+        sent = 0
+        for lane in (INTERACTIVE, BULK):
+            queues = [q for q, l in LANES.items() if l == lane]
+            progress = True
+            # Round-robin across the lane's queues until each is full or empty
+            while progress:
+                progress = False
+                for queue in queues:
+                    base, rotation, members, jobs, stats = _keys(queue)
+                    inflight, inflight_at = _inflight_keys(queue)
+                    job = await self._pop_script()(keys=[rotation, members, jobs, queue, inflight, inflight_at],
+                                                   args=[base, settings.DISPATCH_QUEUE_DEPTH, time.time()])
+                    if not job: continue
+                    job = loads(job)
+                    try: self.celery_app.send_task(job["task"], args=job["args"], kwargs=job["kwargs"], task_id=job["task_id"], queue=queue)
+                    except Exception:
+                        await self._requeue(queue, [job["task_id"]])
+                        raise
+                    waited = time.time() - job["submitted"]
+                    async with r.pipeline(transaction=False) as pipe:
+                        pipe.hdel(inflight, job["task_id"])
+                        pipe.zrem(inflight_at, job["task_id"])
+                        pipe.hincrby(stats, "dispatched", 1)
+                        pipe.hincrbyfloat(stats, "wait_seconds_total", waited)
+                        pipe.hset(stats, "last_wait_seconds", round(waited, 2))
+                        await pipe.execute()
+                    sent += 1; progress = True
+        return sent
+
+    async def run(self):
+        while True:
+            try: await self.dispatch_once()
+            except asyncio.CancelledError: raise
+            except Exception as e: print(f"[DISPATCH] Error: {e}")
+            self._wake.clear()
+            try: await asyncio.wait_for(self._wake.wait(), timeout=settings.DISPATCH_INTERVAL)
+            except asyncio.TimeoutError: pass
+
+    def start(self):
+        if self._loop_task is None or self._loop_task.done(): self._loop_task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._loop_task: self._loop_task.cancel()
+
+    async def lane_metrics(self) -> dict:
+        """Per Celery queue: jobs waiting for dispatch, jobs in the broker, users waiting, oldest and average wait."""
+        r = get_redis()
+        now = time.time()
+        result = {}
+        for queue, lane in LANES.items():
+            base, rotation, members, jobs, stats = _keys(queue)
+            pending = [loads(j) for j in (await r.hvals(jobs))]
+            counters = await r.hgetall(stats)
+            dispatched = int(counters.get("dispatched", 0))
+            result[queue] = {
+                "lane": lane,
+                "waiting": len(pending),
+                "in_broker": await r.llen(queue),
+                "in_flight": await r.hlen(_inflight_keys(queue)[0]),
+                "users_waiting": await r.scard(members),
+                "oldest_wait_seconds": round(max((now - j["submitted"] for j in pending), default=0), 1),
+                "dispatched": dispatched,
+                "avg_wait_seconds": round(float(counters.get("wait_seconds_total", 0)) / dispatched, 2) if dispatched else 0,
+                "last_wait_seconds": float(counters.get("last_wait_seconds", 0)),
+            }
+        return result
+
+dispatcher = FairDispatcher(celery_app)
@@ -0,0 +1,306 @@
+"""
+Write-behind buffer for live Telegram messages. The persistence handler hands rows over and returns at
+once; rows are written to message_logs in batches with one multi-row INSERT ... RETURNING, every
+INGEST_BATCH_SIZE rows or INGEST_FLUSH_MS milliseconds, whichever comes first.
+
+The in-memory queue holds at most INGEST_MAX_PENDING rows. Beyond that (or while the database is
+failing) rows are appended to segment files under INGEST_SPILL_DIR, which are replayed oldest first once
+the queue has drained. Replay is at-least-once: a crash mid-segment replays that segment again.
+
+A batch the database rejects for its content (constraint or data errors) is retried row by row, and the
+rows that still fail go to INGEST_SPILL_DIR/dead-letter with the error instead of blocking the queue.
+Replay does the same, dead-letters lines it cannot decode, and moves a segment that keeps failing for any
+reason other than a lost database connection to INGEST_SPILL_DIR/quarantine.
+"""
+from sqlalchemy import insert, update
+from sqlalchemy.exc import DataError, IntegrityError, InterfaceError, OperationalError
+from datetime import datetime
+from typing import Dict, List, Optional, TextIO, Tuple
+import asyncio
+import json
+import os
+import socket
+import time
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app.models import MessageLog
+from app.redis_client import get_redis
+
+DATETIME_FIELDS = ("timestamp", "created_at")
+REPLAY_RETRY_SECONDS = 5  # pause replay this long after any failed write
+MEDIA_PATH_PREFIX = "superapp:ingest:media_path:"
+MEDIA_PATH_TTL = 7 * 86400  # how long a captured path waits for its spilled row to be written
+REPLAY_MAX_FAILURES = 5  # a segment failing this often for reasons other than the connection is quarantined
+
+def _encode(row: dict) -> str:
+    return json.dumps({k: v.isoformat() if isinstance(v, datetime) else v for k, v in row.items()})
+
+def _decode(line: str) -> dict:
+    row = json.loads(line)
+    for field in DATETIME_FIELDS:
+        if row.get(field): row[field] = datetime.fromisoformat(row[field])
+    return row
+
+def media_path_key(session_id: int, chat_id: str, telegram_message_id: int) -> str:
+    """Redis key under which media capture leaves a path for a row that was not in the database yet."""
+    return f"{MEDIA_PATH_PREFIX}{session_id}:{chat_id}:{telegram_message_id}"
+
+def _is_transient(error: Exception) -> bool:
+    """Errors that say nothing about the rows being written: the database or the network is down."""
+    return isinstance(error, (OperationalError, InterfaceError, OSError, asyncio.TimeoutError)) or getattr(error, "connection_invalidated", False)
+
+def _segment_created(name: str) -> float:
+    """Segment names are segment-<created ms>-<host>-<pid>.<state>."""
+    try: return int(name.split("-")[1]) / 1000
+    except (IndexError, ValueError): return time.time()
+
+class SpillLog:
+    """Append-only segment files. The open segment is sealed when it is full or when the replayer wants it."""
+    def __init__(self, directory: str = None, segment_bytes: int = None):
+        self.directory = directory or settings.INGEST_SPILL_DIR
+        self.segment_bytes = segment_bytes or settings.INGEST_SEGMENT_BYTES
+        self._owner = f"{socket.gethostname()}-{os.getpid()}"
+        self._file: Optional[TextIO] = None
+        self._path: Optional[str] = None
+        self.rows = 0
+        self.bytes = 0
+
+    def append(self, rows: List[dict]):
+        if self._file is not None and not os.path.exists(self._path):
+            # Taken over as abandoned while we sat idle; start a fresh segment rather than write into one being replayed
+            self._file.close(); self._file = None
+        if self._file is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._path = os.path.join(self.directory, f"segment-{int(time.time() * 1000)}-{self._owner}.open")
+            self._file = open(self._path, "a", encoding="utf-8")
+        data = "".join(_encode(row) + "\n" for row in rows)
+        self._file.write(data); self._file.flush()
+        self.rows += len(rows); self.bytes += len(data)
+        if self._file.tell() >= self.segment_bytes: self.seal()
+
+    def seal(self):
+        if self._file is None: return
+        self._file.close()
+        os.rename(self._path, self._path[:-len(".open")] + ".sealed")
+        self._file = None; self._path = None
+
+    def names(self, suffix: str) -> List[str]:
+        try: return sorted(n for n in os.listdir(self.directory) if n.startswith("segment-") and n.endswith(suffix))
+        except FileNotFoundError: return []
+
+    def claim(self) -> Optional[str]:
+        """Takes the oldest sealed segment (from any process sharing the directory) for replay."""
+        self._recover_abandoned()
+        for name in self.names(".sealed"):
+            target = os.path.join(self.directory, f"{name[:-len('.sealed')]}.replaying")
+            try: os.rename(os.path.join(self.directory, name), target); return target
+            except FileNotFoundError: continue  # claimed by another process first
+        return None
+
+    def _recover_abandoned(self):
+        # Segments left open or half-replayed by a process that died are put back in line after a grace period
+        cutoff = time.time() - settings.INGEST_SPILL_STALE_SECONDS
+        for suffix in (".open", ".replaying"):
+            for name in self.names(suffix):
+                path = os.path.join(self.directory, name)
+                if path == self._path: continue
+                try:
+                    if os.path.getmtime(path) < cutoff: os.rename(path, path[:-len(suffix)] + ".sealed")
+                except FileNotFoundError: pass
+
+    def dead_letter(self, row: dict, error: Exception):
+        """Keeps a row the database refuses, with the reason, under <spill dir>/dead-letter for inspection."""
+        directory = os.path.join(self.directory, "dead-letter")
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f"rows-{self._owner}.jsonl"), "a", encoding="utf-8") as f:
+            f.write(json.dumps({"error": str(error)[:1000], "at": time.time(), "row": json.loads(_encode(row))}) + "\n")
+
+    def quarantine(self, path: str) -> str:
+        """Moves a segment out of the replay line into <spill dir>/quarantine; moving it back as .sealed retries it."""
+        directory = os.path.join(self.directory, "quarantine")
+        os.makedirs(directory, exist_ok=True)
+        target = os.path.join(directory, os.path.basename(path).rsplit(".", 1)[0] + ".sealed")
+        os.rename(path, target)
+        return target
+
+    def pending(self) -> List[str]:
+        return self.names(".sealed") + self.names(".open") + self.names(".replaying")
+
+class MessageIngestBuffer:
+    def __init__(self, batch_size: int = None, flush_ms: int = None, max_pending: int = None):
+        self.batch_size = batch_size or settings.INGEST_BATCH_SIZE
+        self.flush_seconds = (flush_ms or settings.INGEST_FLUSH_MS) / 1000
+        self.max_pending = max_pending or settings.INGEST_MAX_PENDING
+        self.spill = SpillLog()
+        self._rows: List[dict] = []
+        self._lock = asyncio.Lock()
+        self._wake = asyncio.Event()
+        self._flusher: Optional[asyncio.Task] = None
+        self._replay_after = 0.0
+        self._replay_failures: Dict[str, int] = {}
+        self.counters = {'received': 0, 'written': 0, 'batches': 0, 'failed_flushes': 0, 'spilled': 0, 'replayed': 0, 'segments_replayed': 0, 'segments_quarantined': 0, 'dead_lettered': 0, 'media_paths_applied': 0}
+        self.last_flush_ms = 0.0
+        self.replay_lag_seconds = 0.0
+
+    def start(self):
+        if self._flusher is None or self._flusher.done(): self._flusher = asyncio.create_task(self._run())
+
+    async def add(self, row: dict):
+        """Never waits: a full queue sends the row to disk instead."""
+        self.counters['received'] += 1
+        if len(self._rows) >= self.max_pending:
+            self._spill([row]); return
+        self._rows.append(row)
+        if len(self._rows) >= self.batch_size: self._wake.set()
+
+    def _spill(self, rows: List[dict]):
+        try: self.spill.append(rows); self.counters['spilled'] += len(rows)
+        except OSError as e:
+            # Nowhere left to put them: keep them in memory rather than lose them
+            print(f"[INGEST] Spill of {len(rows)} messages failed: {e}")
+            self._rows.extend(rows)
+
+    async def _run(self):
+        while True:
+            try: await asyncio.wait_for(self._wake.wait(), timeout=self.flush_seconds)
+            except asyncio.TimeoutError: pass
+            self._wake.clear()
+            try:
+                if self._rows: await self.flush()
+                # Replay only with a drained queue and a database that is accepting writes
+                if len(self._rows) < self.batch_size and time.monotonic() >= self._replay_after: await self._replay_one()
+            except asyncio.CancelledError: raise
+            except Exception as e: print(f"[INGEST] Flusher error: {e}")
+
+    async def _insert(self, batch: List[dict]) -> int:
+        async with AsyncSessionLocal() as db:
+            ids = (await db.execute(insert(MessageLog).values(batch).returning(MessageLog.id))).scalars().all()
+            await db.commit()
+        return len(ids)
+
+    def _dead_letter(self, row: dict, error: Exception):
+        self.counters['dead_lettered'] += 1
+        print(f"[INGEST] Message {row.get('telegram_message_id')} in {row.get('chat_id')} rejected: {error}")
+        try: self.spill.dead_letter(row, error)
+        except OSError as e: print(f"[INGEST] Dead-letter write failed, message dropped: {e}")
+
+    async def _write(self, batch: List[dict]) -> Tuple[int, int, Optional[Exception]]:
+        """
+        Returns (rows written, rows handled, error). A batch rejected for its content is written row by row;
+        rows that fail on their own are dead-lettered and count as handled. Any other error stops the write.
+        """
+        try: return await self._insert(batch), len(batch), None
+        except (IntegrityError, DataError) as e: print(f"[INGEST] Batch of {len(batch)} messages rejected, writing them one by one: {e}")
+        except Exception as e: return 0, 0, e
+        written = 0
+        for handled, row in enumerate(batch):
+            try: written += await self._insert([row])
+            except (IntegrityError, DataError) as e: self._dead_letter(row, e)
+            except Exception as e: return written, handled, e
+        return written, len(batch), None
+
+    async def _apply_media_paths(self, rows: List[dict]):
+        """Fills media_path for just-written rows whose capture finished while they were in flight or on disk."""
+        # media_path on the dict is not enough: capture may have set it after the INSERT was built
+        rows = [row for row in rows if row.get("media_type")]
+        if not rows: return
+        try:
+            keys = [media_path_key(row["session_id"], row["chat_id"], row["telegram_message_id"]) for row in rows]
+            found = [(row, key, path) for row, key, path in zip(rows, keys, await get_redis().mget(keys)) if path]
+            if not found: return
+            async with AsyncSessionLocal() as db:
+                for row, _, path in found:
+                    await db.execute(update(MessageLog).where(MessageLog.session_id == row["session_id"], MessageLog.chat_id == row["chat_id"],
+                                                              MessageLog.telegram_message_id == row["telegram_message_id"]).values(media_path=path))
+                await db.commit()
+            await get_redis().delete(*[key for _, key, _ in found])
+            self.counters['media_paths_applied'] += len(found)
+        except Exception as e: print(f"[INGEST] Applying captured media paths failed: {e}")
+
+    async def flush(self):
+        async with self._lock:
+            while self._rows:
+                batch = self._rows[:self.batch_size]
+                started = time.monotonic()
+                written, handled, error = await self._write(batch)
+                await self._apply_media_paths(batch[:handled])
+                del self._rows[:handled]
+                self.counters['written'] += written
+                if error:
+                    self._replay_after = time.monotonic() + REPLAY_RETRY_SECONDS
+                    self.counters['failed_flushes'] += 1
+                    print(f"[INGEST] Flush of {len(batch) - handled} messages failed: {error}")
+                    overflow = len(self._rows) - self.max_pending // 2
+                    if overflow > 0:
+                        # Database still failing: move the oldest rows to disk so memory stays bounded
+                        spilled = self._rows[:overflow]
+                        del self._rows[:overflow]
+                        self._spill(spilled)
+                    return
+                self.counters['batches'] += 1
+                self.last_flush_ms = round((time.monotonic() - started) * 1000, 1)
+
+    async def _replay_batch(self, batch: List[dict]) -> int:
+        written, _, error = await self._write(batch)
+        if error:
+            self.counters['replayed'] += written
+            raise error
+        await self._apply_media_paths(batch)
+        return written
+
+    async def _replay_one(self):
+        if not self.spill.pending(): self.replay_lag_seconds = 0.0; return
+        # Our own open segment is sealed here so a quiet period eventually replays it too
+        if not self.spill.names(".sealed"): self.spill.seal()
+        path = self.spill.claim()
+        if not path: return
+        segment = os.path.basename(path)[:-len(".replaying")]
+        self.replay_lag_seconds = round(time.time() - _segment_created(segment), 1)
+        batch: List[dict] = []
+        replayed = 0
+        try:
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip(): continue
+                    # A line cut short by a crash mid-append cannot be decoded; set it aside, keep the rest
+                    try: batch.append(_decode(line))
+                    except (ValueError, AttributeError) as e: self._dead_letter({"raw": line.rstrip("\n")}, e); continue
+                    if len(batch) >= self.batch_size:
+                        replayed += await self._replay_batch(batch); batch = []
+                if batch: replayed += await self._replay_batch(batch)
+        except Exception as e:
+            self._replay_after = time.monotonic() + REPLAY_RETRY_SECONDS
+            failures = self._replay_failures.get(segment, 0) + (0 if _is_transient(e) else 1)
+            if failures >= REPLAY_MAX_FAILURES:
+                self._replay_failures.pop(segment, None)
+                self.counters['segments_quarantined'] += 1
+                print(f"[INGEST] Replay of {segment} failed {failures} times, quarantined at {self.spill.quarantine(path)}: {e}")
+            else:
+                self._replay_failures[segment] = failures
+                print(f"[INGEST] Replay of {segment} failed, will retry: {e}")
+                os.rename(path, path[:-len(".replaying")] + ".sealed")
+            return
+        finally:
+            self.counters['replayed'] += replayed
+        os.remove(path)
+        self._replay_failures.pop(segment, None)
+        self.counters['segments_replayed'] += 1
+
+    async def close(self):
+        """Stops the flusher and writes whatever is still buffered; unwritten rows stay on disk for the next start."""
+        if self._flusher:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+        await self.flush()
+        if self._rows: self._spill(self._rows); self._rows = []
+        self.spill.seal()
+
+    def stats(self) -> dict:
+        pending_segments = self.spill.pending()
+        oldest = min((_segment_created(name) for name in pending_segments), default=None)
+        return {**self.counters, 'pending': len(self._rows), 'max_pending': self.max_pending, 'last_flush_ms': self.last_flush_ms,
+                'batch_size': self.batch_size, 'flush_ms': int(self.flush_seconds * 1000),
+                'spill_rows': self.spill.rows, 'spill_bytes': self.spill.bytes, 'spill_segments': len(pending_segments),
+                'replay_lag_seconds': round(time.time() - oldest, 1) if oldest else 0.0, 'last_replay_lag_seconds': self.replay_lag_seconds}
+
+message_ingest = MessageIngestBuffer()
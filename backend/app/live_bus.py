@@ -0,0 +1,69 @@
+"""
+Live message feed over Redis pub/sub. Whichever process hosts a Telegram client publishes each incoming
+message, already normalized and serialized, on the session's channel; every API process subscribes once
+and hands events to its own WebSocket subscribers, so the API can run any number of workers.
+"""
+from typing import Optional
+import asyncio
+import json
+from app.redis_client import get_redis
+from app.ws_fanout import live_feed
+
+CHANNEL_PREFIX = "superapp:live:"
+
+def channel_name(session_id: int) -> str: return f"{CHANNEL_PREFIX}{session_id}"
+
+def message_event(session_id: int, row: dict) -> str:
+    """
+    The feed event for a message_logs row. It is published before the row is written, so it carries no
+    database id; (chat_id, telegram_message_id) identifies the message.
+    """
+    timestamp = row.get("timestamp")
+    ts_str = timestamp.isoformat() if timestamp else ""
+    if not ts_str.endswith("Z"): ts_str += "Z"
+    return json.dumps({
+        "type": "message", "session_id": session_id,
+        "message": {
+            "telegram_message_id": row.get("telegram_message_id"),
+            "chat_id": row.get("chat_id"), "chat_name": row.get("chat_name"), "chat_username": row.get("chat_username"),
+            "sender_id": row.get("sender_id"), "sender_name": row.get("sender_name"), "sender_username": row.get("sender_username"),
+            "content": row.get("content"), "media_type": row.get("media_type"), "timestamp": ts_str
+        }
+    })
+
+async def publish_message(session_id: int, row: dict):
+    await get_redis().publish(channel_name(session_id), message_event(session_id, row))
+
+class LiveBusListener:
+    """One pattern subscription per API process, forwarding every session's events to the local fan-out."""
+    def __init__(self):
+        self._listener: Optional[asyncio.Task] = None
+        self.received = 0
+
+    def start(self):
+        if self._listener is None or self._listener.done(): self._listener = asyncio.create_task(self._listen())
+
+    async def _listen(self):
+        while True:
+            pubsub = get_redis().pubsub()
+            try:
+                await pubsub.psubscribe(f"{CHANNEL_PREFIX}*")
+                while True:
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                    if not message: continue
+                    self.received += 1
+                    # Session subscribers plus the "all sessions" feed (key 0)
+                    live_feed.publish((int(message["channel"][len(CHANNEL_PREFIX):]), 0), message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[LIVE] Subscription lost, reconnecting: {e}")
+                await asyncio.sleep(1)
+            finally:
+                try: await pubsub.reset()
+                except Exception: pass
+
+    async def close(self):
+        if self._listener: self._listener.cancel()
+
+live_bus = LiveBusListener()
@@ -1,15 +1,22 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 from app.config import settings
 from app.database import init_db, AsyncSessionLocal, engine
-from app.routers import auth, admin, telegram, downloader, broadcaster, storage, dumper, academy
+from app.routers import auth, admin, telegram, downloader, broadcaster, storage, dumper, academy, tasks
 from app.models import TelegramSession, DumpTask
 from app.celery_worker import dump_messages_task
 from sqlalchemy import select, and_, text
 from datetime import datetime, timedelta
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from app.routers.academy import seed_japanese_characters
+from app.progress import progress_hub
+from app.dispatcher import dispatcher, queue_for
+from app.ingest import message_ingest
+from app.live_bus import live_bus
+from app.session_supervisor import session_supervisor
+from app.media_capture import media_capture
+from app import client_host
 
 scheduler = AsyncIOScheduler()
 
@@ -26,7 +33,8 @@ async def auto_dump_job():
             
             if not existing_task:
                 print(f"[SCHEDULER] Auto-dump starting for session {s.session_name}...")
-                dump_messages_task.apply_async(args=[s.id, [], today_start.isoformat(), today_end.isoformat(), None], kwargs={'is_auto': True})
+                await dispatcher.submit(dump_messages_task, [s.id, [], today_start.isoformat(), today_end.isoformat(), None], {'is_auto': True},
+                                        user_id=s.user_id, queue=queue_for('dumps', bulk=True))
             else:
                 print(f"[SCHEDULER] Dump exists for {s.session_name}. Skipping.")
 
@@ -43,9 +51,23 @@ async def lifespan(app: FastAPI):
             
     scheduler.add_job(auto_dump_job, 'cron', hour=0, minute=1)
     scheduler.start()
+    dispatcher.start()
+    message_ingest.start()
+    live_bus.start()
+    # Telegram clients live here only in embedded mode; otherwise each client-host shard runs its own supervisor
+    if not client_host.is_remote():
+        media_capture.start()
+        session_supervisor.start()
     
     yield
     print("👋 Shutting down...")
+    if not client_host.is_remote():
+        await session_supervisor.close()
+        await media_capture.close()
+    await live_bus.close()
+    await message_ingest.close()
+    await progress_hub.close()
+    await dispatcher.stop()
 
 app = FastAPI(title="Super App API", version="1.0.0", lifespan=lifespan)
 app.add_middleware(CORSMiddleware, allow_origins=settings.CORS_ORIGINS, allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
@@ -58,8 +80,17 @@ app.include_router(broadcaster.router)
 app.include_router(storage.router)
 app.include_router(dumper.router)
 app.include_router(academy.router)
+app.include_router(tasks.router)
 
 @app.get("/")
 async def root(): return {"status": "running"}
 @app.get("/health")
-async def health(): return {"status": "healthy"}
\ No newline at end of file
+async def health():
+    readiness = await client_host.readiness()
+    return {"status": "healthy", "ready": readiness["ready"], "sessions": readiness}
+@app.get("/health/ready")
+async def ready(response: Response):
+    """503 until every active session has had its first start attempt."""
+    readiness = await client_host.readiness()
+    if not readiness["ready"]: response.status_code = 503
+    return {"ready": readiness["ready"]}
\ No newline at end of file
@@ -0,0 +1,143 @@
+"""
+Background capture of live media into MinIO. The persistence handler offers each media message; if an
+enabled MediaCaptureRule of the session matches (media type, chat, size cap) the job goes on a bounded
+queue drained by MEDIA_CAPTURE_WORKERS workers that stream the file into MinIO and then fill
+message_logs.media_path. A full queue drops the capture, never the live message. A row that is not in the
+database yet (in a batch being written, or spilled to disk) gets its path from the ingest buffer when it
+is written, through a short-lived Redis key.
+"""
+from sqlalchemy import select, update, and_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from typing import Dict, List, Optional
+import asyncio
+import hashlib
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app.models import MediaCaptureRule, MediaObject, MessageLog
+from app.rate_limiter import rate_limiter
+from app.redis_client import get_redis
+from app.ingest import media_path_key, MEDIA_PATH_TTL
+from app.storage_service import StorageManager
+from app.media_stream import stream_to_storage, iter_media_chunks, describe_media
+
+class CaptureJob:
+    __slots__ = ("client", "session_id", "message", "row", "media")
+    def __init__(self, client, session_id: int, message, row: dict, media):
+        self.client = client; self.session_id = session_id; self.message = message; self.row = row; self.media = media
+
+class MediaCapturePipeline:
+    def __init__(self, workers: int = None, queue_size: int = None):
+        self.workers = workers or settings.MEDIA_CAPTURE_WORKERS
+        self._queue: Optional[asyncio.Queue] = None
+        self._queue_size = queue_size or settings.MEDIA_CAPTURE_QUEUE_SIZE
+        self._rules: Dict[int, List[MediaCaptureRule]] = {}
+        self._tasks: List[asyncio.Task] = []
+        self.counters = {'offered': 0, 'queued': 0, 'dropped': 0, 'captured': 0, 'deduplicated': 0, 'failed': 0, 'bytes': 0, 'path_deferred': 0}
+
+    def start(self):
+        if not settings.MEDIA_CAPTURE_ENABLED or self._tasks: return
+        self._queue = asyncio.Queue(maxsize=self._queue_size)
+        self._tasks = [asyncio.create_task(self._refresh_rules())] + [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def _refresh_rules(self):
+        # Rules are read from memory on the live path; edits through the API show up within one refresh
+        while True:
+            try:
+                async with AsyncSessionLocal() as db:
+                    rules = (await db.execute(select(MediaCaptureRule).where(MediaCaptureRule.enabled == True))).scalars().all()
+                by_session: Dict[int, List[MediaCaptureRule]] = {}
+                for rule in rules: by_session.setdefault(rule.session_id, []).append(rule)
+                self._rules = by_session
+            except asyncio.CancelledError: raise
+            except Exception as e: print(f"[CAPTURE] Rule refresh failed: {e}")
+            await asyncio.sleep(settings.MEDIA_CAPTURE_RULES_REFRESH)
+
+    def _matches(self, session_id: int, chat_id: str, media_type: str, size: int) -> bool:
+        for rule in self._rules.get(session_id, ()):
+            if rule.media_types and media_type not in rule.media_types: continue
+            if rule.chat_ids and chat_id not in rule.chat_ids: continue
+            if size > (rule.max_file_size or settings.MEDIA_CAPTURE_MAX_FILE_SIZE): continue
+            return True
+        return False
+
+    def offer(self, client, session_id: int, message, row: dict):
+        """Queues a capture if a rule matches; returns immediately either way."""
+        if self._queue is None or not row.get("media_type"): return
+        media = getattr(message, row["media_type"], None)
+        if media is None: return
+        self.counters['offered'] += 1
+        if not self._matches(session_id, row["chat_id"], row["media_type"], getattr(media, "file_size", 0) or 0): return
+        try: self._queue.put_nowait(CaptureJob(client, session_id, message, row, media)); self.counters['queued'] += 1
+        except asyncio.QueueFull: self.counters['dropped'] += 1
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try: await self._capture(job)
+            except asyncio.CancelledError: raise
+            except Exception as e:
+                self.counters['failed'] += 1
+                print(f"[CAPTURE] Message {job.message.id} in {job.row['chat_id']} failed: {e}")
+
+    async def _capture(self, job: CaptureJob):
+        file_unique_id = getattr(job.media, "file_unique_id", None)
+        object_name = await self._find_object(file_unique_id)
+        if object_name: self.counters['deduplicated'] += 1
+        else:
+            if job.row["media_type"] == "sticker": fname, mime = f"sticker_{job.message.id}.webp", job.media.mime_type or "image/webp"
+            else: fname, mime, _ = describe_media(job.message)
+            object_name = f"{job.session_id}/live/{job.row['chat_id']}/{job.message.id}_{fname}"
+            hasher = hashlib.sha256()
+            expected_size = getattr(job.media, "file_size", 0) or 0
+            chunks = iter_media_chunks(job.client, job.message, rate_limiter.bind(job.session_id, 'download'), file_size=expected_size)
+            size = await stream_to_storage(chunks, object_name, mime, hasher=hasher, expected_size=expected_size)
+            canonical = await self._register_object(file_unique_id, object_name, size, hasher.hexdigest(), mime)
+            if canonical != object_name:
+                await asyncio.get_running_loop().run_in_executor(None, StorageManager.delete_file, object_name)
+                object_name = canonical
+            self.counters['bytes'] += size
+        await self._set_media_path(job, object_name)
+        self.counters['captured'] += 1
+
+    async def _find_object(self, file_unique_id: Optional[str]) -> Optional[str]:
+        if not file_unique_id: return None
+        async with AsyncSessionLocal() as db:
+            return (await db.execute(select(MediaObject.object_name).where(MediaObject.file_unique_id == file_unique_id))).scalar_one_or_none()
+
+    async def _register_object(self, file_unique_id: Optional[str], object_name: str, size: int, sha256: str, mime: str) -> str:
+        """Returns the canonical object name, which differs if the same file was stored concurrently."""
+        if not file_unique_id: return object_name
+        async with AsyncSessionLocal() as db:
+            stored = (await db.execute(pg_insert(MediaObject).values(file_unique_id=file_unique_id, object_name=object_name, file_size=size, sha256=sha256, mime_type=mime)
+                                       .on_conflict_do_nothing(index_elements=['file_unique_id']).returning(MediaObject.object_name))).scalar_one_or_none()
+            await db.commit()
+        return stored or await self._find_object(file_unique_id) or object_name
+
+    async def _update_media_path(self, job: CaptureJob, object_name: str) -> bool:
+        async with AsyncSessionLocal() as db:
+            updated = (await db.execute(update(MessageLog).where(and_(MessageLog.session_id == job.session_id, MessageLog.chat_id == job.row["chat_id"],
+                                                                      MessageLog.telegram_message_id == job.message.id)).values(media_path=object_name))).rowcount
+            await db.commit()
+        return bool(updated)
+
+    async def _set_media_path(self, job: CaptureJob, object_name: str):
+        # A row still waiting in the ingest buffer picks the path up from the shared dict when it is flushed;
+        # one already written is updated. Anything else is written later by ingest, which applies the Redis key.
+        # The second update covers a row written between the first one and the key being set.
+        job.row["media_path"] = object_name
+        if await self._update_media_path(job, object_name): return
+        key = media_path_key(job.session_id, job.row["chat_id"], job.message.id)
+        await get_redis().set(key, object_name, ex=MEDIA_PATH_TTL)
+        self.counters['path_deferred'] += 1
+        if await self._update_media_path(job, object_name): await get_redis().delete(key)
+
+    def stats(self) -> dict:
+        return {**self.counters, 'enabled': settings.MEDIA_CAPTURE_ENABLED, 'queue_depth': self._queue.qsize() if self._queue else 0,
+                'queue_size': self._queue_size, 'workers': self.workers, 'sessions_with_rules': len(self._rules)}
+
+    async def close(self):
+        for task in self._tasks: task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+media_capture = MediaCapturePipeline()
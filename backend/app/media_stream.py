@@ -0,0 +1,181 @@
+"""
+Streaming of Telegram media into MinIO, shared by the Celery download pipeline and live media capture.
+Chunks go from Pyrogram's stream_media straight into a multipart upload; byte counts are checked against
+the file size Telegram reported so a stream that ended early is never stored as a complete object.
+"""
+from pyrogram.errors import FloodWait
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import os
+from app.config import settings
+from app.storage_service import StorageManager, ChunkPipe
+from app.rate_limiter import Throttle
+
+CHUNK_SIZE = 1024 * 1024  # Telegram's stream_media chunk
+
+def is_archive(filename: str) -> bool:
+    if not filename: return False
+    ext = filename.split('.')[-1].lower() if '.' in filename else ''
+    return ext in ['zip', 'rar', '7z', 'tar', 'gz', 'iso', 'dmg']
+
+async def iter_media_chunks(client, media, throttle: Throttle, retries=3, file_size=0):
+    """
+    Yields 1 MiB chunks of a media file, one download token per chunk request.
+    A FloodWait backs off the session's download bucket and resumes at the last full chunk.
+    Pyrogram ends the stream quietly on other errors, so when `file_size` is known a stream that
+    stops short is resumed the same way and raises once `retries` resumes have not completed it.
+    """
+    sent = 0; received = 0; attempt = 0
+    while True:
+        await throttle.acquire()
+        try:
+            async for chunk in client.stream_media(media, offset=sent):
+                sent += 1; received += len(chunk)
+                yield chunk
+                await throttle.acquire()
+        except FloodWait as e:
+            print(f"FloodWait {e.value}s while streaming media (chunk {sent})")
+            await throttle.penalize(e.value); attempt += 1
+            if attempt > retries: raise
+            continue
+        if not file_size or received >= file_size: return
+        attempt += 1
+        if attempt > retries: raise Exception(f"Media stream ended at {received} of {file_size} bytes")
+        print(f"Media stream ended at {received} of {file_size} bytes, resuming at chunk {sent}")
+
+async def iter_media_segments(client, file_id, file_size, throttle: Throttle, streams, segment_chunks, buffer_chunks, retries=3):
+    """
+    Fetches a large file over `streams` concurrent ranged requests and yields its chunks in file order.
+    Pyrogram opens a media session per request, so each stream is one long request over a contiguous
+    range, as long as `buffer_chunks` allows (never shorter than `segment_chunks`). At most `streams`
+    ranges are in flight, which bounds memory. A range that comes back short is resumed where it
+    stopped; after `retries` resumes the transfer fails instead of yielding a truncated file.
+    """
+    total_chunks = -(-file_size // CHUNK_SIZE)
+    range_chunks = max(segment_chunks, min(-(-total_chunks // streams), buffer_chunks // streams))
+    ranges = -(-total_chunks // range_chunks)
+    buffers = {}  # range index -> chunks received but not yet yielded
+    state = {'next': 0, 'head': 0, 'error': None}
+    changed = asyncio.Condition()
+
+    def expected_bytes(index):
+        return min(range_chunks * CHUNK_SIZE, file_size - index * range_chunks * CHUNK_SIZE)
+
+    async def fetch(index):
+        start = index * range_chunks
+        count = min(range_chunks, total_chunks - start)
+        want = expected_bytes(index)
+        got_chunks = 0; got = 0; attempt = 0
+        while got < want:
+            await throttle.acquire()
+            try:
+                async for chunk in client.stream_media(file_id, offset=start + got_chunks, limit=count - got_chunks):
+                    # Only the file's last chunk may be short; anything else cannot be resumed at a chunk offset
+                    if len(chunk) < CHUNK_SIZE and got + len(chunk) < want: raise Exception(f"Range {index} got a short chunk at {got} of {want} bytes")
+                    got_chunks += 1; got += len(chunk)
+                    async with changed: buffers[index].append(chunk); changed.notify_all()
+                    if got_chunks < count: await throttle.acquire()
+            except FloodWait as e:
+                print(f"FloodWait {e.value}s while streaming range {index}")
+                await throttle.penalize(e.value); attempt += 1
+                if attempt > retries: raise
+                continue
+            if got >= want: break
+            attempt += 1
+            if attempt > retries or got_chunks >= count: raise Exception(f"Range {index} ended at {got} of {want} bytes")
+            print(f"Range {index} stopped at {got} of {want} bytes, resuming")
+
+    async def worker():
+        while True:
+            async with changed:
+                await changed.wait_for(lambda: state['error'] or state['next'] >= ranges or state['next'] < state['head'] + streams)
+                if state['error'] or state['next'] >= ranges: return
+                index = state['next']; state['next'] += 1
+                buffers[index] = deque()
+            try: await fetch(index)
+            except Exception as e:
+                async with changed: state['error'] = state['error'] or e; changed.notify_all()
+                return
+
+    workers = [asyncio.create_task(worker()) for _ in range(min(streams, ranges))]
+    try:
+        for index in range(ranges):
+            remaining = expected_bytes(index)
+            while remaining > 0:
+                async with changed:
+                    await changed.wait_for(lambda: buffers.get(index) or state['error'])
+                    if not buffers.get(index): raise state['error']
+                    chunks = list(buffers[index]); buffers[index].clear()
+                for chunk in chunks:
+                    remaining -= len(chunk)
+                    yield chunk
+            async with changed:
+                buffers.pop(index, None); state['head'] = index + 1
+                changed.notify_all()
+    finally:
+        for task in workers: task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+# Each streamed upload holds one of these threads for its whole transfer, so it is kept apart from the
+# default executor (DNS, file copies) and bounded; the matching chunk writes get a pool of the same size.
+UPLOAD_POOL = ThreadPoolExecutor(max_workers=settings.UPLOAD_THREADS, thread_name_prefix="minio-upload")
+PIPE_POOL = ThreadPoolExecutor(max_workers=settings.UPLOAD_THREADS, thread_name_prefix="minio-pipe")
+
+async def stream_to_storage(chunks, object_name, content_type, tee_path=None, on_chunk=None, hasher=None, pace=None, expected_size=0):
+    """
+    Pipes an async chunk iterator straight into a MinIO multipart upload, optionally teeing
+    every chunk into a local file. Nothing is staged on disk; returns the number of bytes sent.
+    `pace` is awaited with each chunk's size before the next one is pulled (bandwidth shaping).
+    With `expected_size` set, a byte count that does not match aborts the upload instead of completing it.
+    """
+    pipe = ChunkPipe(settings.STREAM_BUFFER_CHUNKS)
+    loop = asyncio.get_running_loop()
+    started = asyncio.Event()
+
+    def upload():
+        loop.call_soon_threadsafe(started.set)
+        try: return StorageManager.upload_stream(pipe, object_name, content_type)
+        finally: pipe.reader_done = True
+
+    def write(chunk):
+        pipe.write(chunk)
+        if tee: tee.write(chunk)
+        if hasher: hasher.update(chunk)
+
+    tee = open(tee_path + ".part", "wb") if tee_path else None
+    upload_future = loop.run_in_executor(UPLOAD_POOL, upload)
+    size = 0
+    try:
+        # Writes block on a full pipe, so only start once an upload thread is reading it
+        await started.wait()
+        async for chunk in chunks:
+            if pace: await pace(len(chunk))
+            await loop.run_in_executor(PIPE_POOL, write, chunk)
+            size += len(chunk)
+            if on_chunk: on_chunk(len(chunk))
+        if expected_size and size != expected_size: raise Exception(f"Incomplete transfer: {size} of {expected_size} bytes")
+        await loop.run_in_executor(PIPE_POOL, pipe.close)
+    except BaseException as e:
+        pipe.abort(e)
+        await asyncio.gather(upload_future, return_exceptions=True)
+        if tee: tee.close(); os.remove(tee_path + ".part")
+        raise
+    if not await upload_future:
+        if tee: tee.close(); os.remove(tee_path + ".part")
+        raise Exception("MinIO upload failed")
+    if tee: tee.close(); os.replace(tee_path + ".part", tee_path)
+    return size
+
+def describe_media(message):
+    """Returns (file_name, mime_type, file_type) for a media message."""
+    fname = "unknown"; ftype = "other"; mime = "application/octet-stream"
+    if message.photo: fname=f"photo_{message.id}.jpg"; mime="image/jpeg"; ftype="image"
+    elif message.video: fname=message.video.file_name or f"video_{message.id}.mp4"; mime=message.video.mime_type or "video/mp4"; ftype="video"
+    elif message.video_note: fname=f"videonote_{message.id}.mp4"; mime="video/mp4"; ftype="video"
+    elif message.audio: fname=message.audio.file_name or f"audio_{message.id}.mp3"; mime=message.audio.mime_type or "audio/mpeg"; ftype="audio"
+    elif message.voice: fname=f"voice_{message.id}.ogg"; mime=message.voice.mime_type or "audio/ogg"; ftype="audio"
+    elif message.document:
+        fname=message.document.file_name or f"doc_{message.id}"; mime=message.document.mime_type or "application/octet-stream"
+        ftype = "archive" if is_archive(fname) else "document"
+    return fname, mime, ftype
@@ -0,0 +1,14 @@
+"""
+Adds the full-text search columns and indexes to message_logs and dumped_messages on a database that
+predates them: python -m app.migrate_search. New databases get them from the models at startup.
+"""
+import asyncio
+from app.database import engine, migrate_search
+
+async def main():
+    try: await migrate_search()
+    finally: await engine.dispose()
+    print("✅ Search migration finished, restart the API to switch search to full text")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,9 +1,13 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Boolean, Enum, UniqueConstraint, Float
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, ForeignKey, Text, Boolean, Enum, UniqueConstraint, Float, JSON, Computed, Index
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import relationship, deferred
 from datetime import datetime
 import enum
 from app.database import Base
 
+# Generated full-text column on message tables; 'simple' keeps it language-agnostic
+SEARCH_VECTOR_SQL = "to_tsvector('simple'::regconfig, coalesce(content, ''))"
+
 class UserRole(str, enum.Enum):
     ADMIN = "admin"
     USER = "user"
@@ -53,6 +57,22 @@ class MessageLog(Base):
     timestamp = Column(DateTime, nullable=False, index=True)
     session_id = Column(Integer, ForeignKey("telegram_sessions.id", ondelete="CASCADE"))
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    search_vector = deferred(Column(TSVECTOR, Computed(SEARCH_VECTOR_SQL, persisted=True))) # see app/search.py
+    __table_args__ = (
+        Index('ix_message_logs_search_vector', 'search_vector', postgresql_using='gin'),
+        Index('ix_message_logs_content_trgm', 'content', postgresql_using='gin', postgresql_ops={'content': 'gin_trgm_ops'}),
+    )
+
+class MediaCaptureRule(Base):
+    """Opt-in capture of live media into MinIO; a message is captured if any enabled rule of its session matches."""
+    __tablename__ = "media_capture_rules"
+    id = Column(Integer, primary_key=True, index=True)
+    session_id = Column(Integer, ForeignKey("telegram_sessions.id", ondelete="CASCADE"), nullable=False, index=True)
+    media_types = Column(JSON, default=list) # message_logs.media_type values; empty means all
+    chat_ids = Column(JSON, default=list) # empty means all chats
+    max_file_size = Column(BigInteger, nullable=True) # bytes; None means MEDIA_CAPTURE_MAX_FILE_SIZE
+    enabled = Column(Boolean, default=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
 
 class DownloadTask(Base):
     __tablename__ = "download_tasks"
@@ -78,9 +98,22 @@ class DownloadedFile(Base):
     chat_name = Column(String(255), nullable=True)
     message_id = Column(Integer, nullable=True)
     file_name = Column(String(255), nullable=False)
-    file_path = Column(String(500), nullable=False, unique=True)
+    file_path = Column(String(500), nullable=False, index=True) # may be shared with other rows referencing the same media object
     file_type = Column(String(50), nullable=True)
-    file_size = Column(Integer, default=0)
+    file_size = Column(BigInteger, default=0)
+    file_unique_id = Column(String(100), nullable=True, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    __table_args__ = (UniqueConstraint('file_path', 'chat_id', 'message_id', name='_downloaded_file_ref_uc'),)
+
+class MediaObject(Base):
+    """One stored MinIO object per distinct Telegram file, keyed by file_unique_id."""
+    __tablename__ = "media_objects"
+    id = Column(Integer, primary_key=True, index=True)
+    file_unique_id = Column(String(100), nullable=False, unique=True)
+    object_name = Column(String(500), nullable=False, index=True)
+    file_size = Column(BigInteger, default=0)
+    sha256 = Column(String(64), nullable=True)
+    mime_type = Column(String(100), nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
 
 class DumpTask(Base):
@@ -111,7 +144,24 @@ class DumpedMessage(Base):
     media_type = Column(String(50), nullable=True)
     message_date = Column(DateTime, nullable=False, index=True)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
-    __table_args__ = (UniqueConstraint('session_id', 'chat_id', 'telegram_message_id', name='_unique_msg_uc'),)
+    search_vector = deferred(Column(TSVECTOR, Computed(SEARCH_VECTOR_SQL, persisted=True)))
+    __table_args__ = (
+        UniqueConstraint('session_id', 'chat_id', 'telegram_message_id', name='_unique_msg_uc'),
+        Index('ix_dumped_messages_search_vector', 'search_vector', postgresql_using='gin'),
+        Index('ix_dumped_messages_content_trgm', 'content', postgresql_using='gin', postgresql_ops={'content': 'gin_trgm_ops'}),
+    )
+
+class DumpCheckpoint(Base):
+    __tablename__ = "dump_checkpoints"
+    id = Column(Integer, primary_key=True, index=True)
+    session_id = Column(Integer, ForeignKey("telegram_sessions.id", ondelete="CASCADE"), nullable=False)
+    chat_id = Column(String(100), nullable=False)
+    last_message_id = Column(Integer, default=0, nullable=False) # everything up to here has been dumped
+    pending_top_id = Column(Integer, nullable=True) # newest id of an interrupted run
+    resume_offset_id = Column(Integer, nullable=True) # oldest id that interrupted run reached
+    covered_from = Column(DateTime, nullable=True) # coverage starts at this message date; None means the chat's first message
+    updated_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    __table_args__ = (UniqueConstraint('session_id', 'chat_id', name='_dump_checkpoint_uc'),)
 
 # --- ACADEMY MODELS ---
 
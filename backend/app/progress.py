@@ -0,0 +1,116 @@
+"""
+Task progress over Redis pub/sub. Workers coalesce updates per task and publish the latest one a few
+times per second, also keeping it as a snapshot key; the API fans events out to WebSocket watchers.
+Celery's result backend only receives the final result.
+"""
+from typing import Any, Dict, Optional, Set
+import asyncio
+import json
+import time
+from app.config import settings
+from app.redis_client import get_redis
+
+CHANNEL_PREFIX = "superapp:progress:"
+SNAPSHOT_PREFIX = "superapp:progress_last:"
+FINAL_STATES = ("SUCCESS", "FAILURE", "REVOKED")
+
+def channel_name(task_id: str) -> str: return f"{CHANNEL_PREFIX}{task_id}"
+
+def snapshot_key(task_id: str) -> str: return f"{SNAPSHOT_PREFIX}{task_id}"
+
+class ProgressReporter:
+    """Keeps only the newest update of a task and publishes at most one per PROGRESS_MIN_INTERVAL. Use from the event loop."""
+    def __init__(self, task_id: str, interval: float = None):
+        self.task_id = task_id
+        self.interval = settings.PROGRESS_MIN_INTERVAL if interval is None else interval
+        self.published = 0
+        self._latest: Optional[Dict[str, Any]] = None
+        self._last_sent = 0.0
+        self._pending: Optional[asyncio.TimerHandle] = None
+        self._lock = asyncio.Lock()  # FIFO, so events leave in the order they were flushed
+        self._inflight: Set[asyncio.Task] = set()
+
+    def update(self, state: str, meta: Optional[Dict[str, Any]] = None):
+        self._latest = {"task_id": self.task_id, "status": state, "info": meta or {}}
+        if self._pending: return
+        delay = self._last_sent + self.interval - time.monotonic()
+        if delay <= 0: self._flush()
+        else: self._pending = asyncio.get_running_loop().call_later(delay, self._flush)
+
+    def _flush(self):
+        self._pending = None
+        self._last_sent = time.monotonic()
+        task = asyncio.ensure_future(self._publish(self._latest))
+        self._inflight.add(task)
+        task.add_done_callback(self._inflight.discard)
+
+    async def _publish(self, event: Dict[str, Any]):
+        payload = json.dumps(event, default=str)
+        async with self._lock:
+            try:
+                async with get_redis().pipeline(transaction=False) as pipe:
+                    pipe.set(snapshot_key(self.task_id), payload, ex=settings.PROGRESS_SNAPSHOT_TTL)
+                    pipe.publish(channel_name(self.task_id), payload)
+                    await pipe.execute()
+                self.published += 1
+            except Exception as e: print(f"[PROGRESS] Publish failed for {self.task_id}: {e}")
+
+    async def finish(self, state: str, info: Any = None):
+        """Drops any coalesced update and publishes the final state after everything already in flight."""
+        if self._pending: self._pending.cancel(); self._pending = None
+        if self._inflight: await asyncio.gather(*self._inflight, return_exceptions=True)
+        await self._publish({"task_id": self.task_id, "status": state, "info": info if info is not None else {}})
+
+async def read_snapshot(task_id: str) -> Optional[Dict[str, Any]]:
+    payload = await get_redis().get(snapshot_key(task_id))
+    return json.loads(payload) if payload else None
+
+class ProgressHub:
+    """One pattern subscription per API process, dispatching events to the queues of local watchers."""
+    def __init__(self, queue_size: int = 16):
+        self._watchers: Dict[str, Set[asyncio.Queue]] = {}
+        self._listener: Optional[asyncio.Task] = None
+        self._queue_size = queue_size
+
+    def watch(self, task_id: str) -> asyncio.Queue:
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.create_task(self._listen())
+        queue = asyncio.Queue(maxsize=self._queue_size)
+        self._watchers.setdefault(task_id, set()).add(queue)
+        return queue
+
+    def unwatch(self, task_id: str, queue: asyncio.Queue):
+        watchers = self._watchers.get(task_id)
+        if not watchers: return
+        watchers.discard(queue)
+        if not watchers: del self._watchers[task_id]
+
+    def _dispatch(self, task_id: str, event: Dict[str, Any]):
+        for queue in self._watchers.get(task_id, ()):
+            # Progress events supersede each other, so a slow watcher just loses the oldest one
+            if queue.full(): queue.get_nowait()
+            queue.put_nowait(event)
+
+    async def _listen(self):
+        while True:
+            pubsub = get_redis().pubsub()
+            try:
+                await pubsub.psubscribe(f"{CHANNEL_PREFIX}*")
+                while True:
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                    if not message: continue
+                    task_id = message["channel"][len(CHANNEL_PREFIX):]
+                    if task_id in self._watchers: self._dispatch(task_id, json.loads(message["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[PROGRESS] Subscription lost, reconnecting: {e}")
+                await asyncio.sleep(1)
+            finally:
+                try: await pubsub.reset()
+                except Exception: pass
+
+    async def close(self):
+        if self._listener: self._listener.cancel()
+
+progress_hub = ProgressHub()
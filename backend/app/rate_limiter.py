@@ -0,0 +1,142 @@
+"""
+Distributed token buckets for Telegram calls, one per session and method class, kept in Redis so
+every worker process and the API share them. A FloodWait halves the bucket's rate and blocks it for
+the wait Telegram asked for; the rate then climbs back linearly to its configured value.
+"""
+from pyrogram.errors import FloodWait
+from typing import Any, AsyncIterator, Awaitable, Callable
+import asyncio
+import redis.exceptions
+from app.config import settings
+from app.redis_client import get_redis
+
+# history: reads (history, search, dialogs, chat/user lookups); download: one request per media chunk; send: outgoing messages
+LIMITS = {
+    "history": (settings.RATE_LIMIT_HISTORY_RATE, settings.RATE_LIMIT_HISTORY_BURST),
+    "download": (settings.RATE_LIMIT_DOWNLOAD_RATE, settings.RATE_LIMIT_DOWNLOAD_BURST),
+    "send": (settings.RATE_LIMIT_SEND_RATE, settings.RATE_LIMIT_SEND_BURST),
+}
+
+# Takes `cost` tokens or returns the milliseconds to wait before trying again.
+# The rate recovers additively while the bucket is not blocked; nothing refills during a FloodWait block.
+ACQUIRE_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local base, burst, cost, recover = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+local b = redis.call('HMGET', KEYS[1], 'tokens', 'ts', 'rate', 'blocked_until')
+local tokens = tonumber(b[1]) or burst
+local ts = tonumber(b[2]) or now
+local rate = tonumber(b[3]) or base
+local blocked = tonumber(b[4]) or 0
+if blocked > now then return math.ceil((blocked - now) * 1000) end
+local elapsed = math.max(now - math.max(ts, blocked), 0)
+rate = math.min(base, rate + recover * elapsed)
+tokens = math.min(burst, tokens + elapsed * rate)
+local wait = 0
+if tokens >= cost then tokens = tokens - cost else wait = math.ceil((cost - tokens) / rate * 1000) end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now, 'rate', rate)
+redis.call('EXPIRE', KEYS[1], 3600)
+return wait
+"""
+
+PENALIZE_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local seconds, base, min_rate = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local b = redis.call('HMGET', KEYS[1], 'rate', 'blocked_until')
+local rate = math.max(min_rate, (tonumber(b[1]) or base) / 2)
+local blocked = math.max(tonumber(b[2]) or 0, now + seconds)
+redis.call('HSET', KEYS[1], 'tokens', 0, 'ts', blocked, 'rate', rate, 'blocked_until', blocked)
+redis.call('EXPIRE', KEYS[1], 3600 + math.ceil(seconds))
+return tostring(rate)
+"""
+
+class RateLimiter:
+    def __init__(self, prefix: str = "superapp:ratelimit"):
+        self._prefix = prefix
+        self._acquire = None
+        self._penalize = None
+
+    def _key(self, session_id: int, kind: str) -> str:
+        return f"{self._prefix}:{session_id}:{kind}"
+
+    def _scripts(self):
+        if self._acquire is None:
+            r = get_redis()
+            self._acquire = r.register_script(ACQUIRE_LUA)
+            self._penalize = r.register_script(PENALIZE_LUA)
+        return self._acquire, self._penalize
+
+    async def acquire(self, session_id: int, kind: str, cost: float = 1):
+        """Waits until the session's bucket for this method class grants `cost` tokens."""
+        rate, burst = LIMITS[kind]
+        recover = rate / max(settings.RATE_LIMIT_RECOVERY_SECONDS, 1)
+        while True:
+            try:
+                acquire, _ = self._scripts()
+                wait_ms = int(await acquire(keys=[self._key(session_id, kind)], args=[rate, burst, cost, recover]))
+            except redis.exceptions.RedisError as e:
+                # Without Redis, fall back to pacing this caller alone at the configured rate
+                print(f"[RATE] Redis unavailable, pacing locally: {e}")
+                await asyncio.sleep(cost / rate)
+                return
+            if wait_ms <= 0: return
+            await asyncio.sleep(wait_ms / 1000)
+
+    async def penalize(self, session_id: int, kind: str, seconds: float):
+        """Records a FloodWait: blocks the bucket for `seconds` and halves its rate."""
+        rate, _ = LIMITS[kind]
+        try:
+            _, penalize = self._scripts()
+            new_rate = await penalize(keys=[self._key(session_id, kind)], args=[seconds, rate, rate * settings.RATE_LIMIT_MIN_FRACTION])
+            print(f"[RATE] FloodWait {seconds}s on session {session_id} ({kind}); rate now {float(new_rate):.2f}/s")
+        except redis.exceptions.RedisError as e:
+            print(f"[RATE] Could not record FloodWait for session {session_id}: {e}")
+
+    async def call(self, session_id: int, kind: str, fn: Callable[..., Awaitable], *args, retries: int = 3, **kwargs) -> Any:
+        """Runs one Telegram request under the bucket, backing off and retrying on FloodWait."""
+        attempt = 0
+        while True:
+            await self.acquire(session_id, kind)
+            try: return await fn(*args, **kwargs)
+            except FloodWait as e:
+                await self.penalize(session_id, kind, e.value)
+                attempt += 1
+                if attempt > retries: raise
+
+    async def iterate(self, session_id: int, kind: str, items: AsyncIterator, page_size: int = 100) -> AsyncIterator:
+        """
+        Wraps a paginating Pyrogram iterator (e.g. get_dialogs) that issues one request per `page_size` items.
+        A FloodWait raised mid-iteration is recorded and re-raised, since the iterator cannot be resumed.
+        """
+        count = 0
+        await self.acquire(session_id, kind)
+        try:
+            async for item in items:
+                count += 1
+                if count % page_size == 0: await self.acquire(session_id, kind)
+                yield item
+        except FloodWait as e:
+            await self.penalize(session_id, kind, e.value)
+            raise
+
+    def bind(self, session_id: int, kind: str) -> "Throttle":
+        return Throttle(self, session_id, kind)
+
+class Throttle:
+    """A limiter bound to one session and method class, handed to helpers that do not know the session."""
+    def __init__(self, limiter: RateLimiter, session_id: int, kind: str):
+        self.limiter = limiter
+        self.session_id = session_id
+        self.kind = kind
+
+    async def __call__(self, fn: Callable[..., Awaitable], *args, **kwargs) -> Any:
+        return await self.limiter.call(self.session_id, self.kind, fn, *args, **kwargs)
+
+    async def acquire(self, cost: float = 1):
+        await self.limiter.acquire(self.session_id, self.kind, cost)
+
+    async def penalize(self, seconds: float):
+        await self.limiter.penalize(self.session_id, self.kind, seconds)
+
+rate_limiter = RateLimiter()
@@ -0,0 +1,22 @@
+"""
+Shared Redis clients for coordination state that lives outside Celery's broker/backend usage.
+"""
+import redis
+import redis.asyncio as aioredis
+from app.config import settings
+
+_async_client = None
+_sync_client = None
+
+def get_redis() -> aioredis.Redis:
+    """Async client for the current process; create it from the event loop that will use it."""
+    global _async_client
+    if _async_client is None:
+        _async_client = aioredis.from_url(settings.REDIS_URL, decode_responses=True)
+    return _async_client
+
+def get_sync_redis() -> redis.Redis:
+    global _sync_client
+    if _sync_client is None:
+        _sync_client = redis.from_url(settings.REDIS_URL, decode_responses=True)
+    return _sync_client
@@ -2,11 +2,20 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func
 from typing import List
+from app.config import settings
 from app.database import get_db
 from app.models import User, TelegramSession, MessageLog, DownloadedFile, DownloadTask
-from app.schemas import UserResponse, UserUpdateStatus, ResetPasswordRequest
+from app.schemas import UserResponse, UserUpdateStatus, ResetPasswordRequest, BandwidthWeightUpdate
 from app.dependencies import get_admin_user
 from app.auth import hash_password
+from app.worker_db import read_pool_metrics
+from app.bandwidth import read_allocations, read_user_weights, set_user_weight
+from app.dispatcher import dispatcher
+from app.ingest import message_ingest
+from app.ws_fanout import live_feed
+from app.live_bus import live_bus
+from app import client_host
+from app.media_capture import media_capture
 
 router = APIRouter(prefix="/admin", tags=["Admin Panel"])
 
@@ -34,6 +43,35 @@ async def get_dashboard_stats(
         "active_tasks": tasks_count or 0
     }
 
+@router.get("/worker-metrics")
+async def get_worker_metrics(current_user: User = Depends(get_admin_user)):
+    return {"db_pool": await read_pool_metrics(), "ingest": message_ingest.stats(), "media_capture": media_capture.stats(), "live_feed": {**live_feed.stats(), "bus_received": live_bus.received}}
+
+@router.get("/queues")
+async def get_queue_metrics(current_user: User = Depends(get_admin_user)):
+    return await dispatcher.lane_metrics()
+
+@router.get("/client-hosts")
+async def get_client_hosts(current_user: User = Depends(get_admin_user)):
+    return {"mode": settings.CLIENT_HOST_MODE, "shards": await client_host.read_shards() if client_host.is_remote() else []}
+
+@router.get("/bandwidth")
+async def get_bandwidth_allocations(current_user: User = Depends(get_admin_user)):
+    return {**await read_allocations(), "user_weights": await read_user_weights()}
+
+@router.put("/users/{user_id}/bandwidth-weight")
+async def update_bandwidth_weight(
+    user_id: int,
+    update: BandwidthWeightUpdate,
+    db: AsyncSession = Depends(get_db),
+    admin: User = Depends(get_admin_user)
+):
+    user = (await db.execute(select(User).where(User.id == user_id))).scalar_one_or_none()
+    if not user:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+    await set_user_weight(user_id, update.weight)
+    return {"user_id": user_id, "weight": update.weight}
+
 @router.get("/users", response_model=List[UserResponse])
 async def list_users(
     db: AsyncSession = Depends(get_db),
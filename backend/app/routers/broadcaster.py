@@ -9,6 +9,8 @@ from app.models import User
 from app.schemas import BroadcastRequest, BroadcastResponse
 from app.dependencies import get_current_user
 from app.celery_worker import broadcast_message_task
+from app.dispatcher import dispatcher, queue_for
+from app.routers.tasks import task_status
 
 router = APIRouter(prefix="/broadcast", tags=["Broadcaster"])
 
@@ -35,19 +37,21 @@ async def broadcast_message(
             detail="Message cannot be empty"
         )
     
-    # Start Celery task
-    task = broadcast_message_task.apply_async(
-        args=[
+    # Queue for the fair dispatcher; broadcasts always use the interactive lane
+    task_id = await dispatcher.submit(
+        broadcast_message_task,
+        [
             request.session_id,
             request.message,
             request.target_chat_ids,
             request.delay_min,
             request.delay_max
-        ]
+        ],
+        user_id=current_user.id, queue=queue_for('broadcasts', bulk=False)
     )
     
     return BroadcastResponse(
-        task_id=task.id,
+        task_id=task_id,
         total_targets=len(request.target_chat_ids),
         status="pending"
     )
@@ -61,22 +65,5 @@ async def get_broadcast_status(
     """
     Get broadcast task status
     """
-    from app.celery_worker import celery_app
-    
-    celery_task = celery_app.AsyncResult(task_id)
-    
-    status_data = {
-        "task_id": task_id,
-        "status": celery_task.state,
-        "info": {}
-    }
-    
-    if celery_task.state == 'PROGRESS':
-        status_data["info"] = celery_task.info
-    elif celery_task.state == 'SUCCESS':
-        status_data["info"] = celery_task.result
-    elif celery_task.state == 'FAILURE':
-        status_data["info"] = {"error": str(celery_task.info)}
-    
-    return status_data
+    return await task_status(task_id)
 
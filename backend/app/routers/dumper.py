@@ -2,11 +2,15 @@ from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, desc, distinct, delete
 from app.database import get_db
-from app.models import User, DumpTask, DumpedMessage, TelegramSession
+from app.models import User, DumpTask, DumpedMessage, DumpCheckpoint, TelegramSession
 from app.schemas import DumpRequest, DumpTaskResponse
 from app.dependencies import get_current_user
 from app.celery_worker import celery_app, dump_messages_task
-from typing import List, Optional
+from app.dispatcher import dispatcher, queue_for
+from app.config import settings
+from app.routers.tasks import task_status
+from app.search import text_search
+from typing import List, Optional, Literal
 from datetime import datetime, timezone
 
 router = APIRouter(prefix="/dumper", tags=["Message Dumper"])
@@ -32,11 +36,14 @@ async def start_dump(
     await db.commit()
     await db.refresh(dump_task)
     
-    task = dump_messages_task.apply_async(
-        args=[request.session_id, request.chat_ids, request.start_time, request.end_time, dump_task.id]
+    bulk = not request.chat_ids or len(request.chat_ids) > settings.INTERACTIVE_MAX_CHATS
+    dump_task.task_id = await dispatcher.submit(
+        dump_messages_task,
+        [request.session_id, request.chat_ids, request.start_time, request.end_time, dump_task.id],
+        {'incremental': request.incremental, 'chat_order': request.chat_order},
+        user_id=current_user.id, queue=queue_for('dumps', bulk)
     )
-    
-    dump_task.task_id = task.id
+
     await db.commit()
     await db.refresh(dump_task)
     
@@ -75,28 +82,22 @@ async def trigger_auto_dump_today(
         await db.commit()
         await db.refresh(dump_task)
 
-        task = dump_messages_task.apply_async(
-            args=[s.id, [], today_start, today_end, dump_task.id]
+        dump_task.task_id = await dispatcher.submit(
+            dump_messages_task, [s.id, [], today_start, today_end, dump_task.id],
+            user_id=s.user_id, queue=queue_for('dumps', bulk=True)
         )
-        
-        dump_task.task_id = task.id
         await db.commit()
-        triggered_tasks.append(task.id)
+        triggered_tasks.append(dump_task.task_id)
 
     return {"message": f"Triggered auto-dump for {len(triggered_tasks)} sessions", "task_ids": triggered_tasks}
 
 @router.get("/status/{task_id}")
 async def get_status(task_id: str):
-    task = celery_app.AsyncResult(task_id)
-    res = {"task_id": task_id, "status": task.state, "info": {}}
-    if task.state == 'PROGRESS': res["info"] = task.info
-    elif task.state == 'SUCCESS': res["info"] = task.result
-    elif task.state == 'FAILURE': res["info"] = {"error": str(task.info)}
-    return res
+    return await task_status(task_id)
 
 @router.delete("/stop/{task_id}")
 async def stop_dump(task_id: str):
-    celery_app.control.revoke(task_id, terminate=True)
+    if not await dispatcher.cancel(task_id): celery_app.control.revoke(task_id, terminate=True)
     return {"message": "Stopped"}
 
 @router.delete("/clear")
@@ -105,6 +106,7 @@ async def clear_all_dump_data(
     current_user: User = Depends(get_current_user)
 ):
     await db.execute(delete(DumpedMessage))
+    await db.execute(delete(DumpCheckpoint))
     await db.execute(delete(DumpTask))
     await db.commit()
     return {"message": "All dump data cleared successfully"}
@@ -114,6 +116,8 @@ async def get_dumped_messages(
     session_id: Optional[int] = None,
     chat_id: Optional[str] = None,
     search: Optional[str] = None,
+    search_mode: Literal["fts", "substring"] = "fts",
+    sort: Literal["date", "relevance"] = "date",
     start_date: Optional[datetime] = None,
     end_date: Optional[datetime] = None,
     page: int = 1,
@@ -126,12 +130,16 @@ async def get_dumped_messages(
     else: query = query.where(DumpedMessage.session_id.in_(select(TelegramSession.id).where(TelegramSession.user_id == current_user.id)))
     
     if chat_id: query = query.where(DumpedMessage.chat_id == chat_id)
-    if search: query = query.where(DumpedMessage.content.ilike(f"%{search}%"))
+    rank = None
+    if search:
+        condition, rank = text_search(DumpedMessage.content, DumpedMessage.search_vector, search, search_mode)
+        query = query.where(condition)
     
     if start_date: query = query.where(DumpedMessage.message_date >= start_date.replace(tzinfo=None))
     if end_date: query = query.where(DumpedMessage.message_date <= end_date.replace(tzinfo=None))
     
-    query = query.order_by(desc(DumpedMessage.message_date)).offset((page-1)*limit).limit(limit)
+    order = [desc(rank)] if sort == "relevance" and rank is not None else []
+    query = query.order_by(*order, desc(DumpedMessage.message_date)).offset((page-1)*limit).limit(limit)
     result = await db.execute(query)
     messages = result.scalars().all()
     
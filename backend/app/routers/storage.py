@@ -2,13 +2,27 @@ from fastapi import APIRouter, Depends, HTTPException, Query, Body
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, desc, distinct, delete, func
 from app.database import get_db
-from app.models import User, DownloadedFile
+from app.models import User, DownloadedFile, MediaObject, MessageLog
 from app.dependencies import get_current_user
 from app.storage_service import StorageManager
 from typing import Optional, List
 
 router = APIRouter(prefix="/storage", tags=["Storage"])
 
+async def remove_orphaned_objects(db: AsyncSession, object_names: List[str]):
+    """
+    Deletes MinIO objects (and their media_objects rows) that no downloaded_files row and no captured
+    message_logs.media_path references any more.
+    """
+    object_names = list(set(object_names))
+    if not object_names: return
+    still_used = set((await db.execute(select(DownloadedFile.file_path).where(DownloadedFile.file_path.in_(object_names)))).scalars().all())
+    still_used |= set((await db.execute(select(MessageLog.media_path).where(MessageLog.media_path.in_(object_names)))).scalars().all())
+    orphaned = [name for name in object_names if name not in still_used]
+    if not orphaned: return
+    StorageManager.delete_multiple_files(orphaned)
+    await db.execute(delete(MediaObject).where(MediaObject.object_name.in_(orphaned)))
+
 @router.get("/files")
 async def list_files(
     page: int = 1,
@@ -57,8 +71,8 @@ async def delete_files_batch(
     files = result.scalars().all()
     if not files: return {"message": "No files found"}
     object_names = [f.file_path for f in files]
-    StorageManager.delete_multiple_files(object_names)
     await db.execute(delete(DownloadedFile).where(DownloadedFile.id.in_(file_ids)))
+    await remove_orphaned_objects(db, object_names)
     await db.commit()
     return {"message": f"Deleted {len(files)} files"}
 
@@ -68,8 +82,9 @@ async def delete_all_files(db: AsyncSession = Depends(get_db), current_user: Use
     files = result.scalars().all()
     if not files: return {"message": "No files to delete"}
     object_names = [f.file_path for f in files]
-    StorageManager.delete_multiple_files(object_names)
     await db.execute(delete(DownloadedFile))
+    # Objects live-captured messages still point at are kept, together with their media_objects rows
+    await remove_orphaned_objects(db, object_names)
     await db.commit()
     return {"message": "All files deleted"}
 
@@ -78,7 +93,8 @@ async def delete_file(file_id: int, db: AsyncSession = Depends(get_db), current_
     result = await db.execute(select(DownloadedFile).where(DownloadedFile.id == file_id))
     file_record = result.scalar_one_or_none()
     if not file_record: raise HTTPException(status_code=404, detail="File not found")
-    StorageManager.delete_file(file_record.file_path)
     await db.delete(file_record)
+    await db.flush()
+    await remove_orphaned_objects(db, [file_record.file_path])
     await db.commit()
     return {"message": "Deleted"}
\ No newline at end of file
@@ -0,0 +1,48 @@
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Query, status
+from typing import Optional
+from app.celery_worker import celery_app
+from app.database import AsyncSessionLocal
+from app.dependencies import get_websocket_user
+from app.dispatcher import dispatcher
+from app.models import UserRole
+from app.progress import progress_hub, read_snapshot, FINAL_STATES
+import asyncio
+
+router = APIRouter(prefix="/tasks", tags=["Tasks"])
+
+async def task_status(task_id: str) -> dict:
+    """Final state from the result backend, otherwise the latest progress snapshot published by the worker."""
+    celery_task = celery_app.AsyncResult(task_id)
+    status_data = {"task_id": task_id, "status": celery_task.state, "info": {}}
+    if celery_task.state == 'SUCCESS': status_data["info"] = celery_task.result
+    elif celery_task.state == 'FAILURE': status_data["info"] = {"error": str(celery_task.info)}
+    elif celery_task.state == 'REVOKED': status_data["info"] = {"status": "cancelled"}
+    else:
+        snapshot = await read_snapshot(task_id)
+        if snapshot: status_data.update(status=snapshot["status"], info=snapshot["info"])
+    return status_data
+
+@router.websocket("/ws/{task_id}")
+async def websocket_task_progress(ws: WebSocket, task_id: str, token: Optional[str] = Query(None)):
+    """
+    Streams {task_id, status, info} events, the same shape as the status endpoints, and closes after the final one.
+    Needs the access token as ?token=; only the user who submitted the task (or an admin) may watch it.
+    """
+    async with AsyncSessionLocal() as db: user = await get_websocket_user(token, db)
+    if user is None or (user.role != UserRole.ADMIN and await dispatcher.owner(task_id) != str(user.id)):
+        await ws.close(code=status.WS_1008_POLICY_VIOLATION); return
+    await ws.accept()
+    queue = progress_hub.watch(task_id)  # subscribe before reading the snapshot so nothing falls in between
+    try:
+        event = await task_status(task_id)
+        await ws.send_json(event)
+        while event["status"] not in FINAL_STATES:
+            try: event = await asyncio.wait_for(queue.get(), timeout=15)
+            except asyncio.TimeoutError:
+                # Quiet task or a worker that died without publishing: re-check the backend
+                event = await task_status(task_id)
+            await ws.send_json(event)
+        await ws.close()
+    except WebSocketDisconnect: pass
+    except Exception as e: print(f"[PROGRESS] WebSocket for {task_id} closed: {e}")
+    finally: progress_hub.unwatch(task_id, queue)
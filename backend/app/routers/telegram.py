@@ -1,73 +1,40 @@
 from fastapi import APIRouter, Depends, HTTPException, status, WebSocket, WebSocketDisconnect
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, desc, distinct
-from typing import List, Optional
+from typing import List, Optional, Literal
 from datetime import datetime, timezone
 from app.database import get_db
-from app.models import User, TelegramSession, MessageLog
-from app.schemas import TelegramLoginRequest, TelegramOTPRequest, Telegram2FARequest, TelegramSessionResponse, ProfileLookupResponse, GroupLookupResponse
+from app.models import User, TelegramSession, MessageLog, MediaCaptureRule
+from app.schemas import TelegramLoginRequest, TelegramOTPRequest, Telegram2FARequest, TelegramSessionResponse, ProfileLookupResponse, GroupLookupResponse, SendMessageRequest, MediaCaptureRuleCreate, MediaCaptureRuleResponse
 from app.dependencies import get_current_user
-from app.telegram_service import TelegramManager, set_broadcast_callback
-from app.auth import decrypt_session_string
-import asyncio
+from app.telegram_service import TelegramManager
+from app.ws_fanout import live_feed
+from app import client_host
+from app.search import text_search
 
 router = APIRouter(prefix="/telegram", tags=["Telegram"])
-active_websockets: dict[int, List[WebSocket]] = {}
-
-async def ws_broadcast(session_id: int, message_log: MessageLog):
-    ts_str = message_log.timestamp.isoformat() if message_log.timestamp else ""
-    if not ts_str.endswith("Z"): ts_str += "Z"
-    message_data = {
-        "type": "message", "session_id": session_id,
-        "message": {
-            "id": message_log.id, "telegram_message_id": message_log.telegram_message_id,
-            "chat_id": message_log.chat_id, "chat_name": message_log.chat_name, "chat_username": message_log.chat_username,
-            "sender_id": message_log.sender_id, "sender_name": message_log.sender_name, "sender_username": message_log.sender_username,
-            "content": message_log.content, "media_type": message_log.media_type, "timestamp": ts_str
-        }
-    }
-    async def broadcast_to_list(sockets):
-        to_remove = []
-        for ws in list(sockets):
-            try: await ws.send_json(message_data)
-            except: to_remove.append(ws)
-        for ws in to_remove:
-            if ws in sockets: sockets.remove(ws)
-    if session_id in active_websockets: await broadcast_to_list(active_websockets[session_id])
-    if 0 in active_websockets: await broadcast_to_list(active_websockets[0])
-
-set_broadcast_callback(ws_broadcast)
-
-async def ensure_client_active(session_id: int, db: AsyncSession):
-    client = TelegramManager.get_client(session_id)
-    if client: await TelegramManager.start_client(client, session_id); return client
-    res = await db.execute(select(TelegramSession).where(TelegramSession.id == session_id))
-    sess = res.scalar_one_or_none()
-    if not sess or not sess.is_active: return None
-    try:
-        client = await TelegramManager.create_client(sess.session_name, sess.api_id, sess.api_hash, sess.phone_number, sess.id, decrypt_session_string(sess.session_string))
-        await TelegramManager.start_client(client, session_id)
-        return client
-    except Exception as e: print(f"Auto-start fail {session_id}: {e}"); return None
 
-async def ensure_all_active_clients(db: AsyncSession):
-    res = await db.execute(select(TelegramSession).where(TelegramSession.is_active == True))
-    for s in res.scalars().all():
-        if not TelegramManager.get_client(s.id): await ensure_client_active(s.id, db)
+async def ensure_client_active(session_id: int) -> bool:
+    """Returns at once for a running session; otherwise waits up to SESSION_ENSURE_WAIT for the supervisor to start it."""
+    return (await client_host.call("ensure", session_id=session_id)).get("active", False)
 
 @router.get("/messages")
-async def get_messages(session_id: Optional[int] = None, chat_id: Optional[str] = None, search: Optional[str] = None, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None, page: int = 1, limit: int = 50, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+async def get_messages(session_id: Optional[int] = None, chat_id: Optional[str] = None, search: Optional[str] = None, search_mode: Literal["fts", "substring"] = "fts", sort: Literal["date", "relevance"] = "date", start_date: Optional[datetime] = None, end_date: Optional[datetime] = None, page: int = 1, limit: int = 50, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
     query = select(MessageLog)
     if session_id and session_id > 0: query = query.where(MessageLog.session_id == session_id)
     else: query = query.where(MessageLog.session_id.in_(select(TelegramSession.id).where(TelegramSession.user_id == current_user.id)))
     if chat_id: query = query.where(MessageLog.chat_id == chat_id)
-    if search: query = query.where(MessageLog.content.ilike(f"%{search}%"))
+    rank = None
+    if search:
+        condition, rank = text_search(MessageLog.content, MessageLog.search_vector, search, search_mode)
+        query = query.where(condition)
     
     # Force Naive UTC for DB comparison
     if start_date: query = query.where(MessageLog.timestamp >= start_date.replace(tzinfo=None))
     if end_date: query = query.where(MessageLog.timestamp <= end_date.replace(tzinfo=None))
     
-    query = query.order_by(desc(MessageLog.timestamp)).offset((page - 1) * limit).limit(limit)
+    order = [desc(rank)] if sort == "relevance" and rank is not None else []
+    query = query.order_by(*order, desc(MessageLog.timestamp)).offset((page - 1) * limit).limit(limit)
     results = (await db.execute(query)).scalars().all()
     formatted_results = []
     for msg in results:
@@ -87,34 +54,62 @@ async def get_groups_history(session_id: Optional[int] = None, db: AsyncSession
 @router.post("/sessions", response_model=TelegramSessionResponse)
 async def create_session(d: dict, db: AsyncSession = Depends(get_db), u: User = Depends(get_current_user)):
     s = TelegramSession(user_id=u.id, session_name=d["session_name"], session_string=d["session_string"], phone_number=d["phone_number"], api_id=d["api_id"], api_hash=d["api_hash"], is_active=True)
-    db.add(s); await db.commit(); await db.refresh(s); await ensure_client_active(s.id, db); return s
+    db.add(s); await db.commit(); await db.refresh(s); await ensure_client_active(s.id); return s
 
 @router.get("/sessions", response_model=List[TelegramSessionResponse])
 async def list_sessions(db: AsyncSession = Depends(get_db), u: User = Depends(get_current_user)):
     res = await db.execute(select(TelegramSession).where(TelegramSession.user_id == u.id))
-    sessions = res.scalars().all()
-    for s in sessions:
-        if s.is_active: asyncio.create_task(ensure_client_active(s.id, db))
-    return sessions
+    return res.scalars().all()
 
 @router.delete("/sessions/{id}")
 async def delete_session(id: int, db: AsyncSession = Depends(get_db), u: User = Depends(get_current_user)):
     res = await db.execute(select(TelegramSession).where(TelegramSession.id == id, TelegramSession.user_id == u.id))
     s = res.scalar_one_or_none()
     if not s: raise HTTPException(404, "Not found")
-    await TelegramManager.stop_client(id); await db.delete(s); await db.commit(); return {"message": "Deleted"}
+    await client_host.call("stop", session_id=id); await db.delete(s); await db.commit(); return {"message": "Deleted"}
 
 @router.get("/sessions/{id}/chats")
 async def list_chats(id: int, db: AsyncSession = Depends(get_db), u: User = Depends(get_current_user)):
-    await ensure_client_active(id, db); return await TelegramManager.get_dialogs(id)
+    await ensure_client_active(id); return await client_host.call("get_dialogs", session_id=id)
+
+async def get_owned_session(id: int, db: AsyncSession, u: User) -> TelegramSession:
+    s = (await db.execute(select(TelegramSession).where(TelegramSession.id == id, TelegramSession.user_id == u.id))).scalar_one_or_none()
+    if not s: raise HTTPException(404, "Not found")
+    return s
+
+@router.post("/sessions/{id}/send")
+async def send_message(id: int, r: SendMessageRequest, db: AsyncSession = Depends(get_db), u: User = Depends(get_current_user)):
+    await get_owned_session(id, db, u)
+    await ensure_client_active(id)
+    res = await client_host.call("send_message", session_id=id, chat_id=r.chat_id, text=r.text)
+    if res.get("error"): raise HTTPException(400, res["error"])
+    return res
+
+@router.get("/sessions/{id}/capture-rules", response_model=List[MediaCaptureRuleResponse])
+async def list_capture_rules(id: int, db: AsyncSession = Depends(get_db), u: User = Depends(get_current_user)):
+    await get_owned_session(id, db, u)
+    return (await db.execute(select(MediaCaptureRule).where(MediaCaptureRule.session_id == id))).scalars().all()
+
+@router.post("/sessions/{id}/capture-rules", response_model=MediaCaptureRuleResponse)
+async def create_capture_rule(id: int, r: MediaCaptureRuleCreate, db: AsyncSession = Depends(get_db), u: User = Depends(get_current_user)):
+    await get_owned_session(id, db, u)
+    rule = MediaCaptureRule(session_id=id, **r.model_dump())
+    db.add(rule); await db.commit(); await db.refresh(rule); return rule
+
+@router.delete("/sessions/{id}/capture-rules/{rule_id}")
+async def delete_capture_rule(id: int, rule_id: int, db: AsyncSession = Depends(get_db), u: User = Depends(get_current_user)):
+    await get_owned_session(id, db, u)
+    rule = (await db.execute(select(MediaCaptureRule).where(MediaCaptureRule.id == rule_id, MediaCaptureRule.session_id == id))).scalar_one_or_none()
+    if not rule: raise HTTPException(404, "Not found")
+    await db.delete(rule); await db.commit(); return {"message": "Deleted"}
 
 @router.get("/profile/{q}", response_model=ProfileLookupResponse)
 async def lookup_profile(q: str, session_id: int, db: AsyncSession = Depends(get_db), u: User = Depends(get_current_user)):
-    await ensure_client_active(session_id, db); return await TelegramManager.get_profile_info(session_id, q)
+    await ensure_client_active(session_id); return await client_host.call("get_profile_info", session_id=session_id, username_or_phone=q)
 
 @router.get("/group/{q}", response_model=GroupLookupResponse)
 async def lookup_group(q: str, session_id: int, db: AsyncSession = Depends(get_db), u: User = Depends(get_current_user)):
-    await ensure_client_active(session_id, db); return await TelegramManager.get_group_info(session_id, q)
+    await ensure_client_active(session_id); return await client_host.call("get_group_info", session_id=session_id, group_link=q)
 
 @router.post("/login/send-code")
 async def send_otp(r: TelegramLoginRequest):
@@ -136,13 +131,11 @@ async def verify_2fa(r: Telegram2FARequest):
     return res
 
 @router.websocket("/ws/feed/{sid}")
-async def websocket_feed(ws: WebSocket, sid: int, db: AsyncSession = Depends(get_db)):
+async def websocket_feed(ws: WebSocket, sid: int):
+    # Active sessions are brought up by the session supervisor at startup, so the feed never waits on handshakes
     await ws.accept()
-    if sid == 0: await ensure_all_active_clients(db)
-    else: await ensure_client_active(sid, db)
-    if sid not in active_websockets: active_websockets[sid] = []
-    active_websockets[sid].append(ws)
+    subscriber = live_feed.subscribe(sid, ws)
     try:
         while True: await ws.receive_text()
-    except WebSocketDisconnect:
-        if sid in active_websockets and ws in active_websockets[sid]: active_websockets[sid].remove(ws)
\ No newline at end of file
+    except WebSocketDisconnect: pass
+    finally: live_feed.unsubscribe(subscriber)
\ No newline at end of file
@@ -1,6 +1,6 @@
 from __future__ import annotations
 from pydantic import BaseModel, EmailStr, Field
-from typing import Optional, List, Dict, Any, Union
+from typing import Optional, List, Dict, Any, Union, Literal
 from datetime import datetime
 from app.models import UserRole, UserStatus
 
@@ -31,6 +31,9 @@ class TokenResponse(BaseModel):
 class UserUpdateStatus(BaseModel):
     status: UserStatus
 
+class BandwidthWeightUpdate(BaseModel):
+    weight: float = Field(..., gt=0, le=100)
+
 class ResetPasswordRequest(BaseModel):
     new_password: str = Field(..., min_length=6)
 
@@ -80,6 +83,11 @@ class DownloadRequest(BaseModel):
     media_types: List[str] = ["photo", "video", "document"]
     limit: Optional[int] = None
     save_locally: bool = False
+    chat_order: Literal["largest_first", "smallest_first", "dialog"] = "largest_first" # when chat_ids is empty
+    priority: Literal["history", "newest_first", "smallest_first"] = "history" # non-history orders download only after the scan
+    max_total_bytes: Optional[int] = Field(default=None, gt=0) # byte budget for the whole job
+    max_file_size: Optional[int] = Field(default=None, gt=0) # skip files larger than this
+    estimate_only: bool = False # scan and report files/bytes/time without downloading
 
 class DownloadTaskResponse(BaseModel):
     id: int
@@ -110,6 +118,26 @@ class GroupLookupResponse(BaseModel):
     description: Optional[str]
     is_verified: bool
 
+class MediaCaptureRuleCreate(BaseModel):
+    media_types: List[Literal['photo', 'video', 'document', 'sticker', 'voice', 'audio', 'video_note']] = []
+    chat_ids: List[str] = []
+    max_file_size: Optional[int] = Field(default=None, gt=0)
+    enabled: bool = True
+
+class MediaCaptureRuleResponse(BaseModel):
+    id: int
+    session_id: int
+    media_types: List[str]
+    chat_ids: List[str]
+    max_file_size: Optional[int]
+    enabled: bool
+    created_at: datetime
+    class Config: from_attributes = True
+
+class SendMessageRequest(BaseModel):
+    chat_id: str
+    text: str = Field(min_length=1, max_length=4096)
+
 class BroadcastRequest(BaseModel):
     session_id: int
     message: str
@@ -128,6 +156,8 @@ class DumpRequest(BaseModel):
     chat_ids: List[str] = []
     start_time: Optional[datetime] = None
     end_time: Optional[datetime] = None
+    incremental: bool = True # resume from the per-chat checkpoint instead of re-reading stored history
+    chat_order: Literal["largest_first", "smallest_first", "dialog"] = "largest_first" # when chat_ids is empty
 
 class DumpTaskResponse(BaseModel):
     id: int
@@ -0,0 +1,47 @@
+"""
+Message search over the generated `search_vector` columns (to_tsvector('simple', content), GIN indexed).
+The 'simple' configuration neither stems nor drops stop words, so Vietnamese and English behave the same.
+Terms containing CJK text, which has no spaces to split on, fall back to a substring match served by the
+pg_trgm index on content.
+
+Query syntax (fts mode): plain words must all match, "quoted text" is a phrase, `or` and `-word` work as in
+web search, and a trailing * makes a word a prefix (`tele*`).
+"""
+from sqlalchemy import func
+from typing import Optional, Tuple
+import re
+
+CJK = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af]")  # kana, CJK ideographs, hangul
+WORD = re.compile(r"\w+")
+TOKEN = re.compile(r'(-?)"([^"]*)"|(\S+)')
+
+# Tables whose search_vector column exists, filled in by init_db. On a database that predates search, fts
+# requests fall back to substring matching until `python -m app.migrate_search` has run and the API restarted.
+FTS_TABLES = set()
+
+def _prefix_tsquery(term: str) -> str:
+    """websearch_to_tsquery's syntax (phrases, or, -word) plus word* prefixes, as a to_tsquery string."""
+    groups, group = [], []
+    for match in TOKEN.finditer(term):
+        negate, phrase, bare = match.group(1), match.group(2), match.group(3)
+        if bare and bare.lower() == "or":
+            if group: groups.append(group); group = []
+            continue
+        if bare and bare.startswith("-"): negate, bare = "-", bare[1:]
+        words = WORD.findall(phrase if phrase is not None else bare)
+        if not words: continue
+        if bare and bare.endswith("*"): words[-1] += ":*"
+        part = " <-> ".join(words)
+        if len(words) > 1: part = f"({part})"
+        group.append(f"!{part}" if negate else part)
+    if group: groups.append(group)
+    return " | ".join(f"({' & '.join(group)})" for group in groups)
+
+def text_search(column, vector, term: str, mode: str = "fts") -> Tuple[object, Optional[object]]:
+    """Returns (where clause, relevance expression or None) for matching `term` against a content column."""
+    if mode == "substring": return column.ilike(f"%{term}%"), None
+    if CJK.search(term) or not WORD.search(term):
+        return column.ilike(f"%{term}%"), func.word_similarity(term, column)
+    if column.class_.__tablename__ not in FTS_TABLES: return column.ilike(f"%{term}%"), None
+    query = func.to_tsquery("simple", _prefix_tsquery(term)) if "*" in term else func.websearch_to_tsquery("simple", term)
+    return vector.op("@@")(query), func.ts_rank_cd(vector, query)
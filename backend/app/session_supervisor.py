@@ -0,0 +1,120 @@
+"""
+Brings up every active Telegram session owned by this process and keeps it up: at most
+SESSION_WARMUP_CONCURRENCY handshakes run at once, failures retry with exponential backoff, and each
+session's health is kept for /health. Runs in the API (embedded mode) or in each client-host shard.
+"""
+from sqlalchemy import select
+from typing import Callable, Dict, Optional
+import asyncio
+import random
+import time
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app.models import TelegramSession
+from app.auth import decrypt_session_string
+from app.telegram_service import TelegramManager, active_clients
+
+class SessionSupervisor:
+    def __init__(self, concurrency: int = None):
+        self.owns: Callable[[int], bool] = lambda session_id: True
+        self.health: Dict[int, dict] = {}
+        self.warmed_up = False
+        self._concurrency = concurrency or settings.SESSION_WARMUP_CONCURRENCY
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._bringing_up: Dict[int, asyncio.Task] = {}
+        self._loop_task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._slots is None: self._slots = asyncio.Semaphore(self._concurrency)
+        if self._loop_task is None or self._loop_task.done(): self._loop_task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try: await self.reconcile()
+            except asyncio.CancelledError: raise
+            except Exception as e: print(f"[SUPERVISOR] Reconcile failed: {e}")
+            await asyncio.sleep(settings.CLIENT_HOST_REBALANCE_SECONDS)
+
+    async def reconcile(self):
+        """Starts owned active sessions that are down, stops clients that are no longer owned or active."""
+        async with AsyncSessionLocal() as db:
+            ids = set((await db.execute(select(TelegramSession.id).where(TelegramSession.is_active == True))).scalars().all())
+        owned = {sid for sid in ids if self.owns(sid)}
+        for sid in set(active_clients) | set(self.health):
+            if sid not in owned: await self.stop(sid)
+        for sid in owned:
+            client = active_clients.get(sid)
+            if client is not None and not client.is_connected:
+                self.health[sid] = {**self.health.get(sid, {}), 'state': 'disconnected'}
+                active_clients.pop(sid, None)
+            self.request(sid)
+        # Ready once every owned session has had its first attempt, whatever the outcome
+        while not self.warmed_up:
+            if any(self.health.get(sid, {}).get('attempts', 0) == 0 for sid in list(self._bringing_up)): await asyncio.sleep(0.2)
+            else: self.warmed_up = True
+
+    def request(self, session_id: int) -> asyncio.Task:
+        """Schedules a bring-up unless the session is running or one is already underway."""
+        task = self._bringing_up.get(session_id)
+        if task and not task.done(): return task
+        if session_id in active_clients:
+            task = asyncio.get_running_loop().create_future(); task.set_result(True)
+            return task
+        task = asyncio.create_task(self._bring_up(session_id))
+        self._bringing_up[session_id] = task
+        task.add_done_callback(lambda _: self._bringing_up.pop(session_id, None) if self._bringing_up.get(session_id) is task else None)
+        return task
+
+    async def ensure(self, session_id: int, wait: float = None) -> bool:
+        """Requests the session and waits up to `wait` seconds for it to be running."""
+        if self._slots is None: self.start()
+        task = self.request(session_id)
+        try: await asyncio.wait_for(asyncio.shield(task), timeout=settings.SESSION_ENSURE_WAIT if wait is None else wait)
+        except asyncio.TimeoutError: pass
+        return session_id in active_clients
+
+    async def _bring_up(self, session_id: int) -> bool:
+        attempts = 0
+        while True:
+            entry = self.health.setdefault(session_id, {'state': 'starting', 'attempts': 0})
+            async with self._slots:
+                entry.update(state='starting', next_retry=None)
+                client = None
+                try:
+                    async with AsyncSessionLocal() as db:
+                        sess = (await db.execute(select(TelegramSession).where(TelegramSession.id == session_id))).scalar_one_or_none()
+                    if not sess or not sess.is_active:
+                        self.health.pop(session_id, None); return False
+                    client = await TelegramManager.create_client(sess.session_name, sess.api_id, sess.api_hash, sess.phone_number, sess.id, decrypt_session_string(sess.session_string))
+                    await asyncio.wait_for(TelegramManager.start_client(client, session_id), timeout=settings.SESSION_START_TIMEOUT)
+                    entry.update(state='ready', attempts=entry['attempts'] + 1, last_error=None, ready_since=time.time())
+                    return True
+                except asyncio.CancelledError: raise
+                except Exception as e:
+                    attempts += 1
+                    delay = min(settings.SESSION_RETRY_BASE * 2 ** (attempts - 1), settings.SESSION_RETRY_MAX) * random.uniform(0.8, 1.2)
+                    entry.update(state='backoff', attempts=entry['attempts'] + 1, last_error=str(e) or type(e).__name__, next_retry=time.time() + delay)
+                    if client is not None and client.is_connected:
+                        # A handshake that timed out half-way must not keep a second connection alive
+                        try: await client.stop()
+                        except Exception: pass
+                    print(f"[SUPERVISOR] Session {session_id} failed to start (attempt {attempts}), retrying in {delay:.0f}s: {e}")
+            await asyncio.sleep(delay)
+
+    async def stop(self, session_id: int):
+        task = self._bringing_up.pop(session_id, None)
+        if task: task.cancel()
+        self.health.pop(session_id, None)
+        await TelegramManager.stop_client(session_id)
+
+    def readiness(self) -> dict:
+        states: Dict[str, int] = {}
+        for entry in self.health.values(): states[entry['state']] = states.get(entry['state'], 0) + 1
+        return {'ready': self.warmed_up, 'states': states, 'sessions': {str(sid): entry for sid, entry in self.health.items()}}
+
+    async def close(self):
+        if self._loop_task: self._loop_task.cancel()
+        for task in list(self._bringing_up.values()): task.cancel()
+        for sid in list(active_clients): await TelegramManager.stop_client(sid)
+
+session_supervisor = SessionSupervisor()
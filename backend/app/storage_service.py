@@ -3,8 +3,50 @@ from minio.deleteobjects import DeleteObject
 from minio.error import S3Error
 from app.config import settings
 import os
+import queue
 from datetime import timedelta
 
+class ChunkPipe:
+    """
+    Blocking file-like reader fed chunk by chunk from another thread or event loop.
+    Holds at most `max_chunks` pending chunks so a streaming upload never buffers a whole file.
+    """
+    def __init__(self, max_chunks: int = 4):
+        self._queue = queue.Queue(maxsize=max_chunks)
+        self._buffer = bytearray()
+        self._eof = False
+        self._error = None
+        self.reader_done = False
+
+    def write(self, chunk: bytes):
+        while True:
+            if self.reader_done: raise IOError("Upload stream closed by reader")
+            try: self._queue.put(chunk, timeout=0.5); return
+            except queue.Full: continue
+
+    def close(self): self.write(None)
+
+    def abort(self, error: Exception):
+        """Fails the reader on its next read so a partial object is never completed."""
+        self._error = error
+        while True:
+            try: self._queue.put_nowait(None); return
+            except queue.Full:
+                try: self._queue.get_nowait()
+                except queue.Empty: pass
+
+    def read(self, size: int = -1) -> bytes:
+        while not self._eof and (size < 0 or len(self._buffer) < size):
+            chunk = self._queue.get()
+            if chunk is None:
+                if self._error: raise IOError(f"Upload stream aborted: {self._error}")
+                self._eof = True; break
+            self._buffer += chunk
+        if size < 0: size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
 class StorageManager:
     _internal_client = None
     _public_client = None
@@ -50,6 +92,31 @@ class StorageManager:
             print(f"MinIO Upload Error: {e}")
             return None
 
+    @staticmethod
+    def upload_stream(data, object_name: str, content_type: str = "application/octet-stream", length: int = -1):
+        """
+        Upload from a file-like stream without touching disk.
+        Unknown lengths go through a multipart upload of MINIO_PART_SIZE parts.
+        """
+        try:
+            client = StorageManager.get_internal_client()
+            client.put_object(settings.MINIO_BUCKET_NAME, object_name, data, length, content_type=content_type,
+                              part_size=settings.MINIO_PART_SIZE, num_parallel_uploads=settings.UPLOAD_CONCURRENCY)
+            return object_name
+        except Exception as e:
+            print(f"MinIO Stream Upload Error: {e}")
+            return None
+
+    @staticmethod
+    def download_file(object_name: str, file_path: str):
+        try:
+            client = StorageManager.get_internal_client()
+            client.fget_object(settings.MINIO_BUCKET_NAME, object_name, file_path)
+            return file_path
+        except Exception as e:
+            print(f"MinIO Download Error: {e}")
+            return None
+
     @staticmethod
     def list_files(prefix: str = ""):
         return []
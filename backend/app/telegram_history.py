@@ -0,0 +1,90 @@
+"""
+History and search iterators shared by the Celery worker and TelegramManager.
+They call messages.GetHistory / messages.Search directly so callers can push id and date bounds to Telegram.
+"""
+from pyrogram import Client, enums, raw, utils
+from datetime import datetime
+from typing import AsyncGenerator, Awaitable, Callable, List, Optional, Union
+
+# Runs a request on the caller's behalf, e.g. a rate_limiter.Throttle; it owns FloodWait handling
+Throttle = Callable[..., Awaitable]
+
+# Downloader media types mapped to Telegram's server-side search filters
+MEDIA_SEARCH_FILTERS = {
+    "photo": [enums.MessagesFilter.PHOTO],
+    "video": [enums.MessagesFilter.VIDEO, enums.MessagesFilter.VIDEO_NOTE],
+    "audio": [enums.MessagesFilter.AUDIO, enums.MessagesFilter.VOICE_NOTE],
+    "document": [enums.MessagesFilter.DOCUMENT],
+    "archive": [enums.MessagesFilter.DOCUMENT],
+}
+
+async def _invoke(client: Client, query, throttle: Optional[Throttle]):
+    # With a throttle, FloodWait is raised to it instead of being slept out inside Pyrogram
+    if throttle: return await throttle(client.invoke, query, sleep_threshold=0)
+    return await client.invoke(query, sleep_threshold=60)
+
+async def _resolve_peer(client: Client, chat_id: Union[int, str], throttle: Optional[Throttle]):
+    if throttle: return await throttle(client.resolve_peer, chat_id)
+    return await client.resolve_peer(chat_id)
+
+async def iter_search(client: Client, chat_id: Union[int, str], message_filter: "enums.MessagesFilter", min_date: Optional[datetime] = None, max_date: Optional[datetime] = None, page_size: int = 100, throttle: Optional[Throttle] = None) -> AsyncGenerator:
+    """Yields messages matching a search filter newest-first, with the date window applied by Telegram."""
+    peer = await _resolve_peer(client, chat_id, throttle)
+    offset_id = 0
+    while True:
+        r = await _invoke(client, raw.functions.messages.Search(
+            peer=peer, q="", filter=message_filter.value(),
+            min_date=utils.datetime_to_timestamp(min_date) if min_date else 0,
+            max_date=utils.datetime_to_timestamp(max_date) if max_date else 0,
+            offset_id=offset_id, add_offset=0, limit=page_size, max_id=0, min_id=0, hash=0
+        ), throttle)
+        messages = await utils.parse_messages(client, r, replies=0)
+        if not messages: return
+        for message in messages: yield message
+        offset_id = messages[-1].id
+
+async def iter_media_search(client: Client, chat_id: Union[int, str], media_types: List[str], min_date: Optional[datetime] = None, max_date: Optional[datetime] = None, throttle: Optional[Throttle] = None) -> AsyncGenerator:
+    """Runs one search per needed filter and merges the streams newest-first, dropping duplicates."""
+    filters = []
+    for media_type in media_types:
+        for message_filter in MEDIA_SEARCH_FILTERS.get(media_type, []):
+            if message_filter not in filters: filters.append(message_filter)
+    streams = [iter_search(client, chat_id, f, min_date, max_date, throttle=throttle).__aiter__() for f in filters]
+    heads = {}
+    for stream in streams:
+        try: heads[stream] = await stream.__anext__()
+        except StopAsyncIteration: pass
+    last_id = None
+    while heads:
+        stream = max(heads, key=lambda s: heads[s].id)
+        message = heads[stream]
+        try: heads[stream] = await stream.__anext__()
+        except StopAsyncIteration: del heads[stream]
+        if message.id == last_id: continue
+        last_id = message.id
+        yield message
+
+async def iter_history_window(client: Client, chat_id: Union[int, str], start_dt: Optional[datetime] = None, end_dt: Optional[datetime] = None, offset_id: int = 0, min_id: int = 0, throttle: Optional[Throttle] = None) -> AsyncGenerator:
+    """
+    Yields messages newest-first inside [start_dt, end_dt]. Iteration is positioned at end_dt
+    with offset_date, so nothing newer is paged through, and stops at the first message older than start_dt.
+    An explicit offset_id (resuming below an earlier position) takes precedence over end_dt.
+    """
+    peer = await _resolve_peer(client, chat_id, throttle)
+    # offset_date returns messages strictly older than it; end_dt is inclusive and Telegram dates are whole seconds
+    offset_date = utils.datetime_to_timestamp(end_dt) + 1 if end_dt and not offset_id else 0
+    while True:
+        r = await _invoke(client, raw.functions.messages.GetHistory(
+            peer=peer, offset_id=offset_id, offset_date=offset_date, add_offset=0,
+            limit=100, max_id=0, min_id=min_id, hash=0
+        ), throttle)
+        messages = await utils.parse_messages(client, r, replies=0)
+        if not messages: return
+        for message in messages:
+            if message.id <= min_id: return
+            if message.date is None: continue
+            if start_dt and message.date < start_dt: return
+            if end_dt and message.date > end_dt: continue
+            yield message
+        offset_id = messages[-1].id
+        offset_date = 0
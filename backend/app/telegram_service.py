@@ -1,20 +1,36 @@
 from pyrogram import Client, filters
 from pyrogram.types import Message
 from pyrogram.handlers import MessageHandler
-from typing import Dict, Optional, Callable
+from typing import Dict, Optional
 import os
+import json
 from datetime import datetime, timezone
-from app.database import AsyncSessionLocal
-from app.models import MessageLog
+from app.config import settings
+from app.ingest import message_ingest
 from app.auth import encrypt_session_string
+from app.telegram_history import iter_history_window
+from app.rate_limiter import rate_limiter
+from app.redis_client import get_redis
+from app.live_bus import publish_message
+from app.media_capture import media_capture
 
 active_clients: Dict[int, Client] = {}
-pending_auth: Dict[str, Dict] = {}
-broadcast_callback: Optional[Callable] = None
+# Logins in progress live in Redis plus a temp session file, so every step may hit a different API worker
+PENDING_AUTH_PREFIX = "superapp:pending_auth:"
+TEMP_WORKDIR = "./sessions/temp"
 
-def set_broadcast_callback(callback: Callable):
-    global broadcast_callback
-    broadcast_callback = callback
+def _temp_client(session_name: str, api_id: str, api_hash: str, phone_number: str) -> Client:
+    os.makedirs(TEMP_WORKDIR, exist_ok=True)
+    return Client(name=f"temp_{session_name}", api_id=int(api_id), api_hash=api_hash, workdir=TEMP_WORKDIR, phone_number=phone_number)
+
+async def _load_pending_auth(session_name: str) -> Optional[dict]:
+    payload = await get_redis().get(f"{PENDING_AUTH_PREFIX}{session_name}")
+    return json.loads(payload) if payload else None
+
+async def _finish_pending_auth(session_name: str):
+    await get_redis().delete(f"{PENDING_AUTH_PREFIX}{session_name}")
+    try: os.remove(os.path.join(TEMP_WORKDIR, f"temp_{session_name}.session"))
+    except OSError: pass
 
 class TelegramManager:
     @staticmethod
@@ -30,47 +46,47 @@ class TelegramManager:
     async def start_client(client: Client, session_id: int):
         async def persistence_handler(client: Client, message: Message):
             try:
-                print(f"[DEBUG] New message from {message.chat.id} in session {session_id}")
-                async with AsyncSessionLocal() as db:
-                    # Improved Name Resolution
-                    chat_name = message.chat.title
-                    if not chat_name:
-                        chat_name = f"{message.chat.first_name or ''} {message.chat.last_name or ''}".strip()
-                    if not chat_name:
-                        chat_name = message.chat.username or "Unknown"
-                    
-                    chat_username = message.chat.username
-                    
-                    sender_name = "Unknown"
-                    sender_username = None
-                    if message.from_user:
-                        sender_name = f"{message.from_user.first_name or ''} {message.from_user.last_name or ''}".strip() or "Unknown"
-                        sender_username = message.from_user.username
-                    elif message.sender_chat:
-                        sender_name = message.sender_chat.title or "Unknown Group/Channel"
-                        sender_username = message.sender_chat.username
-                    
-                    media_type = None
-                    if message.photo: media_type = 'photo'
-                    elif message.video: media_type = 'video'
-                    elif message.document: media_type = 'document'
-                    elif message.sticker: media_type = 'sticker'
-                    elif message.voice: media_type = 'voice'
-                    elif message.audio: media_type = 'audio'
-                    elif message.video_note: media_type = 'video_note'
+                # Improved Name Resolution
+                chat_name = message.chat.title
+                if not chat_name:
+                    chat_name = f"{message.chat.first_name or ''} {message.chat.last_name or ''}".strip()
+                if not chat_name:
+                    chat_name = message.chat.username or "Unknown"
+                
+                chat_username = message.chat.username
+                
+                sender_name = "Unknown"
+                sender_username = None
+                if message.from_user:
+                    sender_name = f"{message.from_user.first_name or ''} {message.from_user.last_name or ''}".strip() or "Unknown"
+                    sender_username = message.from_user.username
+                elif message.sender_chat:
+                    sender_name = message.sender_chat.title or "Unknown Group/Channel"
+                    sender_username = message.sender_chat.username
+                
+                media_type = None
+                if message.photo: media_type = 'photo'
+                elif message.video: media_type = 'video'
+                elif message.document: media_type = 'document'
+                elif message.sticker: media_type = 'sticker'
+                elif message.voice: media_type = 'voice'
+                elif message.audio: media_type = 'audio'
+                elif message.video_note: media_type = 'video_note'
 
-                    content = message.text or message.caption or ""
-                    if not content and media_type: content = f"[{media_type.upper()}]"
-                    timestamp = datetime.now(timezone.utc).replace(tzinfo=None)
+                content = message.text or message.caption or ""
+                if not content and media_type: content = f"[{media_type.upper()}]"
+                timestamp = datetime.now(timezone.utc).replace(tzinfo=None)
 
-                    new_log = MessageLog(
-                        telegram_message_id=message.id, chat_id=str(message.chat.id), chat_name=chat_name, chat_username=chat_username,
-                        sender_id=str(message.from_user.id) if message.from_user else str(message.sender_chat.id) if message.sender_chat else None,
-                        sender_name=sender_name, sender_username=sender_username,
-                        content=content, media_type=media_type, timestamp=timestamp, session_id=session_id
-                    )
-                    db.add(new_log); await db.commit(); await db.refresh(new_log)
-                    if broadcast_callback: await broadcast_callback(session_id, new_log)
+                row = dict(
+                    telegram_message_id=message.id, chat_id=str(message.chat.id), chat_name=chat_name, chat_username=chat_username,
+                    sender_id=str(message.from_user.id) if message.from_user else str(message.sender_chat.id) if message.sender_chat else None,
+                    sender_name=sender_name, sender_username=sender_username,
+                    content=content, media_type=media_type, media_path=None, timestamp=timestamp, session_id=session_id, created_at=timestamp
+                )
+                # Subscribers see the message now; the row is written with the next batch (it has no id yet)
+                await publish_message(session_id, row)
+                await message_ingest.add(row)
+                media_capture.offer(client, session_id, message, row)
             except Exception as e: print(f"[ERROR] handling message: {e}")
 
         if not getattr(client, "has_persistence_handler", False):
@@ -90,35 +106,46 @@ class TelegramManager:
     
     @staticmethod
     async def send_code(phone_number: str, api_id: str, api_hash: str, session_name: str) -> dict:
+        client = _temp_client(session_name, api_id, api_hash, phone_number)
         try:
-            workdir = "./sessions/temp"; os.makedirs(workdir, exist_ok=True)
-            client = Client(name=f"temp_{session_name}", api_id=int(api_id), api_hash=api_hash, workdir=workdir, phone_number=phone_number)
             await client.connect(); sent_code = await client.send_code(phone_number)
-            pending_auth[session_name] = {"client": client, "phone_code_hash": sent_code.phone_code_hash, "phone_number": phone_number}
+            # The auth key stays in the temp session file; the code is checked against it on the next step
+            state = {"phone_code_hash": sent_code.phone_code_hash, "phone_number": phone_number, "api_id": api_id, "api_hash": api_hash}
+            await get_redis().set(f"{PENDING_AUTH_PREFIX}{session_name}", json.dumps(state), ex=settings.LOGIN_STATE_TTL)
             return {"success": True, "phone_code_hash": sent_code.phone_code_hash, "message": "OTP sent"}
         except Exception as e: return {"success": False, "error": str(e)}
+        finally:
+            if client.is_connected: await client.disconnect()
     
     @staticmethod
     async def verify_code(session_name: str, code: str) -> dict:
-        if session_name not in pending_auth: return {"success": False, "error": "Session not found"}
+        auth = await _load_pending_auth(session_name)
+        if not auth: return {"success": False, "error": "Session not found"}
+        client = _temp_client(session_name, auth["api_id"], auth["api_hash"], auth["phone_number"])
         try:
-            auth = pending_auth[session_name]; client = auth["client"]
+            await client.connect()
             await client.sign_in(auth["phone_number"], auth["phone_code_hash"], code)
-            string = await client.export_session_string(); await client.disconnect(); del pending_auth[session_name]
+            string = await client.export_session_string(); await client.disconnect(); await _finish_pending_auth(session_name)
             return {"success": True, "session_string": encrypt_session_string(string), "requires_2fa": False}
         except Exception as e:
             if "PASSWORD_REQUIRED" in str(e): return {"success": False, "requires_2fa": True, "message": "2FA required"}
             return {"success": False, "error": str(e)}
+        finally:
+            if client.is_connected: await client.disconnect()
     
     @staticmethod
     async def verify_2fa(session_name: str, password: str) -> dict:
-        if session_name not in pending_auth: return {"success": False, "error": "Session not found"}
+        auth = await _load_pending_auth(session_name)
+        if not auth: return {"success": False, "error": "Session not found"}
+        client = _temp_client(session_name, auth["api_id"], auth["api_hash"], auth["phone_number"])
         try:
-            client = pending_auth[session_name]["client"]
+            await client.connect()
             await client.check_password(password)
-            string = await client.export_session_string(); await client.disconnect(); del pending_auth[session_name]
+            string = await client.export_session_string(); await client.disconnect(); await _finish_pending_auth(session_name)
             return {"success": True, "session_string": encrypt_session_string(string)}
         except Exception as e: return {"success": False, "error": str(e)}
+        finally:
+            if client.is_connected: await client.disconnect()
 
     @staticmethod
     async def get_dialogs(session_id: int, limit: int = 100) -> dict:
@@ -126,7 +153,7 @@ class TelegramManager:
         if not client: return {"error": "Client not active", "chats": []}
         try:
             chats = []
-            async for d in client.get_dialogs(limit=limit):
+            async for d in rate_limiter.iterate(session_id, 'history', client.get_dialogs(limit=limit)):
                 # Improved Name Resolution Logic
                 name = d.chat.title
                 if not name:
@@ -149,8 +176,8 @@ class TelegramManager:
         client = active_clients.get(session_id)
         if not client: return {"error": "Client not active"}
         try:
-            user = await client.get_users(username_or_phone)
-            try: common = len(await client.get_common_chats(user.id))
+            user = await rate_limiter.call(session_id, 'history', client.get_users, username_or_phone)
+            try: common = len(await rate_limiter.call(session_id, 'history', client.get_common_chats, user.id))
             except: common = 0
             return {"user_id": user.id, "username": user.username, "first_name": user.first_name, "last_name": user.last_name, "phone": user.phone_number, "bio": getattr(user, "bio", None), "dc_id": getattr(user, "dc_id", None), "common_chats_count": common}
         except Exception as e: return {"error": str(e)}
@@ -160,10 +187,22 @@ class TelegramManager:
         client = active_clients.get(session_id)
         if not client: return {"error": "Client not active"}
         try:
-            chat = await client.get_chat(group_link)
+            chat = await rate_limiter.call(session_id, 'history', client.get_chat, group_link)
             return {"chat_id": chat.id, "title": chat.title, "username": chat.username, "member_count": chat.members_count, "description": chat.description, "is_verified": chat.is_verified}
         except Exception as e: return {"error": str(e)}
 
+    @staticmethod
+    async def send_message(session_id: int, chat_id: str, text: str) -> dict:
+        client = active_clients.get(session_id)
+        if not client: return {"error": "Client not active"}
+        try:
+            target = int(chat_id) if str(chat_id).lstrip('-').isdigit() else chat_id
+            msg = await rate_limiter.call(session_id, 'send', client.send_message, target, text)
+            return {"success": True, "message_id": msg.id, "chat_id": str(msg.chat.id)}
+        except Exception as e: return {"error": str(e)}
+
+    @staticmethod
+    async def get_messages_for_summary(session_id: int, chat_ids: list, start_time: Optional[datetime] = None, end_time: Optional[datetime] = None, limit: int = 500) -> list:
         """
         Fetch messages directly from Telegram for AI summary
         """
@@ -176,27 +215,24 @@ class TelegramManager:
         
         # If chat_ids is empty or None, we can't easily dump ALL chats for summary in real-time quickly.
         # So we require at least one chat ID or use a small subset of dialogs.
-        # For now, assume chat_ids provided.
         
+        history = rate_limiter.bind(session_id, 'history')
         target_chats = []
         if not chat_ids or not chat_ids[0]:
              # Limit to top 5 dialogs if no chat selected to prevent overload
-             async for d in client.get_dialogs(limit=5): target_chats.append(d.chat)
+             async for d in rate_limiter.iterate(session_id, 'history', client.get_dialogs(limit=5)): target_chats.append(d.chat)
         else:
              for cid in chat_ids:
                  try:
                      val = int(cid) if str(cid).lstrip('-').isdigit() else cid
-                     chat = await client.get_chat(val)
+                     chat = await history(client.get_chat, val)
                      target_chats.append(chat)
                  except: continue
 
         for chat in target_chats:
             chat_title = chat.title or f"{chat.first_name or ''} {chat.last_name or ''}".strip()
-            async for msg in client.get_chat_history(chat.id):
-                # Time filter
-                if end_time and msg.date > end_time: continue
-                if start_time and msg.date < start_time: break # Optimisation: stop if older
-                
+            # Starts at end_time and stops at start_time instead of paging through newer history
+            async for msg in iter_history_window(client, chat.id, start_time, end_time, throttle=history):
                 # Content filter
                 content = msg.text or msg.caption or ""
                 if not content: continue # Skip media-only for summary unless needed
@@ -209,4 +245,4 @@ class TelegramManager:
             
             if len(messages_text) >= limit: break
             
-        return messages_text
\ No newline at end of file
+        return messages_text
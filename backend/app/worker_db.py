@@ -0,0 +1,210 @@
+"""
+Shared asyncpg pool for Celery worker-side writes.
+Hot INSERT/UPDATE statements are prepared once per pooled connection, and
+acquire metrics are published to Redis so the pool can be sized from /admin/worker-metrics.
+"""
+from contextlib import asynccontextmanager
+from app.config import settings
+from app.redis_client import get_redis
+import asyncio
+import asyncpg
+import json
+import os
+import socket
+import time
+
+METRICS_KEY = "superapp:metrics:db_pool"
+
+HOT_QUERIES = {
+    "session_credentials": "SELECT session_string, api_id, api_hash FROM telegram_sessions WHERE id = $1",
+    "insert_file": '''
+        INSERT INTO downloaded_files (session_id, chat_id, chat_name, message_id, file_name, file_path, file_type, file_size, file_unique_id, created_at)
+        VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10)
+        ON CONFLICT ON CONSTRAINT _downloaded_file_ref_uc DO NOTHING
+    ''',
+    "find_media_object": "SELECT object_name, file_size FROM media_objects WHERE file_unique_id = $1",
+    "insert_media_object": '''
+        INSERT INTO media_objects (file_unique_id, object_name, file_size, sha256, mime_type, created_at)
+        VALUES ($1, $2, $3, $4, $5, $6)
+        ON CONFLICT (file_unique_id) DO NOTHING
+        RETURNING object_name
+    ''',
+    "load_checkpoint": "SELECT last_message_id, pending_top_id, resume_offset_id, covered_from FROM dump_checkpoints WHERE session_id = $1 AND chat_id = $2",
+    "save_checkpoint": '''
+        INSERT INTO dump_checkpoints (session_id, chat_id, last_message_id, pending_top_id, resume_offset_id, covered_from, updated_at)
+        VALUES ($1, $2, $3, $4, $5, $6, $7)
+        ON CONFLICT ON CONSTRAINT _dump_checkpoint_uc DO UPDATE
+        SET last_message_id = EXCLUDED.last_message_id, pending_top_id = EXCLUDED.pending_top_id,
+            resume_offset_id = EXCLUDED.resume_offset_id, covered_from = EXCLUDED.covered_from, updated_at = EXCLUDED.updated_at
+    ''',
+    "update_dump_task": '''
+        UPDATE dump_tasks
+        SET status=$1, progress=$2, error_message=$3, total_messages=$4
+        WHERE id=$5
+    ''',
+}
+
+class WorkerConnection(asyncpg.Connection):
+    """Connection class that carries its own prepared statements for HOT_QUERIES."""
+    statements: dict
+
+class WorkerDatabase:
+    def __init__(self):
+        self._pool = None
+        self._pool_lock = None
+        self._reporter = None
+        self.acquires = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.in_use = 0
+        self.in_use_peak = 0
+
+    @staticmethod
+    async def _prepare(conn: WorkerConnection):
+        conn.statements = {}
+        for name, sql in HOT_QUERIES.items():
+            try: conn.statements[name] = await conn.prepare(sql)
+            except Exception as e: print(f"[DB POOL] Could not prepare {name}: {e}")
+
+    async def get_pool(self) -> asyncpg.Pool:
+        if self._pool is None:
+            if self._pool_lock is None: self._pool_lock = asyncio.Lock()
+            async with self._pool_lock:
+                if self._pool is None:
+                    dsn = settings.DATABASE_URL.replace("postgresql+asyncpg://", "postgresql://")
+                    self._pool = await asyncpg.create_pool(dsn, min_size=settings.WORKER_DB_POOL_MIN, max_size=settings.WORKER_DB_POOL_MAX,
+                                                           connection_class=WorkerConnection, init=self._prepare)
+                    self._reporter = asyncio.create_task(self._publish_metrics())
+        return self._pool
+
+    @asynccontextmanager
+    async def acquire(self):
+        pool = await self.get_pool()
+        started = time.monotonic()
+        async with pool.acquire() as conn:
+            waited = time.monotonic() - started
+            self.acquires += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+            self.in_use += 1
+            self.in_use_peak = max(self.in_use_peak, self.in_use)
+            try: yield conn
+            finally: self.in_use -= 1
+
+    async def run(self, conn, name: str, *args):
+        """Executes a HOT_QUERIES statement, falling back to an ad-hoc query if it could not be prepared."""
+        stmt = getattr(conn, "statements", {}).get(name)
+        if stmt: return await stmt.fetchval(*args)
+        return await conn.fetchval(HOT_QUERIES[name], *args)
+
+    async def fetchrow(self, conn, name: str, *args):
+        stmt = getattr(conn, "statements", {}).get(name)
+        if stmt: return await stmt.fetchrow(*args)
+        return await conn.fetchrow(HOT_QUERIES[name], *args)
+
+    async def run_many(self, conn, name: str, rows):
+        stmt = getattr(conn, "statements", {}).get(name)
+        if stmt: return await stmt.executemany(rows)
+        return await conn.executemany(HOT_QUERIES[name], rows)
+
+    def metrics(self) -> dict:
+        pool = self._pool
+        return {
+            "size": pool.get_size() if pool else 0,
+            "idle": pool.get_idle_size() if pool else 0,
+            "max_size": settings.WORKER_DB_POOL_MAX,
+            "in_use": self.in_use,
+            "in_use_peak": self.in_use_peak,
+            "acquires": self.acquires,
+            "acquire_wait_avg_ms": round(self.wait_total / self.acquires * 1000, 2) if self.acquires else 0,
+            "acquire_wait_max_ms": round(self.wait_max * 1000, 2),
+            "updated_at": time.time(),
+        }
+
+    async def _publish_metrics(self):
+        field = f"{socket.gethostname()}:{os.getpid()}"
+        while True:
+            try: await get_redis().hset(METRICS_KEY, field, json.dumps(self.metrics()))
+            except Exception as e: print(f"[DB POOL] Metrics publish failed: {e}")
+            await asyncio.sleep(settings.WORKER_METRICS_INTERVAL)
+
+    async def close(self):
+        if self._reporter: self._reporter.cancel()
+        if self._pool: await self._pool.close(); self._pool = None
+
+worker_db = WorkerDatabase()
+
+DUMPED_MESSAGE_COLUMNS = ('session_id', 'chat_id', 'chat_name', 'telegram_message_id', 'sender_id', 'sender_name',
+                          'sender_username', 'content', 'media_type', 'message_date', 'created_at')
+
+class DumpedMessageWriter:
+    """
+    Buffers dumped_messages rows and writes them in bulk: COPY into a per-connection staging
+    table, then one INSERT ... SELECT that applies the _unique_msg_uc conflict rule.
+    Flushes when `batch_size` rows are buffered or `flush_interval` seconds have passed.
+    """
+    def __init__(self, db: WorkerDatabase, batch_size: int, flush_interval: float):
+        self._db = db
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._rows = []
+        self._lock = asyncio.Lock()
+        self._timer = None
+        self.buffered_total = 0
+        self.inserted_total = 0
+
+    async def add(self, row: tuple):
+        self._rows.append(row)
+        self.buffered_total += 1
+        if self._timer is None: self._timer = asyncio.create_task(self._flush_periodically())
+        if len(self._rows) >= self._batch_size: await self.flush()
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self._flush_interval)
+            try: await self.flush()
+            except Exception as e: print(f"[DUMP WRITER] Periodic flush failed: {e}")
+
+    async def flush(self) -> int:
+        async with self._lock:
+            if not self._rows: return 0
+            rows = list(self._rows)
+            async with self._db.acquire() as conn:
+                async with conn.transaction():
+                    await conn.execute('''
+                        CREATE TEMP TABLE IF NOT EXISTS dumped_messages_stage (
+                            session_id INTEGER, chat_id VARCHAR(100), chat_name VARCHAR(255), telegram_message_id INTEGER,
+                            sender_id VARCHAR(100), sender_name VARCHAR(255), sender_username VARCHAR(255), content TEXT,
+                            media_type VARCHAR(50), message_date TIMESTAMP, created_at TIMESTAMP
+                        ) ON COMMIT DELETE ROWS
+                    ''')
+                    await conn.copy_records_to_table('dumped_messages_stage', records=rows, columns=DUMPED_MESSAGE_COLUMNS)
+                    cols = ", ".join(DUMPED_MESSAGE_COLUMNS)
+                    status = await conn.execute(f'''
+                        INSERT INTO dumped_messages ({cols})
+                        SELECT DISTINCT ON (session_id, chat_id, telegram_message_id) {cols} FROM dumped_messages_stage
+                        ON CONFLICT ON CONSTRAINT _unique_msg_uc DO NOTHING
+                    ''')
+            # Rows are only dropped from the buffer once the transaction has committed
+            del self._rows[:len(rows)]
+            inserted = int(status.split()[-1])
+            self.inserted_total += inserted
+            return inserted
+
+    async def close(self):
+        """Stops the flush timer and writes out whatever is still buffered."""
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        await self.flush()
+
+async def read_pool_metrics(max_age: float = 60) -> dict:
+    """Collects the latest pool metrics published by each live worker process."""
+    raw = await get_redis().hgetall(METRICS_KEY)
+    now = time.time(); result = {}; stale = []
+    for worker, payload in raw.items():
+        data = json.loads(payload)
+        if now - data.get("updated_at", 0) <= max_age: result[worker] = data
+        else: stale.append(worker)
+    if stale: await get_redis().hdel(METRICS_KEY, *stale)
+    return result
@@ -0,0 +1,109 @@
+"""
+WebSocket fan-out where publishers never wait on a socket. Each subscriber has a bounded send queue
+drained by its own writer task, payloads are serialized once and shared, and a configurable policy
+decides what happens when a subscriber falls behind:
+  drop_oldest - discard the oldest queued message to make room (default)
+  drop_newest - discard the incoming message
+  sample      - past half full, deliver only every WS_SAMPLE_EVERY-th message; drop the newest when full
+  disconnect  - close the slow subscriber
+"""
+from fastapi import WebSocket
+from typing import Dict, Optional, Set
+import asyncio
+import time
+from app.config import settings
+
+POLICIES = ("drop_oldest", "drop_newest", "sample", "disconnect")
+
+class Subscriber:
+    def __init__(self, key: int, ws: WebSocket, queue_size: int):
+        self.key = key
+        self.ws = ws
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.writer: Optional[asyncio.Task] = None
+        self.sent = 0
+        self.dropped = 0
+        self.offered = 0
+        self.last_lag_ms = 0.0
+        self.max_lag_ms = 0.0
+
+    def stats(self) -> dict:
+        return {'queued': self.queue.qsize(), 'sent': self.sent, 'dropped': self.dropped,
+                'last_lag_ms': self.last_lag_ms, 'max_lag_ms': self.max_lag_ms}
+
+class FanoutHub:
+    def __init__(self, queue_size: int = None, policy: str = None, sample_every: int = None):
+        self.queue_size = queue_size or settings.WS_SEND_QUEUE_SIZE
+        self.policy = policy or settings.WS_SLOW_CONSUMER_POLICY
+        if self.policy not in POLICIES: self.policy = "drop_oldest"
+        self.sample_every = max(sample_every or settings.WS_SAMPLE_EVERY, 1)
+        self._subscribers: Dict[int, Set[Subscriber]] = {}
+        self.published = 0
+        self.dropped = 0
+        self.disconnected_slow = 0
+
+    def subscribe(self, key: int, ws: WebSocket) -> Subscriber:
+        sub = Subscriber(key, ws, self.queue_size)
+        self._subscribers.setdefault(key, set()).add(sub)
+        sub.writer = asyncio.create_task(self._write(sub))
+        return sub
+
+    def unsubscribe(self, sub: Subscriber):
+        subs = self._subscribers.get(sub.key)
+        if subs:
+            subs.discard(sub)
+            if not subs: del self._subscribers[sub.key]
+        if sub.writer and sub.writer is not asyncio.current_task(): sub.writer.cancel()
+
+    def publish(self, keys, text: str):
+        """Queues an already-serialized payload for every subscriber of `keys`; never awaits a socket."""
+        self.published += 1
+        now = time.monotonic()
+        for key in keys:
+            for sub in list(self._subscribers.get(key, ())): self._offer(sub, text, now)
+
+    def _offer(self, sub: Subscriber, text: str, now: float):
+        sub.offered += 1
+        queue = sub.queue
+        if self.policy == "sample" and queue.qsize() >= queue.maxsize // 2 and sub.offered % self.sample_every:
+            self._drop(sub); return
+        if queue.full():
+            if self.policy == "disconnect":
+                self.disconnected_slow += 1
+                self.unsubscribe(sub)
+                asyncio.create_task(self._close(sub.ws))
+                return
+            self._drop(sub)
+            if self.policy != "drop_oldest": return
+            queue.get_nowait()
+        queue.put_nowait((text, now))
+
+    def _drop(self, sub: Subscriber):
+        sub.dropped += 1; self.dropped += 1
+
+    async def _write(self, sub: Subscriber):
+        try:
+            while True:
+                text, queued_at = await sub.queue.get()
+                await sub.ws.send_text(text)
+                sub.sent += 1
+                sub.last_lag_ms = round((time.monotonic() - queued_at) * 1000, 1)
+                sub.max_lag_ms = max(sub.max_lag_ms, sub.last_lag_ms)
+        except asyncio.CancelledError: raise
+        except Exception: self.unsubscribe(sub)
+
+    async def _close(self, ws: WebSocket):
+        try: await ws.close(code=1013)  # try again later
+        except Exception: pass
+
+    def stats(self) -> dict:
+        subs = [sub for group in self._subscribers.values() for sub in group]
+        return {
+            'policy': self.policy, 'queue_size': self.queue_size, 'published': self.published,
+            'subscribers': len(subs), 'disconnected_slow': self.disconnected_slow,
+            'dropped': self.dropped,
+            'max_lag_ms': max((s.max_lag_ms for s in subs), default=0),
+            'by_key': {str(key): [s.stats() for s in group] for key, group in self._subscribers.items()},
+        }
+
+live_feed = FanoutHub()
@@ -8,7 +8,9 @@ from alembic import context
 
 from app.config import settings
 from app.database import Base
-from app.models import * config = context.config
+from app.models import *
+
+config = context.config
 
 if config.config_file_name is not None:
     fileConfig(config.config_file_name)
@@ -1,7 +1,7 @@
 import { useState, useEffect } from 'react';
 import { motion } from 'framer-motion';
 import { Radio, Send, Plus, X } from 'lucide-react';
-import { broadcasterAPI, telegramAPI } from '../services/api';
+import { broadcasterAPI, telegramAPI, watchTask } from '../services/api';
 import type { TelegramSession } from '../types';
 import ChatSelector from '../components/ChatSelector';
 import CustomSelect from '../components/CustomSelect';
@@ -23,10 +23,7 @@ export default function Broadcaster() {
 
   useEffect(() => {
     if (taskId) {
-      const interval = setInterval(() => {
-        checkTaskStatus();
-      }, 1000);
-      return () => clearInterval(interval);
+      return watchTask(taskId, () => broadcasterAPI.getStatus(taskId), handleTaskStatus);
     }
   }, [taskId]);
 
@@ -42,19 +39,12 @@ export default function Broadcaster() {
     }
   };
 
-  const checkTaskStatus = async () => {
-    if (!taskId) return;
+  const handleTaskStatus = (statusData: any) => {
+    setStatus(statusData);
 
-    try {
-      const statusData = await broadcasterAPI.getStatus(taskId);
-      setStatus(statusData);
-
-      if (statusData.status === 'SUCCESS' || statusData.status === 'FAILURE') {
-        setBroadcasting(false);
-        setTaskId(null);
-      }
-    } catch (error) {
-      console.error('Failed to check task status:', error);
+    if (statusData.status === 'SUCCESS' || statusData.status === 'FAILURE' || statusData.status === 'REVOKED') {
+      setBroadcasting(false);
+      setTaskId(null);
     }
   };
 
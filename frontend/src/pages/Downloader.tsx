@@ -1,7 +1,7 @@
 import { useState, useEffect, useRef } from 'react';
 import { motion } from 'framer-motion';
 import { Download, Terminal, Square, HardDrive, Trash2 } from 'lucide-react';
-import { downloaderAPI, telegramAPI } from '../services/api';
+import { downloaderAPI, telegramAPI, watchTask } from '../services/api';
 import type { TelegramSession } from '../types';
 import ChatSelector from '../components/ChatSelector';
 import { useDownloadStore } from '../store/downloadStore';
@@ -23,12 +23,8 @@ export default function Downloader() {
   useEffect(() => { loadSessions(); }, []);
 
   useEffect(() => {
-    let interval: any;
-    if (taskId) {
-      checkTaskStatus();
-      interval = setInterval(checkTaskStatus, 1000);
-    }
-    return () => { if (interval) clearInterval(interval); };
+    if (!taskId) return;
+    return watchTask(taskId, () => downloaderAPI.getTaskStatus(taskId), handleTaskStatus);
   }, [taskId]);
 
   useEffect(() => {
@@ -45,25 +41,22 @@ export default function Downloader() {
     } catch (error) { console.error(error); }
   };
 
-  const checkTaskStatus = async () => {
-    if (!taskId) return;
-    try {
-      const status = await downloaderAPI.getTaskStatus(taskId);
-      if (status.status === 'PROGRESS' && status.info?.status) {
-        const lastLog = logs[logs.length - 1];
-        if (!lastLog || !lastLog.includes(status.info.status)) {
-             addLog(status.info.status);
-        }
+  const handleTaskStatus = (status: any) => {
+    if (status.status === 'PROGRESS' && status.info?.status) {
+      const logs = useDownloadStore.getState().logs;
+      const lastLog = logs[logs.length - 1];
+      if (!lastLog || !lastLog.includes(status.info.status)) {
+           addLog(status.info.status);
       }
-      if (status.info?.progress !== undefined) setProgress(status.info.progress);
-      if (status.status === 'SUCCESS') {
-        setIsDownloading(false); setTaskId(null);
-        addLog(status.info?.message || 'Completed successfully'); addLog('--------------------------------');
-      } else if (status.status === 'FAILURE') {
-        setIsDownloading(false); setTaskId(null);
-        addLog(`ERROR: ${status.info?.error || 'Worker crashed'}`); addLog('--------------------------------');
-      }
-    } catch (error) { console.error(error); }
+    }
+    if (status.info?.progress !== undefined) setProgress(status.info.progress);
+    if (status.status === 'SUCCESS') {
+      setIsDownloading(false); setTaskId(null);
+      addLog(status.info?.message || 'Completed successfully'); addLog('--------------------------------');
+    } else if (status.status === 'FAILURE' || status.status === 'REVOKED') {
+      setIsDownloading(false); setTaskId(null);
+      addLog(`ERROR: ${status.info?.error || (status.status === 'REVOKED' ? 'Cancelled' : 'Worker crashed')}`); addLog('--------------------------------');
+    }
   };
 
   const handleStartDownload = async () => {
@@ -229,7 +229,7 @@ export default function LiveFeed() {
                     {messages.length === 0 && !loading && (<div className="flex flex-col items-center justify-center h-64 text-gray-500"><MessageSquare size={48} className="mb-2 opacity-50" /><p>No messages found</p></div>)}
 
                     {messages.map((msg, idx) => (
-                        <motion.div key={`${msg.id}-${idx}`} initial={{ opacity: 0, y: 10 }} animate={{ opacity: 1, y: 0 }} className="flex gap-4 group hover:bg-gray-800/30 p-2 rounded-lg transition-colors">
+                        <motion.div key={`${msg.chat_id}-${msg.telegram_message_id}-${idx}`} initial={{ opacity: 0, y: 10 }} animate={{ opacity: 1, y: 0 }} className="flex gap-4 group hover:bg-gray-800/30 p-2 rounded-lg transition-colors">
                             <div className={`w-10 h-10 rounded-full flex items-center justify-center font-bold text-sm flex-shrink-0 cursor-pointer hover:ring-2 ring-blue-500 transition-all ${getAvatarColor(msg.sender_name || 'U')}`} onClick={() => setSelectedUser(msg)}>{getInitials(msg.sender_name || 'U')}</div>
                             <div className="flex-1 min-w-0">
                                 <div className="flex items-baseline gap-2 mb-1 min-w-0">
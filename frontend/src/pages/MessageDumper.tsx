@@ -1,7 +1,7 @@
 import { useState, useEffect, useRef } from 'react';
 import { motion } from 'framer-motion';
 import { Terminal, Square, Play, Zap, Trash2, Calendar } from 'lucide-react';
-import { dumperAPI, telegramAPI } from '../services/api';
+import { dumperAPI, telegramAPI, watchTask } from '../services/api';
 import { useDumperStore } from '../store/dumperStore';
 import CustomSelect from '../components/CustomSelect';
 import ChatSelector from '../components/ChatSelector';
@@ -28,21 +28,14 @@ export default function MessageDumper() {
   }, []);
 
   useEffect(() => {
-    let interval: any;
-    if (taskId) {
-        const check = async () => {
-            try {
-                const s = await dumperAPI.getStatus(taskId);
-                if (s.status === 'PROGRESS' && s.info?.status) addLog(s.info.status);
-                if (s.info?.progress !== undefined) setProgress(s.info.progress);
-                if (s.status === 'SUCCESS') { setIsDumping(false); setTaskId(null); addLog(s.info?.message || 'Done'); }
-                else if (s.status === 'FAILURE') { setIsDumping(false); setTaskId(null); addLog(`ERROR: ${s.info?.error}`); }
-            } catch {}
-        };
-        check();
-        interval = setInterval(check, 1000);
-    }
-    return () => clearInterval(interval);
+    if (!taskId) return;
+    return watchTask(taskId, () => dumperAPI.getStatus(taskId), (s: any) => {
+        if (s.status === 'PROGRESS' && s.info?.status) addLog(s.info.status);
+        if (s.info?.progress !== undefined) setProgress(s.info.progress);
+        if (s.status === 'SUCCESS') { setIsDumping(false); setTaskId(null); addLog(s.info?.message || 'Done'); }
+        else if (s.status === 'FAILURE') { setIsDumping(false); setTaskId(null); addLog(`ERROR: ${s.info?.error}`); }
+        else if (s.status === 'REVOKED') { setIsDumping(false); setTaskId(null); addLog('Stopped'); }
+    });
   }, [taskId]);
 
   useEffect(() => {
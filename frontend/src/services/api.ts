@@ -61,6 +61,25 @@ export const storageAPI = {
   deleteAllFiles: async () => (await api.delete('/storage/files/all')).data,
 };
 
+// Streams {task_id, status, info} progress events until the task ends; falls back to polling if the socket drops
+export const watchTask = (taskId: string, poll: () => Promise<any>, onStatus: (status: any) => void) => {
+  const isFinal = (s: any) => ['SUCCESS', 'FAILURE', 'REVOKED'].includes(s?.status);
+  let stopped = false; let finished = false; let timer: any;
+  const startPolling = () => {
+    const tick = async () => {
+      if (stopped) return;
+      try { const s = await poll(); onStatus(s); if (isFinal(s)) return; } catch (error) { console.error(error); }
+      timer = setTimeout(tick, 2000);
+    };
+    tick();
+  };
+  const token = encodeURIComponent(localStorage.getItem('access_token') || '');
+  const ws = new WebSocket(API_URL.replace('http', 'ws') + `/tasks/ws/${taskId}?token=${token}`);
+  ws.onmessage = (event) => { const s = JSON.parse(event.data); if (isFinal(s)) finished = true; onStatus(s); };
+  ws.onclose = () => { if (!stopped && !finished) startPolling(); };
+  return () => { stopped = true; clearTimeout(timer); ws.close(); };
+};
+
 export const dumperAPI = {
   startDump: async (data: any) => (await api.post('/dumper/start', data)).data,
   triggerAutoDump: async () => (await api.post('/dumper/auto-dump')).data,